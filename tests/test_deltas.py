@@ -0,0 +1,24 @@
+import pyarrow as pa
+
+from trading_data.deltas import merge_arrow_tables
+
+
+def make_table(ts: list, volume: pa.Array) -> pa.Table:
+    return pa.table({'ts': pa.array(ts, type=pa.timestamp('ns')), 'volume': volume})
+
+
+def test_merge_widens_a_downcast_base():
+    # the base volume was downcast to integers by a storage profile, the delta is fractional
+    base = make_table([0, 60, 120], pa.array([1, 2, 3], type=pa.int32()))
+    delta = make_table([120, 180], pa.array([0.5, 1.5], type=pa.float64()))
+    merged = merge_arrow_tables([base, delta])
+    assert merged.schema.field('volume').type == pa.float64()
+    assert merged.column('volume').to_pylist() == [1.0, 2.0, 0.5, 1.5]
+
+
+def test_merge_keeps_the_base_type_of_narrower_deltas():
+    base = make_table([0, 60], pa.array([1.0, 2.0], type=pa.float64()))
+    delta = make_table([60], pa.array([5], type=pa.int32()))
+    merged = merge_arrow_tables([base, delta])
+    assert merged.schema.field('volume').type == pa.float64()
+    assert merged.column('volume').to_pylist() == [1.0, 5.0]
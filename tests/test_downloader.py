@@ -0,0 +1,145 @@
+import time
+import threading
+import http.server
+
+import pytest
+import requests
+
+from trading_data.downloader import HTTPDownloader, RateLimiter
+
+
+CONTENT = bytes(range(256)) * 64
+
+
+class ScriptedHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve `CONTENT` with range support, after the (status, headers) responses scripted per path are used up.
+    """
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        script = self.server.scripts.get(self.path, [])
+        if len(script) > 0:
+            status, headers = script.pop(0)
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            # REMINDER: an unread body keeps the connection busy until the response is closed
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        offset = 0
+        if 'Range' in self.headers:
+            offset = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if offset >= len(CONTENT):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(CONTENT)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT) - offset))
+        self.end_headers()
+        self.wfile.write(CONTENT[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    server.requests = []
+    server.scripts = {}
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_pool(downloader: HTTPDownloader, url: str):
+    # the connection pool of the (single) host of the downloader session
+    poolmanager = downloader.session.get_adapter(url).poolmanager
+    return poolmanager.pools[list(poolmanager.pools.keys())[0]]
+
+
+def test_retry_after_is_honored(server):
+    server.scripts['/file'] = [(429, {'Retry-After': '1'}), (503, {'Retry-After': '0'})]
+    downloader = HTTPDownloader(max_retries=3, backoff_factor=0)
+    start = time.monotonic()
+    assert downloader.fetch(f'{server.url}/file') == CONTENT
+    assert len(server.requests) == 3
+    assert time.monotonic() - start >= 1
+
+
+def test_gives_up_after_max_retries(server):
+    server.scripts['/file'] = [(503, {})] * 10
+    downloader = HTTPDownloader(max_retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError):
+        downloader.fetch(f'{server.url}/file')
+    assert len(server.requests) == 3
+
+
+def test_missing_resource_is_not_retried(server):
+    downloader = HTTPDownloader(max_retries=3, backoff_factor=0)
+    assert downloader.stream(f'{server.url}/missing', lambda f: f.read()) is None
+    assert len(server.requests) == 1
+    pool = get_pool(downloader, server.url)
+    assert pool.pool.qsize() == pool.pool.maxsize
+
+
+def test_throttled_streams_release_their_connections(server):
+    # a throttled response that is not closed keeps its pooled connection checked out
+    server.scripts['/file'] = [(429, {'Retry-After': '0'})] * 20
+    downloader = HTTPDownloader(max_concurrency_per_host=1, max_retries=20, backoff_factor=0)
+    assert downloader.stream(f'{server.url}/file', lambda f: f.read()) == CONTENT
+    assert len(server.requests) == 21
+    pool = get_pool(downloader, server.url)
+    # every attempt reused the same connection
+    assert pool.num_connections == 1
+    assert pool.pool.qsize() == pool.pool.maxsize
+
+
+def test_download_resumes_from_the_part_file(server, tmp_path):
+    file_path = str(tmp_path / 'file')
+    with open(f'{file_path}.part', 'wb') as f:
+        f.write(CONTENT[:1000])
+    downloader = HTTPDownloader(backoff_factor=0)
+    assert downloader.download(f'{server.url}/file', file_path) == file_path
+    with open(file_path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert server.requests[-1][1]['Range'] == 'bytes=1000-'
+
+
+def test_download_of_a_complete_part_file(server, tmp_path):
+    file_path = str(tmp_path / 'file')
+    with open(f'{file_path}.part', 'wb') as f:
+        f.write(CONTENT)
+    downloader = HTTPDownloader(backoff_factor=0)
+    # the server answers 416 to a range past the end
+    assert downloader.download(f'{server.url}/file', file_path) == file_path
+    with open(file_path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert len(server.requests) == 1
+    pool = get_pool(downloader, server.url)
+    assert pool.pool.qsize() == pool.pool.maxsize
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        rate_limiter.acquire()
+    # the first request uses the burst, the next 5 wait 1/50s each
+    assert time.monotonic() - start >= 5 / 50 * 0.9
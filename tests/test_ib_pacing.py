@@ -0,0 +1,70 @@
+from trading_data.ib_pacing import PacingLimiter, format_duration, get_max_duration, plan_chunks, project_wall_time
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_contract_window():
+    limiter = PacingLimiter()
+    # no 6 requests for the same contract within 2 seconds
+    assert [limiter.reserve('AAPL', 0.0) for _ in range(6)] == [0.0] * 5 + [2.0]
+
+
+def test_requests_are_scheduled_in_order():
+    limiter = PacingLimiter()
+    for _ in range(6):
+        limiter.reserve('AAPL', 0.0)
+    # another contract is not delayed by the AAPL window, but is not sent before the requests reserved earlier
+    assert limiter.reserve('MSFT', 0.0) == 2.0
+    assert limiter.reserve('MSFT', 3.0) == 3.0
+
+
+def test_small_bar_window():
+    limiter = PacingLimiter.for_bar_size('5 secs')
+    times = [limiter.reserve(i, 0.0) for i in range(200)]
+    assert times[:60] == [0.0] * 60
+    assert times[60] == 600.0
+    # no sliding window of 10 minutes ever holds more than 60 requests
+    assert all(times[i + 60] - times[i] >= 600 for i in range(len(times) - 60))
+
+
+def test_large_bars_have_no_global_window():
+    limiter = PacingLimiter.for_bar_size('1 min')
+    assert [limiter.reserve(i, 0.0) for i in range(100)] == [0.0] * 100
+
+
+def test_acquire_sleeps_until_the_reserved_time():
+    clock = FakeClock()
+    limiter = PacingLimiter(clock=clock, sleep=clock.sleep)
+    for _ in range(6):
+        limiter.acquire('AAPL')
+    assert clock.sleeps == [2.0]
+    assert clock.now == 2.0
+
+
+def test_plan_chunks():
+    assert get_max_duration('1 min') == 86400
+    assert format_duration(3600) == '3600 S'
+    assert format_duration(2 * 86400) == '2 D'
+    # walked backwards from the end, only the first chunk is partial
+    assert plan_chunks('2024-01-01 12:00', '2024-01-03', '1 min') == [
+        ('20240102-00:00:00', '43200 S'),
+        ('20240103-00:00:00', '1 D'),
+    ]
+
+
+def test_project_wall_time():
+    # 120 small bar requests: 60 at once, the next 60 after 10 minutes, each answered in 2 seconds
+    assert project_wall_time(list(range(120)), '5 secs', max_in_flight=100, latency=2.0) == 602.0
+    # the requests in flight bound the throughput without pacing rules
+    assert project_wall_time(list(range(8)), '1 day', max_in_flight=4, latency=2.0) == 4.0
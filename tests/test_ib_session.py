@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip('ibapi')
+
+from ibapi.common import BarData
+from ibapi.contract import Contract
+
+from trading_data.ib_session import HISTORICAL_DATA_ERROR_CODE, TIMEOUT_ERROR_CODE, IBSession
+
+
+def make_contract(symbol: str) -> Contract:
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = 'STK'
+    contract.exchange = 'SMART'
+    contract.currency = 'USD'
+    return contract
+
+
+def make_bar(date: str, price: float) -> BarData:
+    bar = BarData()
+    bar.date = date
+    bar.open, bar.high, bar.low, bar.close = price, price, price, price
+    bar.volume = 100
+    return bar
+
+
+def make_session(answer=None, **kwargs) -> tuple:
+    """
+    A session whose app is not connected, the sent requests are recorded and answered by `answer(app, req_id)` if any.
+    The callbacks are driven directly, as the message loop thread would.
+    """
+    session = IBSession(pacing=False, **kwargs)
+    session.app = session._create_app()
+    sent = []
+
+    def reqHistoricalData(reqId, **kwargs):
+        sent.append(reqId)
+        if answer is not None:
+            answer(session.app, reqId, len(sent))
+
+    session.app.reqHistoricalData = reqHistoricalData
+    session.app.cancelHistoricalData = lambda reqId: None
+    return session, sent
+
+
+def get_free_slots(session: IBSession) -> int:
+    n = 0
+    while session._slots.acquire(blocking=False):
+        n += 1
+    for _ in range(n):
+        session._slots.release()
+    return n
+
+
+def test_bars_are_routed_by_req_id():
+    session, sent = make_session(max_in_flight=4)
+    first = session.request_historical_data(make_contract('AAPL'), '20240103-00:00:00', '1 D', '1 min')
+    second = session.request_historical_data(make_contract('MSFT'), '20240103-00:00:00', '1 D', '1 min')
+    assert sent == [first.req_id, second.req_id]
+    assert get_free_slots(session) == 2
+
+    session.app.historicalData(second.req_id, make_bar('20240102 09:30:00 US/Eastern', 2.0))
+    session.app.historicalData(first.req_id, make_bar('20240102 09:30:00 US/Eastern', 1.0))
+    session.app.historicalData(second.req_id, make_bar('20240102 09:31:00 US/Eastern', 3.0))
+    session.app.historicalDataEnd(second.req_id, '', '')
+
+    assert second.done.is_set() and second.error is None
+    assert not first.done.is_set()
+    assert get_free_slots(session) == 3
+    df = second.to_frame()
+    assert df['close'].tolist() == [2.0, 3.0]
+    assert df.index.name == 'ts' and str(df.index[0]) == '2024-01-02 09:30:00'
+    assert len(first.dates) == 1
+
+
+def test_error_finishes_the_request_and_releases_its_slot():
+    session, _ = make_session(max_in_flight=1)
+    request = session.request_historical_data(make_contract('AAPL'), '20240103-00:00:00', '1 D', '1 min')
+    assert get_free_slots(session) == 0
+
+    # notifications do not finish the requests
+    session.app.error(request.req_id, 2104, 'Market data farm connection is OK:usfarm')
+    assert not request.done.is_set()
+
+    session.app.error(request.req_id, HISTORICAL_DATA_ERROR_CODE, 'Historical Market Data Service error message:HMDS query returned no data')
+    assert request.done.is_set()
+    assert request.error[0] == HISTORICAL_DATA_ERROR_CODE
+    assert get_free_slots(session) == 1
+
+    # a late end of the same request does not release its slot twice
+    session.app.historicalDataEnd(request.req_id, '', '')
+    assert get_free_slots(session) == 1
+
+
+def test_connection_loss_finishes_all_requests():
+    session, _ = make_session(max_in_flight=4)
+    requests = [session.request_historical_data(make_contract(symbol), '20240103-00:00:00', '1 D', '1 min') for symbol in ['AAPL', 'MSFT']]
+    session.app.error(-1, 1100, 'Connectivity between IB and Trader Workstation has been lost.')
+    assert all(request.done.is_set() and request.error[0] == 1100 for request in requests)
+    assert get_free_slots(session) == 4
+
+
+def test_unanswered_request_times_out():
+    session, _ = make_session(max_in_flight=1, request_timeout=0.1)
+    request = session.wait(session.request_historical_data(make_contract('AAPL'), '20240103-00:00:00', '1 D', '1 min'))
+    assert request.error[0] == TIMEOUT_ERROR_CODE
+    assert get_free_slots(session) == 1
+
+
+def test_fetch_chunks_retries_pacing_violations():
+    def answer(app, req_id, n_sent):
+        if n_sent == 1:
+            app.error(req_id, HISTORICAL_DATA_ERROR_CODE, 'Historical Market Data Service error message:Historical data request pacing violation')
+        elif n_sent == 2:
+            app.error(req_id, HISTORICAL_DATA_ERROR_CODE, 'Historical Market Data Service error message:HMDS query returned no data')
+        else:
+            app.historicalData(req_id, make_bar('20240102 09:30:00', float(n_sent)))
+            app.historicalDataEnd(req_id, '', '')
+
+    session, sent = make_session(answer, max_in_flight=2, retry_backoff=0)
+    items = [('AAPL', make_contract('AAPL'), '20240103-00:00:00', '1 D'), ('MSFT', make_contract('MSFT'), '20240103-00:00:00', '1 D')]
+    frames = session.fetch_chunks(items, '1 min')
+    # AAPL was sent again after the pacing violation, MSFT had no data and was not
+    assert len(sent) == 3
+    assert len(frames['AAPL']) == 1 and frames['AAPL'][0]['close'].tolist() == [3.0]
+    assert frames['MSFT'] == []
+    assert get_free_slots(session) == 2
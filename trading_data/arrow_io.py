@@ -0,0 +1,140 @@
+import typing
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+def read_arrow_table(file_path: str, columns: typing.List[str]=None, filters: typing.List[tuple]=None) -> pa.Table:
+    # memory map the file so that the raw pages are not copied into a read buffer first
+    return pq.read_table(file_path, columns=columns, filters=filters, memory_map=True, use_pandas_metadata=False)
+
+
+def select_row_groups(parquet_file: pq.ParquetFile, start_date=None, end_date=None) -> typing.List[int]:
+    """
+    Select the row groups whose ts statistics overlap [start_date, end_date].
+    """
+    metadata = parquet_file.metadata
+    row_groups = list(range(metadata.num_row_groups))
+    if start_date is None and end_date is None:
+        return row_groups
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    if 'ts' not in names:
+        return row_groups
+    ts_idx = names.index('ts')
+    start = pd.Timestamp(start_date) if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+    selected = []
+    for rg in row_groups:
+        stats = metadata.row_group(rg).column(ts_idx).statistics
+        if stats is None or not stats.has_min_max:
+            selected.append(rg)
+            continue
+        if start is not None and pd.Timestamp(stats.max) < start:
+            continue
+        if end is not None and pd.Timestamp(stats.min) > end:
+            continue
+        selected.append(rg)
+    return selected
+
+
+def iter_arrow_batches(file_path: str, columns: typing.List[str]=None, batch_size: int=65536, start_date=None, end_date=None) -> typing.Iterator[pa.RecordBatch]:
+    parquet_file = pq.ParquetFile(file_path, memory_map=True)
+    row_groups = select_row_groups(parquet_file, start_date, end_date)
+    if len(row_groups) == 0:
+        return
+    yield from parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=columns, use_pandas_metadata=False)
+
+
+def filter_by_date_range(table: typing.Union[pa.Table, pa.RecordBatch], start_date=None, end_date=None):
+    if start_date is None and end_date is None:
+        return table
+    filters = []
+    if start_date is not None:
+        filters.append(('ts', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(('ts', '<=', pd.Timestamp(end_date)))
+    return apply_filters(table, filters)
+
+
+FILTER_OPS = {
+    '>=': pc.greater_equal,
+    '>': pc.greater,
+    '<=': pc.less_equal,
+    '<': pc.less,
+    '==': pc.equal,
+}
+
+
+def apply_filters(table: typing.Union[pa.Table, pa.RecordBatch], filters: typing.List[tuple]=None):
+    """
+    Apply `read_parquet` style filters, e.g. [('ts', '>=', start), ('ts', '<', end)], to a table or batch.
+    """
+    if not filters:
+        return table
+    mask = None
+    for column, op, value in filters:
+        condition = FILTER_OPS[op](table[column], pa.scalar(value, type=table.schema.field(column).type))
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return table.filter(mask)
+
+
+def concat_tables(tables: typing.List[pa.Table]) -> pa.Table:
+    """
+    Concatenate tables whose schemas may differ, e.g. partitions written before columns were added.
+    The missing columns are filled with nulls.
+    """
+    if all(table.schema.equals(tables[0].schema) for table in tables[1:]):
+        return pa.concat_tables(tables)
+    schema = pa.unify_schemas([table.schema for table in tables])
+    aligned = []
+    for table in tables:
+        for field in schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(table.num_rows, type=field.type))
+        aligned.append(table.select(schema.names).cast(schema))
+    return pa.concat_tables(aligned)
+
+
+def estimate_row_bytes(file_path: str, columns: typing.List[str]=None) -> int:
+    """
+    Estimate the decoded size of a row from the schema, variable width columns are counted as 32 bytes.
+    """
+    schema = pq.read_schema(file_path)
+    row_bytes = 0
+    for field in schema:
+        if columns is not None and field.name not in columns:
+            continue
+        try:
+            row_bytes += max(field.type.bit_width // 8, 1)
+        except ValueError:
+            row_bytes += 32
+    return max(row_bytes, 1)
+
+
+def to_pandas(table: typing.Union[pa.Table, pa.RecordBatch], set_index: bool=False) -> pd.DataFrame:
+    """
+    Convert an arrow table to pandas. Each column gets its own block (`split_blocks`) so numeric columns
+    without nulls can be wrapped instead of being consolidated into a 2D copy.
+    """
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    df = table.to_pandas(split_blocks=True, ignore_metadata=True)
+    if set_index and 'ts' in df.columns:
+        df = df.set_index('ts')
+    return df
+
+
+def to_numpy(table: typing.Union[pa.Table, pa.RecordBatch], column: str) -> np.ndarray:
+    """
+    Get a column as a numpy array, zero-copy if the column is a single chunk of a primitive type without nulls.
+    """
+    array = table.column(column)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.chunk(0) if array.num_chunks == 1 else array.combine_chunks()
+    try:
+        return array.to_numpy(zero_copy_only=True)
+    except pa.ArrowInvalid:
+        return array.to_numpy(zero_copy_only=False)
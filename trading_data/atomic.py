@@ -0,0 +1,99 @@
+import os
+import uuid
+import zlib
+import threading
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+N_LOCK_STRIPES = 64  # number of lock files per data source, partitions are hashed onto them
+
+_file_locks = {}  # lock_path -> [threading.RLock, depth, fd]
+_file_locks_guard = threading.Lock()
+
+
+def fsync_dir(dir_path: str):
+    # persist a rename, not supported on every platform
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_write_path(file_path: str, commit_lock=None):
+    """
+    Yield a temporary path next to `file_path` to write to. On success the temporary file is fsynced and renamed
+    over `file_path`, so readers see either the old or the new file but never a half-written one.
+    `commit_lock` (a context manager) is only held around the rename, e.g. for files written over a long time.
+    """
+    dir_path = os.path.dirname(file_path) or '.'
+    tmp_file_path = os.path.join(dir_path, f'.{os.path.basename(file_path)}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        yield tmp_file_path
+        fd = os.open(tmp_file_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with commit_lock if commit_lock is not None else nullcontext():
+            os.replace(tmp_file_path, file_path)
+            fsync_dir(dir_path)
+    finally:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+
+
+def _lock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Exclusive lock across processes (on a lock file) and threads. The lock is reentrant within a thread.
+    """
+    with _file_locks_guard:
+        entry = _file_locks.setdefault(lock_path, [threading.RLock(), 0, None])
+    with entry[0]:
+        if entry[1] == 0:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _lock_fd(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+            entry[2] = fd
+        entry[1] += 1
+        try:
+            yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                fd, entry[2] = entry[2], None
+                _unlock_fd(fd)
+                os.close(fd)
+
+
+def get_stripe_lock_path(lock_dir: str, key: str) -> str:
+    # REMINDER: crc32 is stable across processes, unlike `hash`
+    return os.path.join(lock_dir, f'{zlib.crc32(key.encode()) % N_LOCK_STRIPES:02d}.lock')
@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import typing
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from trading_data.deltas import list_delta_files
+
+
+PARTITION_COLUMNS = [
+    'ver_name',
+    'file_name',
+    'asset_type',
+    'ticker',
+    'partition',
+    'row_count',
+    'min_ts',
+    'max_ts',
+    'byte_size',
+    'checksum',
+    'updated_at',
+]
+
+
+def compute_checksum(file_path: str, chunk_size: int=1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def format_ts(ts) -> typing.Optional[str]:
+    if ts is None or pd.isna(ts):
+        return None
+    return pd.Timestamp(ts).isoformat(sep=' ')
+
+
+def parse_partition_filename(file_name: str, asset_types: typing.List[str]) -> typing.Optional[tuple]:
+    """
+    Parse `{asset_type}_{ticker}[_{partition}]_historical_data.parquet` into (asset_type, ticker, partition).
+    `partition` is an empty string for files that are not partitioned (e.g. day_bar).
+    """
+    pattern = '|'.join(re.escape(asset_type) for asset_type in sorted(asset_types, key=len, reverse=True))
+    match = re.fullmatch(rf"({pattern})_(.+?)(?:_(\d{{4}}(?:-\d{{2}}){{0,2}}))?_historical_data\.parquet", file_name)
+    if match is None:
+        return None
+    return match.group(1), match.group(2), match.group(3) or ''
+
+
+def describe_partition(file_path: str, asset_type: str, ticker: str, ver_name: str, partition: str='', data: pd.DataFrame=None) -> dict:
+    """
+    Describe a partition file for the catalog. The row count and ts range are taken from `data`
+    if it is given, otherwise from the parquet footers of the file and its deltas (the row count
+    is then an upper bound until the deltas are folded).
+    """
+    if data is not None:
+        ts = data.index if 'ts' not in data.columns else data['ts']
+        row_count = len(data)
+        min_ts, max_ts = (ts.min(), ts.max()) if row_count > 0 else (None, None)
+    else:
+        row_count, min_ts, max_ts = read_footer_stats(file_path)
+        for delta_file_path in list_delta_files(file_path):
+            delta_row_count, delta_min_ts, delta_max_ts = read_footer_stats(delta_file_path)
+            row_count += delta_row_count
+            min_ts = min(ts for ts in [min_ts, delta_min_ts] if ts is not None) if delta_min_ts is not None or min_ts is not None else None
+            max_ts = max(ts for ts in [max_ts, delta_max_ts] if ts is not None) if delta_max_ts is not None or max_ts is not None else None
+    return {
+        'ver_name': ver_name,
+        'file_name': os.path.basename(file_path),
+        'asset_type': asset_type,
+        'ticker': ticker,
+        'partition': partition or '',
+        'row_count': int(row_count),
+        'min_ts': format_ts(min_ts),
+        'max_ts': format_ts(max_ts),
+        'byte_size': os.path.getsize(file_path),
+        'checksum': compute_checksum(file_path),
+        'updated_at': datetime.now().isoformat(sep=' '),
+    }
+
+
+def read_footer_stats(file_path: str) -> tuple:
+    # only the footer is read, the row groups are left untouched
+    metadata = pq.ParquetFile(file_path).metadata
+    min_ts, max_ts = None, None
+    ts_idx = None
+    for i in range(metadata.num_columns):
+        if metadata.schema.column(i).name == 'ts':
+            ts_idx = i
+            break
+    if ts_idx is not None:
+        for rg in range(metadata.num_row_groups):
+            stats = metadata.row_group(rg).column(ts_idx).statistics
+            if stats is None or not stats.has_min_max:
+                continue
+            min_ts = stats.min if min_ts is None else min(min_ts, stats.min)
+            max_ts = stats.max if max_ts is None else max(max_ts, stats.max)
+    return metadata.num_rows, min_ts, max_ts
+
+
+class PartitionCatalog:
+    """
+    Persistent catalog of the partition files of a data source, stored as a SQLite database next to the data menu.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS partitions (
+                    ver_name TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    asset_type TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    partition TEXT NOT NULL,
+                    row_count INTEGER,
+                    min_ts TEXT,
+                    max_ts TEXT,
+                    byte_size INTEGER,
+                    checksum TEXT,
+                    updated_at TEXT,
+                    PRIMARY KEY (ver_name, file_name)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_partitions_ticker ON partitions (ver_name, asset_type, ticker, partition)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        with self._connect() as conn:
+            # WAL lets readers and a writer of different processes work concurrently
+            conn.execute("PRAGMA journal_mode=WAL")
+
+    @contextmanager
+    def _connect(self):
+        # REMINDER: one connection per operation, so the catalog can be used from multiple threads
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get_setting(self, key: str, default=None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = ?", (key, )).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_setting(self, key: str, value):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def upsert(self, records: typing.List[dict]):
+        if len(records) == 0:
+            return
+        placeholders = ', '.join('?' for _ in PARTITION_COLUMNS)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in PARTITION_COLUMNS if column not in ('ver_name', 'file_name'))
+        with self._connect() as conn:
+            # REMINDER: the records are described under the partition lock but upserted after it is released,
+            # a record never replaces a newer one of a concurrent writer
+            conn.executemany(
+                f"""
+                INSERT INTO partitions ({', '.join(PARTITION_COLUMNS)}) VALUES ({placeholders})
+                ON CONFLICT (ver_name, file_name) DO UPDATE SET {updates}
+                WHERE excluded.updated_at >= partitions.updated_at
+                """,
+                [tuple(record[column] for column in PARTITION_COLUMNS) for record in records],
+            )
+
+    def remove(self, ver_name: str, file_names: typing.List[str]):
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM partitions WHERE ver_name = ? AND file_name = ?",
+                [(ver_name, file_name) for file_name in file_names],
+            )
+
+    def clear(self, ver_name: str=None):
+        with self._connect() as conn:
+            if ver_name is None:
+                conn.execute("DELETE FROM partitions")
+            else:
+                conn.execute("DELETE FROM partitions WHERE ver_name = ?", (ver_name, ))
+
+    def query(
+            self,
+            ver_name: str=None,
+            asset_type: str=None,
+            ticker: str=None,
+            start_date: str=None,
+            end_date: str=None,
+        ) -> pd.DataFrame:
+        """
+        Query the partitions. `start_date`/`end_date` (both inclusive) select partitions by their ts range.
+        """
+        conditions, params = [], []
+        if ver_name is not None:
+            conditions.append('ver_name = ?')
+            params.append(ver_name)
+        if asset_type is not None:
+            conditions.append('asset_type = ?')
+            params.append(asset_type)
+        if ticker is not None:
+            conditions.append('ticker = ?')
+            params.append(ticker)
+        if start_date is not None:
+            # compare on dates so that a partition is selected as long as it overlaps the first day
+            conditions.append('substr(max_ts, 1, 10) >= ?')
+            params.append(pd.to_datetime(start_date).strftime('%Y-%m-%d'))
+        if end_date is not None:
+            conditions.append('substr(min_ts, 1, 10) <= ?')
+            params.append(pd.to_datetime(end_date).strftime('%Y-%m-%d'))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(PARTITION_COLUMNS)} FROM partitions {where} ORDER BY ver_name, asset_type, ticker, partition",
+                params,
+            ).fetchall()
+        return pd.DataFrame(rows, columns=PARTITION_COLUMNS)
+
+    def get_time_period(self, ver_name: str, asset_type: str=None, ticker: str=None) -> tuple:
+        conditions, params = ['ver_name = ?'], [ver_name]
+        if asset_type is not None:
+            conditions.append('asset_type = ?')
+            params.append(asset_type)
+        if ticker is not None:
+            conditions.append('ticker = ?')
+            params.append(ticker)
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT MIN(min_ts), MAX(max_ts) FROM partitions WHERE {' AND '.join(conditions)}",
+                params,
+            ).fetchone()
+
+    def get_time_periods(self, ver_name: str) -> pd.DataFrame:
+        # the ts range of every ticker of a version in a single query
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT asset_type, ticker, MIN(min_ts), MAX(max_ts) FROM partitions WHERE ver_name = ? GROUP BY asset_type, ticker",
+                (ver_name, ),
+            ).fetchall()
+        return pd.DataFrame(rows, columns=['asset_type', 'ticker', 'min_ts', 'max_ts'])
+
+    def summary(self, ver_name: str=None) -> pd.DataFrame:
+        conditions, params = [], []
+        if ver_name is not None:
+            conditions.append('ver_name = ?')
+            params.append(ver_name)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT ver_name, asset_type, COUNT(DISTINCT ticker), COUNT(*), SUM(row_count), SUM(byte_size), MIN(min_ts), MAX(max_ts)
+                FROM partitions {where}
+                GROUP BY ver_name, asset_type
+                ORDER BY ver_name, asset_type
+                """,
+                params,
+            ).fetchall()
+        return pd.DataFrame(rows, columns=['ver_name', 'asset_type', 'n_tickers', 'n_partitions', 'n_rows', 'n_bytes', 'min_ts', 'max_ts'])
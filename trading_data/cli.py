@@ -7,8 +7,12 @@ from importlib import import_module
 from datetime import datetime, timedelta
 
 from trading_data.datalake_client import DatalakeClient
+from trading_data.storage_profiles import STORAGE_PROFILES
+from trading_data.update_planner import to_fetch_plan
 
 DL_CLIENT = DatalakeClient(datalake_dir=os.path.join(os.getenv('HOME'), '.trading-data'))
+# the data sources that can store their raw trades (`--keep-ticks`)
+TICK_DATA_SOURCES = ['binance', 'bybit']
 # Setting the date range (last month)
 DEFAULT_END_DATE = datetime.today()
 
@@ -43,19 +47,30 @@ def datalake():
 @click.option('--end-date', required=False, default=None, help='The ending date of the new data. Default to be today')
 @click.option('--pdts', required=False, default=None, help='The pdts to update. Default to be all pdts in the data source')
 @click.option('--asset-type', required=False, default=None, help='The pdts to update. Default to be all pdts in the data source')
-def update(name, start_date, end_date, pdts, asset_type):
+@click.option('--keep-ticks', is_flag=True, default=False, help='Also store the raw trades as the tick version (binance and bybit only)')
+@click.option('--only-missing', is_flag=True, default=False, help='Only fetch the days that are missing or stale in the datalake')
+@click.option('--dry-run', is_flag=True, default=False, help='Print the planned fetches without fetching anything')
+@click.option('--recheck', is_flag=True, default=False, help='With `--only-missing`, also fetch the days recorded as empty upstream')
+def update(name, start_date, end_date, pdts, asset_type, keep_ticks, only_missing, dry_run, recheck):
     """
     Update an existing data source.
 
     This command allows you to update an existing data source specified by its name.
+    With `--only-missing`, only the missing and stale days of each ticker are fetched, see `DatalakeClient.plan_update`.
     """
     if pdts:
         if name != 'ib':
             print('Currently `--pdts` is only supported for ib_data_source')
             return
         pdts = pdts.split(',')
+    if keep_ticks and name not in TICK_DATA_SOURCES:
+        print(f'Currently `--keep-ticks` is only supported for {TICK_DATA_SOURCES}')
+        return
+    kwargs = {'keep_ticks': True} if keep_ticks else {}
 
     data_source = import_module(f'trading_data.data_sources.{name}_data_source')
+    # REMINDER: the days before the existing data are only planned if the start date is explicit
+    fill_head = start_date is not None
     if end_date is None:
         end_date = datetime.today()
         # convert back to str
@@ -69,27 +84,53 @@ def update(name, start_date, end_date, pdts, asset_type):
     if not isinstance(end_date, str):
         end_date = datetime.strftime(end_date, "%Y-%m-%d")
 
-    if name != 'ib':
-        if asset_type is not None:
-            print('Currently `--asset-type` is only supported for ib_data_source')
+    if name != 'ib' and asset_type is not None:
+        print('Currently `--asset-type` is only supported for ib_data_source')
+        return
+
+    plan = None
+    if only_missing or dry_run:
+        plan = DL_CLIENT.plan_update(
+            name, data_source.VER_NAME, start_date, end_date, tickers=pdts, only_missing=only_missing, fill_head=fill_head, recheck=recheck,
+        )
+        if len(plan) > 0:
+            print(plan.to_string(index=False))
+        print(f"{len(plan)} ranges of {plan['ticker'].nunique()} tickers to fetch, {plan['n_days'].sum()} days in total")
+        if dry_run:
+            return
+        if len(plan) == 0:
             return
-        data_source.update_data(DL_CLIENT, start_date, end_date, pdts)
+        kwargs['plan'] = to_fetch_plan(plan)
+
+    if name != 'ib':
+        with DL_CLIENT.deferred_rollups():
+            data_source.update_data(DL_CLIENT, start_date, end_date, pdts, **kwargs)
     else:
         if asset_type is None:
             asset_type = 'stock'
-        data_source.update_data(DL_CLIENT, start_date, end_date, pdts, asset_type=asset_type)
+        with DL_CLIENT.deferred_rollups():
+            data_source.update_data(DL_CLIENT, start_date, end_date, pdts, asset_type=asset_type, **kwargs)
+    if only_missing:
+        n_recorded = DL_CLIENT.record_checked_dates(name, data_source.VER_NAME, plan)
+        if n_recorded > 0:
+            print(f'Recorded {n_recorded} days without data upstream, they are skipped by the next updates (see `--recheck`)')
 
 
 @datalake.command()
 @click.option('--name', required=True, help='The name of the data source to add')
 @click.option('--start-date', required=False, default=None, help='The starting date of new data. Default to be the date of trailing half year from the ending date')
 @click.option('--end-date', required=False, default=None, help='The ending date of the new data. Default to be today')
-def add(name, start_date, end_date):
+@click.option('--keep-ticks', is_flag=True, default=False, help='Also store the raw trades as the tick version (binance and bybit only)')
+def add(name, start_date, end_date, keep_ticks):
     """
     Add a new data source.
 
     This command allows you to add a new data source with a specified name.
     """
+    if keep_ticks and name not in TICK_DATA_SOURCES:
+        print(f'Currently `--keep-ticks` is only supported for {TICK_DATA_SOURCES}')
+        return
+    kwargs = {'keep_ticks': True} if keep_ticks else {}
     data_source = import_module(f'trading_data.data_sources.{name}_data_source')
     if end_date is None:
         end_date = datetime.today()
@@ -104,7 +145,8 @@ def add(name, start_date, end_date):
     if not isinstance(end_date, str):
         end_date = datetime.strftime(end_date, "%Y-%m-%d")
     
-    data_source.add_data(DL_CLIENT, start_date, end_date)
+    with DL_CLIENT.deferred_rollups():
+        data_source.add_data(DL_CLIENT, start_date, end_date, **kwargs)
 
 
 @datalake.command()
@@ -137,7 +179,132 @@ def info(name, ver):
     for asset_type in data_menu:
         n_assets = len(data_menu[asset_type])
         print(f'{asset_type=} {n_assets=}')
-        
+    catalog = DL_CLIENT.get_catalog(name)
+    if catalog is not None:
+        print('Catalog')
+        print(catalog.summary(ver_name=ver).to_string(index=False))
+
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source to compact')
+@click.option('--ver', required=False, default='min_bar', help='The name of the ver to compact. Default to be min_bar')
+@click.option('--granularity', required=False, default='month', type=click.Choice(['month', 'year']), help='The granularity of the compacted partitions. Default to be month')
+def compact(name, ver, granularity):
+    """
+    Consolidate the daily partitions of a data source into monthly/yearly partitions.
+
+    Only the periods with new or replaced daily partitions since the last compaction are recompacted.
+    """
+    file_paths = DL_CLIENT.compact(name, ver_name=ver, granularity=granularity)
+    print(f'Compacted {len(file_paths)} partitions of data_source={name} ver={ver}')
+
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source')
+@click.option('--ver', required=False, default=None, help='The name of the ver. Default to be all vers')
+@click.option('--min-deltas', required=False, default=1, type=int, help='Only fold the partitions with at least this number of delta files. Default to be 1')
+def fold(name, ver, min_deltas):
+    """
+    Fold the delta files appended by merge updates into their partition files.
+    """
+    file_paths = DL_CLIENT.fold_deltas(name, ver_name=ver, min_deltas=min_deltas)
+    print(f'Folded the deltas of {len(file_paths)} partitions of data_source={name}')
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source')
+@click.option('--ver', required=True, help='The name of the ver')
+@click.option('--profile', required=True, type=click.Choice(list(STORAGE_PROFILES)), help='The storage profile to apply')
+@click.option('--dry-run', is_flag=True, default=False, help='Only measure the size and read time deltas without rewriting the partitions')
+def profile(name, ver, profile, dry_run):
+    """
+    Rewrite the partitions of a data source with a storage profile and report the size and read time deltas.
+
+    The profile is also used by all subsequent writes of the version (unless `--dry-run`).
+    """
+    report = DL_CLIENT.apply_storage_profile(name, ver, profile, dry_run=dry_run)
+    print(report.to_string(index=False))
+    if len(report) > 0:
+        print(f"Total bytes: {report['old_bytes'].sum()} -> {report['new_bytes'].sum()}")
+        print(f"Total read time (s): {report['old_read_s'].sum():.3f} -> {report['new_read_s'].sum():.3f}")
+
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source to catalog')
+def catalog(name):
+    """
+    (Re)build the partition catalog of a data source from the files in the datalake.
+    """
+    catalog = DL_CLIENT.build_catalog(name)
+    print(catalog.summary().to_string(index=False))
+
+
+@datalake.command()
+@click.argument('query')
+@click.option('--name', required=False, default=None, help='The data sources to register, e.g. yfinance,bybit. Default to be all data sources')
+@click.option('--tickers', required=False, default=None, help='Only register the partitions of these tickers, e.g. AAPL,MSFT')
+@click.option('--start-date', required=False, default=None, help='Only register the partitions from this date')
+@click.option('--end-date', required=False, default=None, help='Only register the partitions until this date')
+@click.option('--output', required=False, default=None, help='Write the result to a csv file instead of printing it')
+def query(query, name, tickers, start_date, end_date, output):
+    """
+    Run a SQL query over the datalake, each version is a view named <data_source>.<ver>.
+
+    Example: trading-data datalake query "SELECT ticker, avg(high - low) FROM yfinance.day_bar GROUP BY ticker"
+    """
+    df = DL_CLIENT.sql(
+        query,
+        data_sources=name.split(',') if name else None,
+        tickers=tickers.split(',') if tickers else None,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    if output:
+        df.to_csv(output, index=False)
+        print(f'Wrote {len(df)} rows to {output}')
+    else:
+        print(df.to_string(index=False))
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source to roll up')
+@click.option('--vers', required=False, default=None, help='The rollups to build, e.g. hour_bar,day_bar. Default to be the enabled rollups or all of them')
+@click.option('--tz', required=False, default=None, help='The timezone of the sessions, e.g. America/New_York. Default to be UTC')
+@click.option('--session-offset', required=False, default=None, help='The start of a session relative to midnight, e.g. -6h or 9h30min')
+@click.option('--session-hours', required=False, default=None, help='The session hours in local time, e.g. 09:30,16:00')
+@click.option('--start-date', required=False, default=None, help='The starting date of the min bars to roll up. Default to be all')
+@click.option('--end-date', required=False, default=None, help='The ending date of the min bars to roll up. Default to be all')
+@click.option('--enable', is_flag=True, default=False, help='Also keep the rollups in sync after every subsequent min_bar write')
+def rollup(name, vers, tz, session_offset, session_hours, start_date, end_date, enable):
+    """
+    Build hour_bar/day_bar of a data source from its min_bar.
+    """
+    vers = vers.split(',') if vers else None
+    session_hours = tuple(session_hours.split(',')) if session_hours else None
+    if enable:
+        DL_CLIENT.enable_rollups(name, versions=vers or ('hour_bar', 'day_bar'), tz=tz, session_offset=session_offset, session_hours=session_hours)
+    DL_CLIENT.build_rollups(
+        name,
+        versions=vers,
+        start_date=start_date,
+        end_date=end_date,
+        tz=tz,
+        session_offset=session_offset,
+        session_hours=session_hours,
+    )
+
+
+@datalake.command()
+@click.option('--name', required=True, help='The name of the data source to rebuild')
+@click.option('--tickers', required=False, default=None, help='Only rebuild these tickers, e.g. BTC_USDT,ETH_USDT. Default to be all tickers with ticks')
+@click.option('--start-date', required=False, default=None, help='The starting date of the bars to rebuild. Default to be all')
+@click.option('--end-date', required=False, default=None, help='The ending date of the bars to rebuild. Default to be all')
+def rebar(name, tickers, start_date, end_date):
+    """
+    Rebuild min_bar of a data source from its stored ticks, without downloading anything.
+    """
+    tickers = tickers.split(',') if tickers else None
+    n = DL_CLIENT.rebuild_bars_from_ticks(name, tickers=tickers, start_date=start_date, end_date=end_date)
+    print(f'Rebuilt {n} min_bar partitions of {name} from ticks')
+
 
 if __name__ == '__main__':
     cli()
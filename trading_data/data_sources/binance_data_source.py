@@ -1,20 +1,34 @@
-import io
-import requests
+import os
+import shutil
+import zipfile
+import typing
+import tempfile
+from contextlib import nullcontext
 import pandas as pd
 from tqdm import tqdm
 
 from trading_data.datalake_client import DatalakeClient
-from trading_data.common.date_ranges import get_dates
+from trading_data.common.date_ranges import get_dates, get_months
+from trading_data.downloader import HTTPDownloader
+from trading_data.download_cache import get_cache_from_env
 from trading_data.logger import get_logger
+from trading_data.update_planner import get_plan_ranges
+from trading_data.tick_bars import create_time_bars_from_stream
+from trading_data.tick_store import DailyTickWriter
 
 
 # Constants
 DATA_SOURCE = 'binance'
-BASE_URL = "https://data.binance.vision/"
+VER_NAME = 'min_bar'  # the version written by `update_data`
+# REMINDER: can be pointed to a local HTTP server serving fixture archives
+BASE_URL = os.getenv('BINANCE_DATA_BASE_URL', "https://data.binance.vision/")
+DOWNLOADER = HTTPDownloader(max_concurrency_per_host=8, rate_limit=20, cache=get_cache_from_env(), checksum_suffix='.CHECKSUM')
 PDT_MATCHING = {
     'BTC_USDT': 'BTCUSDT',
     'ETH_USDT': 'ETHUSDT',
 }
+# columns of the futures trade files, for the older files that have no header line
+TRADE_COLUMNS = ['id', 'price', 'qty', 'quote_qty', 'time', 'is_buyer_maker']
 
 logger = get_logger(__name__, logger_lv='info')
 
@@ -30,104 +44,113 @@ def get_path(trading_type, market_data_type, time_period, symbol, interval=None)
   return path
 
 
-def download_market_data(asset: str, date: str, trading_type='um') -> pd.DataFrame:
-    """_summary_
+def get_market_data_url(asset: str, date: str, trading_type='um') -> str:
+    # Construct the download URL for trade data, `date` is a day `YYYY-MM-DD` or a month `YYYY-MM`
+    time_period = 'monthly' if len(date) == 7 else 'daily'
+    path = get_path(trading_type, 'trades', time_period=time_period, symbol=asset)
+    return f'{BASE_URL}{path}{asset}-trades-{date}.zip'
 
-    Args:
-        asset (str): _description_
-        date (str): _description_
-        trading_type (str, optional): trading_type can be `um`, `cm` and `spot`. Defaults to 'um'.
 
-    Returns:
-        pd.DataFrame: _description_
+def plan_periods(start_date: str, end_date: str) -> typing.List[str]:
     """
-    # Construct the download URL for trade data
-    path = get_path(trading_type, 'trades', time_period='daily', symbol=asset)
-    url = f'{BASE_URL}{path}{asset}-trades-{date}.zip'
-    
-    # Send a GET request to the URL
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        # Load the data into a DataFrame
-        df = pd.read_csv(io.BytesIO(response.content), compression='zip')
-        return df
-    else:
-        logger.error(f"Failed to retrieve data: Status code {response.status_code} {url=}")
-        return pd.DataFrame()
-
-
-def create_time_bars_from_tick_data(df: pd.DataFrame, freq: str='1min'):
-    df = df.resample(freq).agg({
-        'price': ['first', 'max', 'min', 'last'],
-        'size': 'sum'
-    })
-    df.columns = ['_'.join(col).strip() for col in df.columns.values]
-    df.rename(columns={
-        'price_first': 'open',
-        'price_max': 'high',
-        'price_min': 'low',
-        'price_last': 'close',
-        'size_sum': 'volume'
-    }, inplace=True)
-    return df
-
-
-def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
+    Cover [start_date, end_date] with the months (`YYYY-MM`) it fully contains, fetched from the monthly archives,
+    and the leftover days (`YYYY-MM-DD`) at its edges. The current month is not archived yet and is fetched by days.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    current_month_start = pd.Timestamp.today().normalize().replace(day=1)
+    periods = []
+    for month in get_months(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')):
+        month_start = pd.Timestamp(f'{month}-01')
+        month_end = month_start + pd.offsets.MonthEnd(0)
+        if start <= month_start and month_end <= end and month_start < current_month_start:
+            periods.append(month)
+        else:
+            periods.extend(get_dates(max(start, month_start).strftime('%Y-%m-%d'), min(end, month_end).strftime('%Y-%m-%d')))
+    return periods
+
+
+def create_min_bars(fileobj, tick_writer=None) -> pd.DataFrame:
+    # REMINDER: a zip needs a seekable file, so a streamed archive is spooled to disk and its csv decoded chunk by chunk
+    with (nullcontext(fileobj) if fileobj.seekable() else tempfile.TemporaryFile()) as zip_fileobj:
+        if zip_fileobj is not fileobj:
+            shutil.copyfileobj(fileobj, zip_fileobj, 1 << 20)
+            zip_fileobj.seek(0)
+        with zipfile.ZipFile(zip_fileobj) as zip_file:
+            with zip_file.open(zip_file.namelist()[0]) as csv_file:
+                return create_time_bars_from_stream(
+                    # REMINDER: the buyer is the maker of the trades initiated by the seller
+                    csv_file, ts_column='time', ts_unit='ms', size_column='qty', side_column='is_buyer_maker', buy_value=False,
+                    freq='1min', column_names=TRADE_COLUMNS, tick_writer=tick_writer,
+                )
+
+
+def _get_transform(dl_client: DatalakeClient, asset_type: str, asset: str, period: str, how: str, keep_ticks: bool):
+    if not keep_ticks:
+        return create_min_bars
+
+    def _open_tick_writer(date):
+        return dl_client.open_tick_writer(DATA_SOURCE, asset_type, asset, date, how=how)
+
+    def _transform(fileobj):
+        # REMINDER: the ticks are kept while the bars are built, in the same pass over the archive
+        with (DailyTickWriter(_open_tick_writer) if len(period) == 7 else _open_tick_writer(period)) as tick_writer:
+            return create_min_bars(fileobj, tick_writer=tick_writer)
+    return _transform
+
+
+def _download_and_write(dl_client: DatalakeClient, data_menu: dict, start_date: str, end_date: str, how: str, keep_ticks: bool=False, plan: dict=None):
+    # the archives are downloaded and converted to bars concurrently, the bars are written as they complete
+    tasks = [
+        ((asset_type, asset, period), get_market_data_url(PDT_MATCHING[asset], period), _get_transform(dl_client, asset_type, asset, period, how, keep_ticks))
+        for asset_type in data_menu
+        for asset in data_menu[asset_type]
+        for range_start, range_end in get_plan_ranges(plan, asset_type, asset, start_date, end_date)
+        for period in plan_periods(range_start, range_end)
+    ]
+    while len(tasks) > 0:
+        logger.info(f'Downloading {len(tasks)} archives from {DATA_SOURCE}...')
+        fallback_tasks = []
+        for (asset_type, asset, period), df, error in tqdm(DOWNLOADER.iter_fetch(tasks, stream=True), total=len(tasks)):
+            if error is not None:
+                logger.error(f'Error downloading {asset=} on {period}: {error}')
+                continue
+            if df is None and len(period) == 7:
+                # the monthly archive is not published (yet), fall back to the daily archives of the month
+                month_end = (pd.Timestamp(f'{period}-01') + pd.offsets.MonthEnd(0)).strftime('%Y-%m-%d')
+                fallback_tasks.extend(
+                    ((asset_type, asset, date_str), get_market_data_url(PDT_MATCHING[asset], date_str), _get_transform(dl_client, asset_type, asset, date_str, how, keep_ticks))
+                    for date_str in get_dates(f'{period}-01', month_end)
+                )
+                continue
+            if df is None:
+                logger.error(f'Failed to retrieve data: not found {asset=} on {period}')
+                continue
+            try:
+                if len(period) == 7:
+                    # REMINDER: a monthly archive is split back into the daily partitions in a single pass
+                    dl_client.write_partitioned(DATA_SOURCE, asset_type, asset, data=df, ver_name='min_bar', how=how)
+                elif how == 'add':
+                    dl_client.add_data(DATA_SOURCE, asset_type, asset, data=df, ver_name='min_bar', date=period)
+                else:
+                    dl_client.update_data(DATA_SOURCE, asset_type, asset, data=df, ver_name='min_bar', date=period, how=how)
+            except Exception as err:
+                logger.error(f'Error writing {asset=} on {period}: {err}')
+        tasks = fallback_tasks
+
+
+def add_data(dl_client: DatalakeClient, start_date: str, end_date: str, keep_ticks: bool=False):
     data_menu = {
         'perp': ['BTC_USDT', 'ETH_USDT'],
     }
     
     dl_client.add_data_source(DATA_SOURCE, data_menu)
-    
-    for asset_type in data_menu:
-        for asset in data_menu[asset_type]:
-            external_asset = PDT_MATCHING[asset]
-            logger.info(f'Downloading {asset=} data from {DATA_SOURCE}...')
-            for date in tqdm(pd.date_range(start=start_date, end=end_date)):
-                try:
-                    date_str = date.strftime('%Y-%m-%d')
-                    df = download_market_data(external_asset, date_str)
-                    # print(f'before {df=}')
-                    df = df.rename(
-                        columns={
-                            'time': 'ts',
-                            'qty': 'size'
-                        }
-                    )
-                    # print(f'after {df=}')
-                    df = df[['ts', 'price', 'size']]  # Adjust based on actual columns
-                    df['ts'] = pd.to_datetime(df['ts'], unit='ms')
-                    df.set_index('ts', inplace=True)
-                    df = create_time_bars_from_tick_data(df, freq='1min')
-                    dl_client.add_data(DATA_SOURCE, asset_type, asset, data=df, ver_name='min_bar', date=date_str)
-                except Exception as err:
-                    logger.error(f'Error downloading {asset=} on {date_str}: {err}')
-
-
-def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None):
+    _download_and_write(dl_client, data_menu, start_date, end_date, how='add', keep_ticks=keep_ticks)
+
+
+def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None, keep_ticks: bool=False, plan: dict=None):
+    # REMINDER: with a `plan` (see `DatalakeClient.plan_update`), only its ranges are downloaded
     data_menu = dl_client.get_data_menu(DATA_SOURCE)
-    for asset_type in data_menu:
-        for asset in data_menu[asset_type]:
-            external_asset = PDT_MATCHING[asset]
-            logger.info(f'Downloading {asset=} data from {DATA_SOURCE}...')
-            for date in tqdm(pd.date_range(start=start_date, end=end_date)):
-                try:
-                    date_str = date.strftime('%Y-%m-%d')
-                    df = download_market_data(external_asset, date_str)
-                    df = df.rename(
-                        columns={
-                            'time': 'ts',
-                            'qty': 'size'
-                        }
-                    )
-                    df = df[['ts', 'price', 'size']]  # Adjust based on actual columns
-                    df['ts'] = pd.to_datetime(df['ts'], unit='ms')
-                    df.set_index('ts', inplace=True)
-                    df = create_time_bars_from_tick_data(df, freq='1min')
-                    dl_client.update_data(DATA_SOURCE, asset_type, asset, data=df, ver_name='min_bar', date=date_str, how='replace')
-                except Exception as err:
-                    logger.info(f'Error downloading {asset=} on {date_str}: {err}')
+    _download_and_write(dl_client, data_menu, start_date, end_date, how='replace', keep_ticks=keep_ticks, plan=plan)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,17 @@
 import io
+import os
+import gzip
 
 from tqdm import tqdm
 import pandas as pd
-import requests
 
 from trading_data.datalake_client import DatalakeClient
 from trading_data.common.date_ranges import get_dates
+from trading_data.downloader import HTTPDownloader
+from trading_data.download_cache import get_cache_from_env
 from trading_data.logger import get_logger
+from trading_data.update_planner import get_plan_ranges
+from trading_data.tick_bars import create_time_bars_from_stream
 
 
 logger = get_logger(__name__, logger_lv='info')
@@ -22,6 +27,10 @@ timestamp   symbol  side   size    price  tickDirection
 """
 
 DATA_SOURCE = 'bybit'
+VER_NAME = 'min_bar'  # the version written by `update_data`
+# REMINDER: can be pointed to a local HTTP server serving fixture archives
+BASE_URL = os.getenv('BYBIT_DATA_BASE_URL', 'https://public.bybit.com/')
+DOWNLOADER = HTTPDownloader(max_concurrency_per_host=8, rate_limit=20, cache=get_cache_from_env())
 PDT_MATCHING = {
     # from internal to external
     'BTC_USDT': 'BTCUSDT',
@@ -29,78 +38,79 @@ PDT_MATCHING = {
 }
 
 
-def create_time_bars_from_tick_data(df, freq='1min'):
-    df = df.resample(freq).agg({
-        'price': ['first', 'max', 'min', 'last'],
-        'size': 'sum'
-    })
-    # Flatten the MultiIndex columns
-    df.columns = ['_'.join(col).strip() for col in df.columns.values]
+def get_market_data_url(asset: str, date: str) -> str:
+    # Construct the download URL
+    return f'{BASE_URL}trading/{asset}/{asset}{date}.csv.gz'
+
 
-    # Rename columns to OHLCV
-    df.rename(columns={
-        'price_first': 'open',
-        'price_max': 'high',
-        'price_min': 'low',
-        'price_last': 'close',
-        'size_sum': 'volume'
-    }, inplace=True)
-    return df
+def parse_market_data(content: bytes) -> pd.DataFrame:
+    # Decompress the content of the response
+    # Read the content into a DataFrame
+    return pd.read_csv(io.BytesIO(content), header=0, compression='gzip')
 
 
 def download_market_data(asset: str, date: str) -> pd.DataFrame:
-    # Construct the download URL
-    url = f'https://public.bybit.com/trading/{asset}/{asset}{date}.csv.gz'
-    
-    # Send a GET request to the URL
-    response = requests.get(url)
-    
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Decompress the content of the response
-        # Read the content into a DataFrame
-        df = pd.read_csv(io.BytesIO(response.content), header=0, compression='gzip')
-        return df
-    else:
+    content = DOWNLOADER.fetch(get_market_data_url(asset, date))
+    if content is None:
         # If the request failed, print the status code
-        print(f"Failed to retrieve data: Status code {response.status_code}")
+        print(f"Failed to retrieve data: not found {asset=} {date=}")
         return pd.DataFrame()
+    return parse_market_data(content)
+
+
+def create_min_bars(fileobj, tick_writer=None) -> pd.DataFrame:
+    # the gzip stream is decompressed and decoded chunk by chunk while it downloads
+    with gzip.GzipFile(fileobj=fileobj) as csv_file:
+        # TODO: use only min bar now
+        return create_time_bars_from_stream(csv_file, ts_column='timestamp', ts_unit='s', side_column='side', buy_value='Buy', freq='1min', tick_writer=tick_writer)
+
+
+def _get_transform(dl_client: DatalakeClient, asset_type: str, asset: str, date: str, how: str, keep_ticks: bool):
+    if not keep_ticks:
+        return create_min_bars
+
+    def _transform(fileobj):
+        # REMINDER: the ticks are kept while the bars are built, in the same pass over the archive
+        with dl_client.open_tick_writer(DATA_SOURCE, asset_type, asset, date, how=how) as tick_writer:
+            return create_min_bars(fileobj, tick_writer=tick_writer)
+    return _transform
+
+
+def _download_and_write(dl_client: DatalakeClient, data_menu: dict, start_date: str, end_date: str, how: str, keep_ticks: bool=False, plan: dict=None):
+    # the archives are downloaded and converted to bars concurrently, the bars are written as they complete
+    tasks = [
+        ((asset_type, asset, date), get_market_data_url(PDT_MATCHING[asset], date), _get_transform(dl_client, asset_type, asset, date, how, keep_ticks))
+        for asset_type in data_menu
+        for asset in data_menu[asset_type]
+        for range_start, range_end in get_plan_ranges(plan, asset_type, asset, start_date, end_date)
+        for date in get_dates(range_start, range_end)
+    ]
+    logger.info(f'Downloading {len(tasks)} archives from {DATA_SOURCE}...')
+    for (asset_type, asset, date), df, error in tqdm(DOWNLOADER.iter_fetch(tasks, stream=True), total=len(tasks)):
+        if error is not None:
+            logger.error(f'Error encountered when downloading {asset=} on {date}: {error}')
+            continue
+        if df is None:
+            logger.error(f'Failed to retrieve data: not found {asset=} on {date}')
+            continue
+        try:
+            if how == 'add':
+                # TODO: need to handle multi files
+                dl_client.add_data(DATA_SOURCE, asset_type, asset, data=df, date=date, ver_name='min_bar')
+            else:
+                # REMINDER: no need to merge for bybit data
+                dl_client.update_data(DATA_SOURCE, asset_type, asset, data=df, date=date, ver_name='min_bar', how=how)
+        except Exception as err:
+            logger.error(f'Error encountered when writing {asset=} on {date}: {err}')
+
+
+def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None, keep_ticks: bool=False, plan: dict=None):
+    # REMINDER: with a `plan` (see `DatalakeClient.plan_update`), only its ranges are downloaded
+    data_menu = dl_client.get_data_menu(DATA_SOURCE)
+    _download_and_write(dl_client, data_menu, start_date, end_date, how='replace', keep_ticks=keep_ticks, plan=plan)
 
 
-def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None):
-    data_menu = dl_client.get_data_menu(DATA_SOURCE)
-    for asset_type in data_menu:
-        for asset in data_menu[asset_type]:
-            external_asset = PDT_MATCHING[asset]
-            logger.info(f'Downloaing {asset=} data from {DATA_SOURCE}...')
-            for date in tqdm(get_dates(start_date, end_date)):
-                try:
-                    df = download_market_data(external_asset, date)
-                    df = df[['timestamp', 'size', 'side', 'price']]  # drop other columns
-                    df = df.rename(
-                        columns={
-                            'timestamp': 'ts',
-                        }
-                    )
-                    df['ts'] = pd.to_datetime(df['ts'], unit='s')
-                    df.set_index('ts', inplace=True)
-                    # TODO: use only min bar now
-                    df = create_time_bars_from_tick_data(df, freq='1min')
-                    # REMINDER: no need to merge for bybit data
-                    dl_client.update_data(
-                        DATA_SOURCE,
-                        asset_type,
-                        asset,
-                        data=df,
-                        date=date,
-                        ver_name='min_bar',
-                        how='replace'
-                    )
-                except Exception as err:
-                    logger.error(f'Error encountered when downloading {asset=} on {date}: {err}')
-
-
-def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
+def add_data(dl_client: DatalakeClient, start_date: str, end_date: str, keep_ticks: bool=False):
     # prepare data menu
     # TODO: hard-code the pairs fo the moment
     data_menu = {
@@ -112,37 +122,8 @@ def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
 
     # add_data in datalake
     dl_client.add_data_source(DATA_SOURCE, data_menu)
-
-    for asset_type in data_menu:
-        for asset in data_menu[asset_type]:
-            external_asset = PDT_MATCHING[asset]
-            logger.info(f'Downloaing {asset=} data from {DATA_SOURCE}...')
-            for date in tqdm(get_dates(start_date, end_date)):
-                try:
-                    df = download_market_data(external_asset, date)
-                    df = df[['timestamp', 'size', 'side', 'price']]  # drop other columns
-                    df = df.rename(
-                        columns={
-                            'timestamp': 'ts',
-                        }
-                    )
-                    df['ts'] = pd.to_datetime(df['ts'], unit='s')
-                    df.set_index('ts', inplace=True)
-                    # TODO: use only min bar now
-                    df = create_time_bars_from_tick_data(df, freq='1min')
-                    # TODO: need to handle multi files
-                    dl_client.add_data(
-                        DATA_SOURCE,
-                        asset_type,
-                        asset,
-                        data=df,
-                        date=date,
-                        ver_name='min_bar'
-                    )
-                except Exception as err:
-                    logger.error(f'Error encountered when downloading {asset=} on {date}: {err}')
+    _download_and_write(dl_client, data_menu, start_date, end_date, how='add', keep_ticks=keep_ticks)
 
 
 def get_data(self):
     pass
-
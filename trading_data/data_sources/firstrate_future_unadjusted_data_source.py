@@ -6,9 +6,11 @@ from tqdm import tqdm
 # Import your data lake client and logger as necessary
 from trading_data.datalake_client import DatalakeClient
 from trading_data.logger import get_logger
+from trading_data.update_planner import get_ranges_mask
 
 
 DATA_SOURCE = 'firstrate_future_unadjusted'
+VER_NAME = 'min_bar'  # the version written by `update_data`
 TICKER_LISTING_FILE_PATH = os.getenv('FIRSTRATE_FUTURE_TICKER_LISTING_FILE_PATH')
 DATA_DIR = os.getenv('FIRSTRATE_FUTURE_UNADJUSTED_DATA_DIR')
 
@@ -42,51 +44,46 @@ def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
                 df['ts'] = pd.to_datetime(df['ts'])
                 mask = (df['ts'] >= start_date) & (df['ts'] <= end_date)
                 df = df.loc[mask]
-                unique_dates = df['ts'].dt.date.unique()
                 df.set_index('ts', inplace=True)
-                # Split the dataframe by date and update the data for each date
-                for unique_date in unique_dates:
-                    date_str = unique_date.strftime('%Y-%m-%d')
-                    df_date = df[df.index.date == unique_date]
-                    # df_date = df_date[['open', 'high', 'low', 'close', 'volume']]
-                    dl_client.add_data(
-                        DATA_SOURCE,
-                        asset_type,
-                        asset,
-                        data=df_date,
-                        ver_name='min_bar',
-                        date=date_str,
-                    )
+                # Split the dataframe by date and add the data for each date
+                dl_client.write_partitioned(
+                    DATA_SOURCE,
+                    asset_type,
+                    asset,
+                    data=df,
+                    ver_name='min_bar',
+                    how='add',
+                )
             except Exception as e:
                 logger.error(f'Error encountered when extracting {asset=}: {e}')
 
 
-def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None):
+def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts=None, plan: dict=None):
+    # REMINDER: with a `plan` (see `DatalakeClient.plan_update`), only the days of its ranges are rewritten
     data_menu = dl_client.get_data_menu(DATA_SOURCE)
     for asset_type in data_menu:
         for asset in tqdm(data_menu[asset_type]):
+            if plan is not None and len(plan.get((asset_type, asset), [])) == 0:
+                continue
             logger.info(f'Extracting {asset=} data from firstrate future...')
             try:
                 file_path = os.path.join(DATA_DIR, f'{asset}_full_1min_continuous_UNadjusted.txt')
                 df = pd.read_csv(file_path, header=None, names=['ts', 'open', 'high', 'low', 'close', 'volume'])
                 df['ts'] = pd.to_datetime(df['ts'])
-                mask = (df['ts'] >= start_date) & (df['ts'] <= end_date)
-                df = df.loc[mask]
-                unique_dates = df['ts'].dt.date.unique()
+                if plan is not None:
+                    df = df[get_ranges_mask(df['ts'], plan[(asset_type, asset)])]
+                else:
+                    mask = (df['ts'] >= start_date) & (df['ts'] <= end_date)
+                    df = df.loc[mask]
                 df.set_index('ts', inplace=True)
-                for unique_date in unique_dates:
-                    date_str = unique_date.strftime('%Y-%m-%d')
-                    df_date = df[df.index.date == unique_date]
-                    # df_date = df_date[['open', 'high', 'low', 'close', 'volume']]
-                    dl_client.update_data(
-                        DATA_SOURCE,
-                        asset_type,
-                        asset,
-                        data=df_date,
-                        ver_name='min_bar',
-                        date=date_str,
-                        how='replace'
-                    )
+                dl_client.write_partitioned(
+                    DATA_SOURCE,
+                    asset_type,
+                    asset,
+                    data=df,
+                    ver_name='min_bar',
+                    how='replace',
+                )
             except Exception as e:
                 logger.error(f'Error encountered when extracting {asset=}: {e}')
 
@@ -1,55 +1,38 @@
 import typing
 import os
-import time
-from threading import Thread
+import itertools
 
 import pandas as pd
-from ibapi.client import EClient
-from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
-from ibapi.common import BarData
 
 from trading_data.datalake_client import DatalakeClient
 from trading_data.common.helpers import if_update_data_menu
+from trading_data.ib_pacing import plan_chunks, project_wall_time
+from trading_data.ib_session import IBSession, concat_bars
 from trading_data.logger import get_logger
+from trading_data.update_planner import get_plan_ranges
 # from datetime import datetime
 
 logger = get_logger("ib_data_source")
 
 
 DATA_SOURCE = 'ib'
+VER_NAME = 'min_bar'  # the version written by `update_data`
 TWS_HOST = os.getenv("TWS_HOST", "127.0.0.1")
 TWS_PORT = os.getenv("TWS_PORT", 4003)  # 7497 for paper trading, 7496 for real trading (default)
 TWS_CLIENT_ID = os.getenv("TWS_CLIENT_ID", 1)
 
 
+BAR_SIZE = '1 min'
+SYMBOLS_PER_BATCH = 8  # symbols fetched together, their bars are held in memory until their batch completes
+
+
 CONVERTOR = {
     'stock': 'STK',
     'futures': 'FUT',
 }
 
 
-class IBApp(EClient, EWrapper):
-    def __init__(self):
-        EClient.__init__(self, self)
-        self.data = []
-        self.connected = False
-
-    def historicalData(self, reqId, bar: BarData):
-        print(bar)
-        self.data.append([bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume])
-
-    def historicalDataEnd(self, reqId, start, end):
-        self.done = True
-
-    def error(self, reqId, errorCode, errorString, advancedOrderRejectJson):
-        benign_errors = [2104, 2106, 2158]
-        if errorCode in benign_errors:
-            logger.info(f"Info {errorCode}: {errorString}")
-        else:
-            logger.error(f"Error {errorCode}: {errorString}")
-
-
 from datetime import datetime
 
 def get_most_recent_future_month():
@@ -67,12 +50,12 @@ def get_most_recent_future_month():
     return f"{year+1}03"
 
 
-def fetch_ib_data(symbol, exchange, currency, start_date, end_date, bar_size='1 Min', sec_type='STK'):
-    app = IBApp()
-    app.connect(TWS_HOST, int(TWS_PORT), clientId=int(TWS_CLIENT_ID))
-    thread = Thread(target=app.run)
-    thread.start()
+def open_session(**kwargs) -> IBSession:
+    # a session to the TWS / IB Gateway configured by `TWS_HOST`, `TWS_PORT` and `TWS_CLIENT_ID`
+    return IBSession(TWS_HOST, int(TWS_PORT), client_id=int(TWS_CLIENT_ID), **kwargs)
+
 
+def get_contract(symbol, exchange, currency, sec_type='STK') -> Contract:
     contract = Contract()
     if sec_type == 'FUT':
         contract.symbol = symbol
@@ -85,60 +68,69 @@ def fetch_ib_data(symbol, exchange, currency, start_date, end_date, bar_size='1
         contract.secType = "STK"
         contract.exchange = exchange
         contract.currency = currency
-
-    start = pd.to_datetime(start_date)
-    end = pd.to_datetime(end_date)
-
-    app.data = []
-    app.done = False
-
-    dfs = []
-    current_start = start
-    max_chunk = pd.Timedelta(days=30)
-    req_id_counter = 1000
-
-    while current_start < end:
-        current_end = min(current_start + max_chunk, end)
-        duration = f"{(current_end - current_start).days} D"
-        end_str = current_end.strftime("%Y%m%d-%H:%M:%S")
-
-        app.data = []
-        app.done = False
-        app.reqHistoricalData(
-            reqId=req_id_counter,
-            contract=contract,
-            endDateTime=end_str,
-            durationStr=duration,
-            barSizeSetting=bar_size,
-            whatToShow="TRADES",
-            useRTH=0,
-            formatDate=1,
-            keepUpToDate=False,
-            chartOptions=[]
-        )
-        req_id_counter += 1
-
-        timeout = time.time() + 60
-        while not app.done and time.time() < timeout:
-            time.sleep(0.5)
-
-        if app.data:
-            df_chunk = pd.DataFrame(app.data, columns=["ts", "open", "high", "low", "close", "volume"])
-            # Strip timezone suffix from IB timestamp strings and parse only date & time
-            ts_clean = df_chunk["ts"].astype(str).str.extract(r'^(\d{8} \d{2}:\d{2}:\d{2})')[0]
-            df_chunk["ts"] = pd.to_datetime(ts_clean, format="%Y%m%d %H:%M:%S")
-            df_chunk.set_index("ts", inplace=True)
-            dfs.append(df_chunk)
-
-        current_start = current_end
-
-    app.disconnect()
-    thread.join()
-
-    if dfs:
-        return pd.concat(dfs).sort_index()
-    else:
-        return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
+    return contract
+
+
+def fetch_ib_data(symbol, exchange, currency, start_date, end_date, bar_size=BAR_SIZE, sec_type='STK', session: IBSession=None):
+    """
+    Fetch the bars of a symbol over [start_date, end_date) in the longest chunks that IB allows for `bar_size`,
+    with the chunks in flight concurrently on `session`. A new session is opened for this symbol only if None.
+    """
+    if session is None:
+        with open_session() as session:
+            return fetch_ib_data(symbol, exchange, currency, start_date, end_date, bar_size=bar_size, sec_type=sec_type, session=session)
+
+    contract = get_contract(symbol, exchange, currency, sec_type=sec_type)
+    return session.fetch_bars(contract, plan_chunks(start_date, end_date, bar_size), bar_size)
+
+
+def _fetch_and_write(dl_client: DatalakeClient, session: IBSession, jobs: typing.List[tuple], how: str, bar_size: str=BAR_SIZE):
+    """
+    Fetch and write the bars of (asset_type, asset, contract, ranges) jobs, the ranges being [start_date, end_date).
+
+    The chunks of a batch of `SYMBOLS_PER_BATCH` symbols are interleaved so that the per contract pacing rules do not
+    slow the batch down, and the symbols are written once their batch completes.
+    """
+    chunks = {
+        (asset_type, asset): [
+            ((asset_type, asset), contract, end_datetime, duration)
+            for start_date, end_date in ranges
+            for end_datetime, duration in plan_chunks(start_date, end_date, bar_size)
+        ]
+        for asset_type, asset, contract, ranges in jobs
+    }
+    batches = [list(chunks)[i:i + SYMBOLS_PER_BATCH] for i in range(0, len(chunks), SYMBOLS_PER_BATCH)]
+    batch_items = [
+        [item for group in itertools.zip_longest(*(chunks[key] for key in batch)) for item in group if item is not None]
+        for batch in batches
+    ]
+    # REMINDER: project from the contract keys used by the pacing, in the order the requests are sent
+    wall_time = project_wall_time(
+        [(item[1].symbol, item[1].secType, item[1].exchange, 'TRADES') for items in batch_items for item in items],
+        bar_size,
+        max_in_flight=session.max_in_flight,
+    )
+    logger.info(
+        f'Fetching {sum(len(items) for items in batch_items)} requests of {bar_size} bars for {len(chunks)} symbols, '
+        f'projected wall time {pd.Timedelta(seconds=round(wall_time))}'
+    )
+
+    for batch, items in zip(batches, batch_items):
+        frames = session.fetch_chunks(items, bar_size)
+        for asset_type, asset in batch:
+            try:
+                df = concat_bars(frames[(asset_type, asset)])
+                if not df.empty:
+                    dl_client.write_partitioned(
+                        DATA_SOURCE,
+                        asset_type,
+                        asset,
+                        data=df,
+                        ver_name='min_bar',
+                        how=how,
+                    )
+            except Exception as e:
+                logger.error(f"Failed to upload data for {asset_type}/{asset}: {e}")
 
 
 def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
@@ -152,52 +144,38 @@ def add_data(dl_client: DatalakeClient, start_date: str, end_date: str):
     # Register data source
     dl_client.add_data_source(DATA_SOURCE, data_menu)
 
-    for asset_type in data_menu:
-        for asset in data_menu[asset_type]:
-            if asset_type == 'fx':
-                symbol = asset  # may require mapping for IB contract format
-            else:
-                symbol = asset
-
-            try:
-                df = fetch_ib_data(symbol, 'SMART', 'USD', start_date, end_date)
-                if not df.empty:
-                    df['date'] = df.index.date
-                    for day, df_day in df.groupby('date'):
-                        df_day = df_day.drop(columns=['date'])
-                        dl_client.add_data(
-                            DATA_SOURCE,
-                            asset_type,
-                            asset,
-                            data=df_day,
-                            ver_name='min_bar',
-                            date=day.strftime('%Y-%m-%d'),
-                        )
-            except Exception as e:
-                logger.error(f"Failed to fetch or upload data for {asset_type}/{asset}: {e}")
-
-
-def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts: typing.Optional[typing.List[str]]=None, asset_type: str='stock'):
-    new_pdts = if_update_data_menu(pdts, dl_client, DATA_SOURCE, asset_type=asset_type)
-    if len(new_pdts) > 0:
-        logger.info(f'Added {new_pdts=} to the data menu under `{asset_type}`.')
+    jobs = [
+        # fx may require mapping for IB contract format
+        (asset_type, asset, get_contract(asset, 'SMART', 'USD'), [(start_date, end_date)])
+        for asset_type in data_menu
+        for asset in data_menu[asset_type]
+    ]
+    # REMINDER: one session is shared by all the symbols instead of a connection per symbol
+    with open_session() as session:
+        _fetch_and_write(dl_client, session, jobs, how='add')
+
+
+def update_data(dl_client: DatalakeClient, start_date: str, end_date: str, pdts: typing.Optional[typing.List[str]]=None, asset_type: str='stock', plan: dict=None):
+    # REMINDER: with a `plan` (see `DatalakeClient.plan_update`), only its ranges are requested
+    if pdts is not None:
+        new_pdts = if_update_data_menu(pdts, dl_client, DATA_SOURCE, asset_type=asset_type)
+        if len(new_pdts) > 0:
+            logger.info(f'Added {new_pdts=} to the data menu under `{asset_type}`.')
     data_menu = dl_client.get_data_menu(DATA_SOURCE, flatten=False)
+    if pdts is None:
+        # update all the pdts of the data menu
+        pdts = [asset for assets in data_menu.values() for asset in assets]
         
+    jobs = []
     for asset_type in data_menu:
         for asset in data_menu[asset_type]:
             if asset in pdts:
                 # only update the specified pdts if any
-                df = fetch_ib_data(asset, 'SMART', 'USD', start_date, end_date, sec_type=CONVERTOR[asset_type])
-                if not df.empty:
-                    df['date'] = df.index.date
-                    for day, df_day in df.groupby('date'):
-                        df_day = df_day.drop(columns=['date'])
-                        dl_client.update_data(
-                            DATA_SOURCE,
-                            asset_type,
-                            asset,
-                            data=df_day,
-                            ver_name='min_bar',
-                            date=day.strftime('%Y-%m-%d'),
-                            how='replace',
-                        )
+                ranges = get_plan_ranges(plan, asset_type, asset, start_date, end_date)
+                if plan is not None:
+                    # the planned end dates are inclusive
+                    ranges = [(range_start, (pd.Timestamp(range_end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')) for range_start, range_end in ranges]
+                if len(ranges) > 0:
+                    jobs.append((asset_type, asset, get_contract(asset, 'SMART', 'USD', sec_type=CONVERTOR[asset_type]), ranges))
+    with open_session() as session:
+        _fetch_and_write(dl_client, session, jobs, how='replace')
@@ -6,9 +6,11 @@ import yfinance as yf
 from trading_data.datalake_client import DatalakeClient
 from trading_data.common.ticker_groups import download_sp500_list
 from trading_data.logger import get_logger
+from trading_data.update_planner import get_plan_ranges
 
 
 DATA_SOURCE = 'yfinance'
+VER_NAME = 'day_bar'  # the version written by `update_data`
 
 logger = get_logger(__name__, logger_lv='info')
 
@@ -26,7 +28,8 @@ def download_market_data(ticker, start_date, end_date):
     return data
 
 
-def update_data(dl_client: DatalakeClient, start_date, end_date, pdts=None):
+def update_data(dl_client: DatalakeClient, start_date, end_date, pdts=None, plan: dict=None):
+    # REMINDER: with a `plan` (see `DatalakeClient.plan_update`), only its ranges are downloaded
     data_menu = dl_client.get_data_menu(DATA_SOURCE)
     for asset_type in data_menu:
         for asset in data_menu[asset_type]:
@@ -35,22 +38,28 @@ def update_data(dl_client: DatalakeClient, start_date, end_date, pdts=None):
                     external_asset = f'{asset}=X'
                 else:
                     external_asset = asset
-                df = download_market_data(external_asset, start_date, end_date)
-
-                columns = ['open', 'high', 'low', 'close', 'volume']
-                df.columns =columns
-                df.index.name = 'ts'  # the `Date` is set as index
-                # Convert 'ts' column to datetime and set as index
-                df.index = pd.to_datetime(df.index)
-                # df.set_index('ts', inplace=True)
-
-                dl_client.update_data(
-                    DATA_SOURCE,
-                    asset_type,
-                    asset,
-                    data=df,
-                    ver_name='day_bar',
-                )
+                for range_start, range_end in get_plan_ranges(plan, asset_type, asset, start_date, end_date):
+                    if plan is not None:
+                        # the planned end date is inclusive, the end date of yfinance is not
+                        range_end = (pd.Timestamp(range_end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+                    df = download_market_data(external_asset, range_start, range_end)
+                    if df.empty:
+                        continue
+
+                    columns = ['open', 'high', 'low', 'close', 'volume']
+                    df.columns =columns
+                    df.index.name = 'ts'  # the `Date` is set as index
+                    # Convert 'ts' column to datetime and set as index
+                    df.index = pd.to_datetime(df.index)
+                    # df.set_index('ts', inplace=True)
+
+                    dl_client.update_data(
+                        DATA_SOURCE,
+                        asset_type,
+                        asset,
+                        data=df,
+                        ver_name='day_bar',
+                    )
             else:
                 raise ValueError(f'asset_type={asset_type} is not in the menu')
 
@@ -1,14 +1,37 @@
 import re
 import os
+import copy
+import pickle
+import hashlib
+import time
 import typing
+import functools
+from contextlib import contextmanager, ExitStack, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from tqdm import tqdm
 from datetime import datetime
 # from importlib import import_module
 import yaml
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from trading_data.types import DataVersionType
+from trading_data.common.date_ranges import get_dates, get_months
+from trading_data.table_cache import TableCache
+from trading_data.atomic import atomic_write_path, file_lock, get_stripe_lock_path
+from trading_data.rollups import ROLLUP_FREQS, aggregate_ohlcv, get_bucket_labels
+from trading_data.streaming import iter_merged_chunks
+from trading_data.tick_bars import TickBarBuilder
+from trading_data.tick_store import BUY_SIDE, TickPartitionWriter
+from trading_data.update_planner import DEFAULT_SETTLE_DAYS, PLAN_COLUMNS, get_checked_key, get_expected_dates, plan_dates
+from trading_data.universe_cube import CUBE_FIELDS, UniverseCube, build_cube, get_universe_key, load_cube, save_cube
+from trading_data import arrow_io, sql_engine
+from trading_data.partitions import GRANULARITIES, get_partition_bounds, plan_partition_reads, split_partition_reads, get_bounds_filters, get_range_filters, get_excluded_mask, overlaps_date_range
+from trading_data.storage_profiles import DEFAULT_VERSION_PROFILES, prepare_for_write, get_storage_profile
+from trading_data.deltas import DELTA_DIR_NAME, get_delta_dir, get_next_delta_path, list_delta_files, merge_arrow_tables, merge_tables, remove_deltas, remove_empty_delta_root
+from trading_data.catalog import PartitionCatalog, describe_partition, parse_partition_filename, read_footer_stats
 from trading_data.timescaledb import utils as timescaledb_utils
 from trading_data.timescaledb.models import *
 
@@ -45,14 +68,89 @@ def select_by_date_range(df, start_date, end_date):
     return filtered_df
 
 
+DEFAULT_ROW_GROUP_SIZE = 50000  # rows per row group, small enough for the ts statistics to prune reads
+
+
+def get_date_range_filters(start_date=None, end_date=None) -> typing.Optional[typing.List[tuple]]:
+    filters = []
+    if start_date is not None:
+        filters.append(('ts', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(('ts', '<=', pd.Timestamp(end_date)))
+    return filters or None
+
+
+def read_parquet_table(file_path, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Read a parquet table with `columns` projected and `filters` pushed down to the row group statistics.
+    """
+    read_columns = None
+    if columns is not None and isinstance(columns, list):
+        # REMINDER: the `ts` index is always restored by the pandas metadata
+        read_columns = [column for column in columns if column != 'ts']
+    df = pd.read_parquet(file_path, columns=read_columns, filters=filters)
+    # REMINDER: tables are written with `ts` as the index, bring it back as a column
+    if df.index.name == 'ts':
+        df = df.reset_index()
+    if columns is not None and isinstance(columns, list):
+        df = df[columns]
+    return df
+
+
+def write_parquet_table(df: pd.DataFrame, file_path, row_group_size: int=DEFAULT_ROW_GROUP_SIZE, profile=None):
+    """
+    Write a table sorted by ts with row groups of a controlled size, so that readers can prune row groups by ts.
+    `profile` is the storage profile (dtypes, codec and encodings) to apply, see `storage_profiles`.
+    """
+    if df.index.name == 'ts' and not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    elif 'ts' in df.columns and not df['ts'].is_monotonic_increasing:
+        df = df.sort_values('ts', kind='stable')
+    df, write_kwargs = prepare_for_write(df, profile)
+    # REMINDER: written to a temporary file and renamed, readers never observe a half-written file
+    with atomic_write_path(file_path) as tmp_file_path:
+        df.to_parquet(tmp_file_path, index=True, row_group_size=row_group_size, **write_kwargs)
+
+
+INDEX_FINGERPRINT_PREFIX = '_fingerprint.'
+_INDEX_WORKER_CLIENT = None  # the client of an index worker process
+
+
+def _init_index_worker(datalake_dir):
+    global _INDEX_WORKER_CLIENT
+    _INDEX_WORKER_CLIENT = DatalakeClient(datalake_dir)
+
+
+def _compute_ticker_indexes(dl_client, data_source, ver_name, asset_type, ticker, index_functions: dict) -> dict:
+    df = dl_client.get_table(data_source, ticker, ver_name, asset_type=asset_type)
+    return {index_name: index_function(df) for index_name, index_function in index_functions.items()}
+
+
+def _compute_ticker_indexes_in_worker(*args) -> dict:
+    return _compute_ticker_indexes(_INDEX_WORKER_CLIENT, *args)
+
+
 # data lake client object: for data selection, loading and transformation
 class DatalakeClient:
     DEFAULT_DATALAKE_DIR = os.path.join(os.getenv('HOME'), '.trading-data')
-    def __init__(self, datalake_dir=None):
+    DEFAULT_MAX_WORKERS = 8  # number of threads for loading partitions concurrently
+    DEFAULT_MAX_DELTAS = 16  # number of delta files of a partition before they are folded into it
+    def __init__(self, datalake_dir=None, cache_size: int=None):
+        """
+        Args:
+            datalake_dir (str, optional): root directory of the datalake. Defaults to `~/.trading-data`.
+            cache_size (int, optional): byte budget of the in-process table cache. The cache is disabled if None.
+        """
         self.datalake_dir = datalake_dir
         if not self.datalake_dir:
             self.datalake_dir = self.DEFAULT_DATALAKE_DIR
 
+        self._cache = TableCache(cache_size) if cache_size else None
+        self._data_menus = {}  # data_source -> (mtime, data_menu, set of (asset_type, asset))
+        self._storage_profiles = {}  # (data_source, ver_name) -> storage profile name
+        self._deferred_rollups = None  # data_source -> {(asset_type, ticker): set of dates} while rollups are deferred
+        self._catalogs = {}  # data_source -> PartitionCatalog
+
         # create the datalake directory if not exists
         if not os.path.exists(self.datalake_dir):
             print(f'Creating datalake directory at {self.datalake_dir}')
@@ -69,20 +167,358 @@ class DatalakeClient:
         asset_type = list(data_menu.keys())[0]
         asset = data_menu[asset_type][0]
 
-        ver_dir = os.path.join(self.datalake_dir, data_source, ver_name)
+        catalog = self.get_catalog(data_source)
+        start_ts, end_ts = None, None
+        if catalog is not None:
+            # REMINDER: (None, None) if the asset has no catalog rows for this version, the files are read instead
+            start_ts, end_ts = catalog.get_time_period(ver_name, asset_type=asset_type, ticker=asset)
         if ver_name != 'day_bar':
+            if start_ts is not None:
+                return start_ts[:10], end_ts[:10]
             # extract the dates from file_names
-            dates = [extract_info_from_filename(file_name, ver_name)[1] for file_name in os.listdir(ver_dir) if asset in file_name]
-            # sort the dates and then return the starting date and ending date, dates are in string
-            # extend my code here
-            sorted_dates = sorted(dates, key=lambda d: datetime.strptime(d, "%Y-%m-%d"))  # Replace "%Y-%m-%d" with your date format
-            return sorted_dates[0], sorted_dates[-1]  # Return the first and last date from the sorted list
+            partitions = self.get_partitions(data_source, asset, ver_name, asset_type=asset_type)
+            if len(partitions) == 0:
+                raise FileNotFoundError(f'No {ver_name} partitions of {asset_type}/{asset} in {data_source}' + (', use `build_catalog` if the catalog is out of date' if catalog is not None else ''))
+            ver = self._convert_ver_name_to_ver(ver_name)
+            # REMINDER: compacted partitions span many days, take their ts range from the parquet footers
+            start_ts = read_footer_stats(self.get_file_path(data_source, asset, ver, asset_type=asset_type, date=partitions[0]))[1]
+            end_ts = read_footer_stats(self.get_file_path(data_source, asset, ver, asset_type=asset_type, date=partitions[-1]))[2]
+            return pd.Timestamp(start_ts).strftime('%Y-%m-%d'), pd.Timestamp(end_ts).strftime('%Y-%m-%d')
         else:
-            df = self.get_table(data_source, asset, 'day_bar')
+            if start_ts is not None:
+                return pd.Timestamp(start_ts), pd.Timestamp(end_ts)
+            df = self.get_table(data_source, asset, 'day_bar', asset_type=asset_type)
             start_date = df.loc[0, 'ts']
             end_date = df.loc[len(df) - 1, 'ts']
             return start_date, end_date
-    
+
+    def _get_catalog_path(self, data_source):
+        return os.path.join(self.datalake_dir, f'{data_source}_catalog.sqlite')
+
+    def get_catalog(self, data_source) -> typing.Optional[PartitionCatalog]:
+        """
+        Get the partition catalog of a data source. Returns None if the data source is not cataloged yet,
+        use `build_catalog` to create the catalog of an existing data source.
+        """
+        if data_source not in self._catalogs:
+            if not os.path.exists(self._get_catalog_path(data_source)):
+                return None
+            self._catalogs[data_source] = PartitionCatalog(self._get_catalog_path(data_source))
+        return self._catalogs[data_source]
+
+    def build_catalog(self, data_source) -> PartitionCatalog:
+        """
+        (Re)build the partition catalog of a data source from the files in the datalake.
+        Only the parquet footers are read.
+        """
+        catalog = PartitionCatalog(self._get_catalog_path(data_source))
+        self._catalogs[data_source] = catalog
+        data_menu = self.get_data_menu(data_source)
+        data_source_dir = os.path.join(self.datalake_dir, data_source)
+        for ver_name in sorted(os.listdir(data_source_dir)):
+            ver_dir = os.path.join(data_source_dir, ver_name)
+            if not os.path.isdir(ver_dir):
+                continue
+            records = []
+            for file_name in tqdm(sorted(os.listdir(ver_dir)), desc=f'Cataloging {data_source}/{ver_name}'):
+                info = parse_partition_filename(file_name, list(data_menu.keys()))
+                if info is None:
+                    continue
+                asset_type, ticker, partition = info
+                records.append(describe_partition(os.path.join(ver_dir, file_name), asset_type, ticker, ver_name, partition))
+            catalog.clear(ver_name)
+            catalog.upsert(records)
+        return catalog
+
+    def _register_partition(self, data_source, asset_type, ticker, ver_name, file_path, date=None, data=None):
+        catalog = self.get_catalog(data_source)
+        if catalog is not None:
+            catalog.upsert([describe_partition(file_path, asset_type, ticker, ver_name, partition=date, data=data)])
+
+    def get_storage_profile(self, data_source, ver_name) -> typing.Optional[str]:
+        key = (data_source, ver_name)
+        if key not in self._storage_profiles:
+            catalog = self.get_catalog(data_source)
+            profile = catalog.get_setting(f'storage_profile.{ver_name}') if catalog is not None else None
+            self._storage_profiles[key] = profile or DEFAULT_VERSION_PROFILES.get(ver_name)
+        return self._storage_profiles[key]
+
+    def set_storage_profile(self, data_source, ver_name, profile: str):
+        """
+        Set the storage profile used by all subsequent writes of a version. Existing partitions are left untouched,
+        use `apply_storage_profile` to rewrite them.
+        """
+        get_storage_profile(profile)  # validate the profile
+        catalog = self.get_catalog(data_source) or self.build_catalog(data_source)
+        catalog.set_setting(f'storage_profile.{ver_name}', profile)
+        self._storage_profiles[(data_source, ver_name)] = profile
+
+    def apply_storage_profile(self, data_source, ver_name, profile: str, tickers: typing.List[str]=None, dry_run: bool=False) -> pd.DataFrame:
+        """
+        Rewrite the existing partitions of a version with a storage profile and report the size and read time deltas
+        per partition. With `dry_run`, the partitions are only rewritten to temporary files and measured.
+        """
+        get_storage_profile(profile)  # validate the profile
+        df_partitions = self.list_partitions(data_source, ver_name)
+        if tickers is not None:
+            df_partitions = df_partitions[df_partitions['ticker'].isin(tickers)]
+        if not dry_run:
+            self.set_storage_profile(data_source, ver_name, profile)
+
+        report = []
+        for asset_type, ticker, partition, file_name, file_path in tqdm(df_partitions[['asset_type', 'ticker', 'partition', 'file_name', 'file_path']].itertuples(index=False), total=len(df_partitions), desc=f'Applying {profile=}'):
+            # the partition is rewritten under its lock so that concurrent writes are not lost
+            with nullcontext() if dry_run else self._partition_locks([file_path]):
+                # REMINDER: the pending deltas are folded into the rewritten file, so that the catalog counts their rows
+                delta_file_paths = list_delta_files(file_path)
+                start = time.perf_counter()
+                df = self._read_merged_file(file_path, delta_file_paths)
+                old_read_s = time.perf_counter() - start
+                old_bytes = sum(os.path.getsize(path) for path in [file_path] + delta_file_paths)
+
+                tmp_file_path = os.path.join(os.path.dirname(file_path), f'.{file_name}.tmp')
+                write_parquet_table(df, tmp_file_path, profile=profile)
+                start = time.perf_counter()
+                pd.read_parquet(tmp_file_path)
+                new_read_s = time.perf_counter() - start
+                new_bytes = os.path.getsize(tmp_file_path)
+
+                if dry_run:
+                    os.remove(tmp_file_path)
+                else:
+                    os.replace(tmp_file_path, file_path)
+                    self._invalidate_cache(file_path)
+                    self._remove_folded_deltas(file_path, delta_file_paths)
+                    self._register_partition(data_source, asset_type, ticker, ver_name, file_path, date=partition, data=df)
+            report.append({
+                'file_name': file_name,
+                'old_bytes': old_bytes,
+                'new_bytes': new_bytes,
+                'bytes_ratio': new_bytes / old_bytes if old_bytes else None,
+                'old_read_s': old_read_s,
+                'new_read_s': new_read_s,
+                'read_s_delta': new_read_s - old_read_s,
+            })
+        return pd.DataFrame(report, columns=['file_name', 'old_bytes', 'new_bytes', 'bytes_ratio', 'old_read_s', 'new_read_s', 'read_s_delta'])
+
+    def list_partitions(self, data_source, ver_name, asset_type=None, ticker=None, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        List the partition files of a version, from the catalog if there is one, otherwise from a single directory scan.
+        """
+        ver_dir = os.path.join(self.datalake_dir, data_source, ver_name)
+        catalog = self.get_catalog(data_source)
+        if catalog is not None:
+            df = catalog.query(ver_name, asset_type=asset_type, ticker=ticker, start_date=start_date, end_date=end_date)
+            df = df[['asset_type', 'ticker', 'partition', 'file_name']]
+        else:
+            data_menu = self.get_data_menu(data_source)
+            rows = []
+            if os.path.exists(ver_dir):
+                for file_name in os.listdir(ver_dir):
+                    info = parse_partition_filename(file_name, list(data_menu.keys()))
+                    if info is not None:
+                        rows.append((*info, file_name))
+            df = pd.DataFrame(rows, columns=['asset_type', 'ticker', 'partition', 'file_name'])
+            mask = pd.Series(True, index=df.index)
+            if asset_type is not None:
+                mask &= df['asset_type'] == asset_type
+            if ticker is not None:
+                mask &= df['ticker'] == ticker
+            # REMINDER: without a catalog the partitions are filtered by their names, unpartitioned files are always kept
+            if start_date is not None or end_date is not None:
+                mask &= [
+                    partition == '' or overlaps_date_range(partition, start_date, end_date)
+                    for partition in df['partition']
+                ]
+            df = df[mask].sort_values(['asset_type', 'ticker', 'partition'], ignore_index=True)
+        df['file_path'] = [os.path.join(ver_dir, file_name) for file_name in df['file_name']]
+        return df
+
+    @staticmethod
+    def _read_partition_dates(file_path, start_date: str, end_date: str) -> typing.Set[str]:
+        # the days with data of a file and its deltas within [start_date, end_date], only the ts column is read
+        filters = get_bounds_filters((pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1)))
+        dates = set()
+        for path in [file_path] + list_delta_files(file_path):
+            ts = arrow_io.to_numpy(arrow_io.read_arrow_table(path, ['ts'], filters), 'ts')
+            dates.update(np.datetime_as_string(np.unique(ts.astype('datetime64[D]')), unit='D').tolist())
+        return dates
+
+    def _get_coverage(self, data_source, ver_name, start_date: str, end_date: str) -> dict:
+        """
+        Get (asset_type, ticker) -> (covered dates, first date, last date, stale dates) of the existing data of a version,
+        the covered and stale dates within [start_date, end_date] only.
+        """
+        ver_dir = os.path.join(self.datalake_dir, data_source, ver_name)
+        catalog = self.get_catalog(data_source)
+        records = []  # (asset_type, ticker, first date, last date, updated_at, file path or None for a daily file) per partition
+        if catalog is not None:
+            df = catalog.query(ver_name, start_date=start_date, end_date=end_date)
+            for row in df.itertuples(index=False):
+                if pd.isna(row.min_ts):
+                    continue
+                file_path = os.path.join(ver_dir, row.file_name) if len(row.partition) != GRANULARITIES['day'] else None
+                records.append((row.asset_type, row.ticker, row.min_ts[:10], row.max_ts[:10], row.updated_at, file_path))
+        else:
+            # REMINDER: without a catalog the ts ranges of the compacted and unpartitioned files are read from their footers
+            df = self.list_partitions(data_source, ver_name)
+            for row in df.itertuples(index=False):
+                file_paths = [row.file_path] + list_delta_files(row.file_path)
+                updated_at = datetime.fromtimestamp(max(os.path.getmtime(path) for path in file_paths)).isoformat(sep=' ')
+                if len(row.partition) == GRANULARITIES['day']:
+                    records.append((row.asset_type, row.ticker, row.partition, row.partition, updated_at, None))
+                    continue
+                ts_ranges = [read_footer_stats(path)[1:] for path in file_paths]
+                min_ts = [ts for ts, _ in ts_ranges if ts is not None]
+                max_ts = [ts for _, ts in ts_ranges if ts is not None]
+                if len(min_ts) == 0:
+                    continue
+                records.append((row.asset_type, row.ticker, pd.Timestamp(min(min_ts)).strftime('%Y-%m-%d'), pd.Timestamp(max(max_ts)).strftime('%Y-%m-%d'), updated_at, row.file_path))
+
+        coverage = {}
+        for asset_type, ticker, first_date, last_date, updated_at, file_path in records:
+            ticker_coverage = coverage.setdefault((asset_type, ticker), [set(), first_date, last_date, set()])
+            ticker_coverage[1] = min(ticker_coverage[1], first_date)
+            ticker_coverage[2] = max(ticker_coverage[2], last_date)
+            if first_date <= end_date and last_date >= start_date:
+                if file_path is None:
+                    ticker_coverage[0].add(first_date)
+                else:
+                    # REMINDER: a compacted (or unpartitioned) file may have holes between its first and last days
+                    ticker_coverage[0].update(self._read_partition_dates(file_path, max(first_date, start_date), min(last_date, end_date)))
+                # a partition written before its last day ended may miss the end of that day
+                if last_date <= end_date and pd.Timestamp(updated_at) < pd.Timestamp(last_date) + pd.Timedelta(days=1):
+                    ticker_coverage[3].add(last_date)
+        if catalog is not None:
+            # the partitions out of range were not listed, take the first and last dates from the ts ranges of the tickers
+            for row in catalog.get_time_periods(ver_name).dropna().itertuples(index=False):
+                if (row.asset_type, row.ticker) in coverage:
+                    coverage[(row.asset_type, row.ticker)][1:3] = [row.min_ts[:10], row.max_ts[:10]]
+                else:
+                    coverage[(row.asset_type, row.ticker)] = [set(), row.min_ts[:10], row.max_ts[:10], set()]
+        return {key: tuple(value) for key, value in coverage.items()}
+
+    def plan_update(
+            self,
+            data_source,
+            ver_name,
+            start_date,
+            end_date,
+            tickers: typing.List[str]=None,
+            only_missing: bool=True,
+            fill_head: bool=False,
+            recheck: bool=False,
+        ) -> pd.DataFrame:
+        """
+        Plan the fetches of an update of [start_date, end_date] (both inclusive), one row per range of a ticker of the
+        data menu (`update_planner.PLAN_COLUMNS`). Use `update_planner.to_fetch_plan` to hand it to a data source.
+
+        With `only_missing`, the ranges only cover the days that are missing or stale: the days after the existing data
+        (`tail`), the holes in between (`gap`, business days only for non crypto asset types), the days written before
+        they ended (`stale`) and the whole range of the new tickers (`new`). The days before the existing data (`head`)
+        are only planned with `fill_head`, and the days recorded as empty upstream by `record_checked_dates` are
+        skipped unless `recheck`. Otherwise every ticker gets the whole range.
+        """
+        start_date = pd.Timestamp(start_date).strftime('%Y-%m-%d')
+        end_date = pd.Timestamp(end_date).strftime('%Y-%m-%d')
+        coverage = self._get_coverage(data_source, ver_name, start_date, end_date) if only_missing else {}
+        catalog = self.get_catalog(data_source)
+        checked = catalog.get_setting(get_checked_key(ver_name), {}) if catalog is not None and only_missing and not recheck else {}
+        rows = []
+        for asset_type, assets in self.get_data_menu(data_source).items():
+            expected_dates = get_expected_dates(asset_type, start_date, end_date)
+            for asset in assets:
+                if tickers is not None and asset not in tickers:
+                    continue
+                if not only_missing:
+                    ranges = [(start_date, end_date, len(expected_dates), 'full')] if len(expected_dates) > 0 else []
+                else:
+                    covered_dates, first_date, last_date, stale_dates = coverage.get((asset_type, asset), (set(), None, None, set()))
+                    ranges = plan_dates(
+                        expected_dates,
+                        covered_dates,
+                        first_date=first_date,
+                        last_date=last_date,
+                        stale_dates=stale_dates,
+                        skipped_dates=set(checked.get(f'{asset_type}/{asset}', [])),
+                        fill_head=fill_head,
+                    )
+                rows.extend((asset_type, asset, *fetch_range) for fetch_range in ranges)
+        return pd.DataFrame(rows, columns=PLAN_COLUMNS)
+
+    def record_checked_dates(self, data_source, ver_name, plan: pd.DataFrame, settle_days: int=DEFAULT_SETTLE_DAYS) -> int:
+        """
+        Record the planned days that are still missing after an update as empty upstream (holidays, outages, days
+        before a listing), so that the next plans skip them. Only the days older than `settle_days` and before the last
+        day of data of their ticker are recorded, a day that may not be published yet or a failed update of the new
+        days are retried. Requires the catalog. Returns the number of recorded days.
+        """
+        catalog = self.get_catalog(data_source)
+        if catalog is None or len(plan) == 0:
+            return 0
+        settled_date = (pd.Timestamp.today().normalize() - pd.Timedelta(days=settle_days)).strftime('%Y-%m-%d')
+        coverage = self._get_coverage(data_source, ver_name, plan['start_date'].min(), plan['end_date'].max())
+        key = get_checked_key(ver_name)
+        checked = catalog.get_setting(key, {})
+        n_recorded = 0
+        for row in plan.itertuples(index=False):
+            covered_dates, _, last_date, _ = coverage.get((row.asset_type, row.ticker), (set(), None, None, set()))
+            if last_date is None:
+                continue
+            empty_dates = [
+                date for date in get_expected_dates(row.asset_type, row.start_date, row.end_date)
+                if date not in covered_dates and date < last_date and date <= settled_date
+            ]
+            if len(empty_dates) > 0:
+                entry = f'{row.asset_type}/{row.ticker}'
+                checked[entry] = sorted(set(checked.get(entry, [])) | set(empty_dates))
+                n_recorded += len(empty_dates)
+        if n_recorded > 0:
+            catalog.set_setting(key, checked)
+        return n_recorded
+
+    @staticmethod
+    def _forget_checked_dates(catalog: PartitionCatalog, ver_name, asset_type, ticker, dates: typing.List[str]):
+        # the days recorded as empty upstream that have data by now are no longer skipped
+        key = get_checked_key(ver_name)
+        checked = catalog.get_setting(key, {})
+        entry = f'{asset_type}/{ticker}'
+        remaining = sorted(set(checked.get(entry, [])) - set(dates))
+        if len(remaining) == len(checked.get(entry, [])):
+            return
+        if len(remaining) > 0:
+            checked[entry] = remaining
+        else:
+            del checked[entry]
+        catalog.set_setting(key, checked)
+
+    def cache_info(self) -> typing.Optional[dict]:
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def clear_cache(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _invalidate_cache(self, file_path):
+        if self._cache is not None:
+            self._cache.invalidate(file_path)
+
+    def _read_table(self, file_path, columns=None, filters=None) -> pd.DataFrame:
+        if self._cache is None:
+            return read_parquet_table(file_path, columns, filters)
+        key = TableCache.make_key(file_path, columns) + (tuple(filters) if filters is not None else None, )
+        df = self._cache.get(key)
+        if df is None:
+            df = read_parquet_table(file_path, columns, filters)
+            if 'ts' in df.columns:
+                # parse `ts` once so that cached tables do not need to be parsed again
+                df['ts'] = pd.to_datetime(df['ts'])
+            self._cache.put(key, df)
+            df = df.copy()
+        return df
+
     def get_data_sources(self):
         return [
             filename.replace('_data_menu.yaml', '')
@@ -90,66 +526,198 @@ class DatalakeClient:
             if filename.endswith('_data_menu.yaml')
         ]
     
+    def _load_data_menu(self, data_source):
+        # REMINDER: the parsed data_menu is reused until the yaml file is modified
+        data_menu_file = os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml')
+        mtime = os.stat(data_menu_file).st_mtime_ns
+        cached = self._data_menus.get(data_source)
+        if cached is None or cached[0] != mtime:
+            with open(data_menu_file, 'r') as f:
+                data_menu = yaml.safe_load(f)
+            assets = {(asset_type, asset) for asset_type in data_menu for asset in data_menu[asset_type]}
+            cached = (mtime, data_menu, assets)
+            self._data_menus[data_source] = cached
+        return cached
+
+    def _check_data_menu(self, data_source, asset_type, asset):
+        data_menu, assets = self._load_data_menu(data_source)[1:]
+        assert asset_type in data_menu
+        assert (asset_type, asset) in assets
+
     def get_data_menu(self, data_source, flatten=False):
         # load the data_menu first
-        with open(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml'), 'r') as f:
-            data_menu = yaml.safe_load(f)
+        data_menu = copy.deepcopy(self._load_data_menu(data_source)[1])
         if flatten:
             data_menu = [item for sublist in data_menu.values() for item in sublist]
         return data_menu
     
+    def _data_menu_lock(self, data_source):
+        return file_lock(os.path.join(self.datalake_dir, '.locks', f'{data_source}_data_menu.lock'))
+
+    def _write_data_menu(self, data_source, data_menu):
+        with atomic_write_path(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml')) as tmp_file_path:
+            with open(tmp_file_path, 'w') as f:
+                yaml.safe_dump(data_menu, f)
+        self._data_menus.pop(data_source, None)
+
     def update_data_menu(self, data_source, data_menu):
         # load the data_menu first
-        with open(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml'), 'w') as f:
-            yaml.safe_dump(data_menu, f)
+        with self._data_menu_lock(data_source):
+            self._write_data_menu(data_source, data_menu)
+
+    def add_to_data_menu(self, data_source, asset_type, assets: typing.List[str]) -> typing.List[str]:
+        """
+        Add assets to the data menu, the read-modify-write of the menu is done under its lock so that concurrent
+        ingestions do not lose entries.
+
+        Returns:
+            List[str]: the assets that were not in the data menu yet.
+        """
+        with self._data_menu_lock(data_source):
+            self._data_menus.pop(data_source, None)  # always re-read the menu under the lock
+            data_menu = self.get_data_menu(data_source)
+            current_assets = data_menu.setdefault(asset_type, [])
+            new_assets = [asset for asset in dict.fromkeys(assets) if asset not in current_assets]
+            if len(new_assets) > 0:
+                current_assets.extend(new_assets)
+                self._write_data_menu(data_source, data_menu)
+        return new_assets
         
-    def get_index(self, data_source):
+    def _read_index_file(self, data_source) -> typing.Optional[pd.DataFrame]:
         index_file_path = os.path.join(self.datalake_dir, f'{data_source}/_index.parquet')
+        if not os.path.exists(index_file_path):
+            return None
         df_index = pd.read_parquet(index_file_path)
+        if 'asset_type' not in df_index.columns:
+            # REMINDER: the indexes written before they were keyed by (asset_type, ticker) get the asset types of the data menu,
+            #   the rows of tickers listed under several asset types are ambiguous and dropped (recomputed by create_indexes)
+            data_menu = self.get_data_menu(data_source)
+            df_asset_types = pd.DataFrame(
+                [(asset_type, ticker) for asset_type in data_menu for ticker in data_menu[asset_type]],
+                columns=['asset_type', 'ticker'],
+            ).drop_duplicates('ticker', keep=False)
+            df_index = df_asset_types.merge(df_index.drop_duplicates('ticker', keep=False), on='ticker', how='inner')
         return df_index
 
+    def get_index(self, data_source):
+        df_index = self._read_index_file(data_source)
+        if df_index is None:
+            raise FileNotFoundError(os.path.join(self.datalake_dir, f'{data_source}/_index.parquet'))
+        # REMINDER: the fingerprint columns are only used to update the indexes incrementally
+        return df_index[[column for column in df_index.columns if not column.startswith(INDEX_FINGERPRINT_PREFIX)]]
+
     def list_indexes(self, data_source):
-        index_file_path = os.path.join(self.datalake_dir, f'{data_source}/_index.parquet')
-        if os.path.exists(index_file_path):
-            df_index = pd.read_parquet(index_file_path)
+        if self._read_index_file(data_source) is not None:
+            df_index = self.get_index(data_source)
             return list(df_index.columns)
         return []
 
-    def _create_new_df_index(self, index_name, index_function, data_source):
+    def _create_new_df_index(self, index_functions: dict, data_source, ver_name='day_bar', df_index_old: pd.DataFrame=None, max_workers: int=None) -> pd.DataFrame:
+        """
+        Compute the indexes of all the tickers of the data menu over a process pool. A ticker is only recomputed
+        if an index is new or the fingerprint of its partitions changed since the index was computed.
+        The rows are keyed by (asset_type, ticker), as the same ticker may be listed under several asset types.
+        """
         data_menu = self.get_data_menu(data_source)
-        df_index = []
-        # TODO: now hard coded `stock` and `fx`
-        for ticker in tqdm(data_menu['stock'], desc='Iterating stocks'):
-            df = self.get_table(data_source, ticker)
-            index = index_function(df)
-            df_index.append({'ticker': ticker, index_name: index})
-        for ticker in tqdm(data_menu['stock'], desc='Iterating fx'):
-            df = self.get_table(data_source, ticker)
-            index = index_function(df)
-            df_index.append({'ticker': ticker, index_name: index})
-        df_index = pd.DataFrame(df_index)
-        return df_index
+        tickers = [(asset_type, ticker) for asset_type in data_menu for ticker in data_menu[asset_type]]
+        fingerprints = {}
+        for asset_type in data_menu:
+            ticker_fingerprints = self._get_ticker_fingerprints(data_source, ver_name, data_menu[asset_type], asset_type)
+            fingerprints.update({(asset_type, ticker): fingerprint for ticker, fingerprint in ticker_fingerprints.items()})
+
+        old_rows = {}
+        if df_index_old is not None:
+            old_rows = {(row['asset_type'], row['ticker']): row for row in df_index_old.to_dict('records')}
+        rows, tasks = [], []
+        for asset_type, ticker in tickers:
+            row = {'asset_type': asset_type, 'ticker': ticker}
+            outdated = {}
+            for index_name, index_function in index_functions.items():
+                fingerprint_column = f'{INDEX_FINGERPRINT_PREFIX}{index_name}'
+                old_row = old_rows.get((asset_type, ticker), {})
+                if old_row.get(fingerprint_column) == fingerprints[(asset_type, ticker)] and index_name in old_row:
+                    row[index_name] = old_row[index_name]
+                    row[fingerprint_column] = fingerprints[(asset_type, ticker)]
+                else:
+                    outdated[index_name] = index_function
+            rows.append(row)
+            if len(outdated) > 0:
+                tasks.append((row, asset_type, ticker, outdated))
+        if len(tasks) == 0:
+            return pd.DataFrame(rows)
+
+        max_workers = max_workers or min(self.DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+        try:
+            pickle.dumps(index_functions)
+            executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_index_worker, initargs=(self.datalake_dir, ))
+            compute = _compute_ticker_indexes_in_worker
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # REMINDER: lambdas and local functions can not be sent to other processes, compute them in threads instead
+            print('The index functions can not be pickled, computing the indexes in threads')
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            compute = functools.partial(_compute_ticker_indexes, self)
+        with executor:
+            futures = [
+                executor.submit(compute, data_source, ver_name, asset_type, ticker, outdated)
+                for _, asset_type, ticker, outdated in tasks
+            ]
+            for (row, asset_type, ticker, outdated), future in tqdm(zip(tasks, futures), total=len(tasks), desc=f'Computing indexes of {data_source}'):
+                row.update(future.result())
+                for index_name in outdated:
+                    row[f'{INDEX_FINGERPRINT_PREFIX}{index_name}'] = fingerprints[(asset_type, ticker)]
+        return pd.DataFrame(rows)
+
+    def create_index(self, data_source, index_name, index_function, ver_name='day_bar', max_workers: int=None):
+        self.create_indexes(data_source, {index_name: index_function}, ver_name=ver_name, max_workers=max_workers)
 
-    def create_index(self, data_source, index_name, index_function):
+    def create_indexes(self, data_source, index_functions: dict, ver_name='day_bar', max_workers: int=None):
+        """
+        Create or update indexes (scalars per ticker, e.g. the average volume) computed by `index_functions`
+        (index name -> function of a ticker's table) over a process pool.
+
+        Re-running with the same index names only recomputes the tickers whose data changed.
+        The index functions should be defined at module level to be computed in other processes.
+        """
         index_file_path = os.path.join(self.datalake_dir, f'{data_source}/_index.parquet')
+        df_index_old = self._read_index_file(data_source)
 
-        print(f'create a new index {index_name}')
-        # create a new index
-        df_index = self._create_new_df_index(index_name, index_function, data_source)
-        if os.path.exists(index_file_path):
-            print(f'updating the new index {index_name}')
-            # load the old index first
-            df_index_old = pd.read_parquet(index_file_path)
-            if index_name in df_index_old.columns:
-                del df_index_old[index_name]  # replace the old index
-            df_index = df_index_old.merge(df_index, on='ticker')
+        print(f'create new indexes {list(index_functions)}')
+        df_index = self._create_new_df_index(index_functions, data_source, ver_name=ver_name, df_index_old=df_index_old, max_workers=max_workers)
+        with file_lock(os.path.join(self.datalake_dir, '.locks', f'{data_source}_index.lock')):
+            # REMINDER: re-read the index under the lock, other indexes may have been written meanwhile
+            df_index_old = self._read_index_file(data_source)
+            if df_index_old is not None:
+                print(f'updating the indexes {list(index_functions)}')
+                # replace the old indexes and keep the others
+                replaced_columns = [column for column in df_index.columns if column not in ('asset_type', 'ticker')]
+                df_index_old = df_index_old.drop(columns=[column for column in replaced_columns if column in df_index_old.columns])
+                df_index = df_index_old.merge(df_index, on=['asset_type', 'ticker'], how='right')
 
-        df_index.to_parquet(index_file_path, index=False)
+            with atomic_write_path(index_file_path) as tmp_file_path:
+                df_index.to_parquet(tmp_file_path, index=False)
+
+    def screen(self, data_source, expr: str, tickers: typing.List[str]=None, asset_type: str='stock') -> typing.List[str]:
+        """
+        Screen the tickers of an asset type by a boolean expression over their indexes, evaluated in a vectorized way
+        with `DataFrame.query`, e.g. `screen('yfinance', 'avg_volume > 1e6 and price > 5')`.
+        The result can be passed to `get_tables` with the same `asset_type` directly.
+        """
+        df_index = self.get_index(data_source)
+        df_index = df_index[df_index['asset_type'] == asset_type]
+        if tickers is not None:
+            df_index = df_index[df_index['ticker'].isin(tickers)]
+        return df_index.query(expr)['ticker'].tolist()
 
     def delete_data_source(self, data_soure):
         # delete the data source
         data_menu_file = os.path.join(self.datalake_dir, f'{data_soure}_data_menu.yaml')
         os.remove(data_menu_file)
+        catalog_file = self._get_catalog_path(data_soure)
+        if os.path.exists(catalog_file):
+            os.remove(catalog_file)
+        self._catalogs.pop(data_soure, None)
+        self._storage_profiles = {key: value for key, value in self._storage_profiles.items() if key[0] != data_soure}
+        self._data_menus.pop(data_soure, None)
         # delete the data source directory
         data_source_dir = os.path.join(self.datalake_dir, data_soure)
         os.rmdir(data_source_dir)
@@ -161,8 +729,11 @@ class DatalakeClient:
         os.mkdir(os.path.join(self.datalake_dir, data_source))
 
         # write the data_menu into the datalake_dir
-        with open(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml'), 'w') as f:
-            yaml.safe_dump(data_menu, f)
+        with self._data_menu_lock(data_source):
+            self._write_data_menu(data_source, data_menu)
+
+        # new data sources are cataloged from the beginning
+        self._catalogs[data_source] = PartitionCatalog(self._get_catalog_path(data_source))
 
     def add_data(self, data_source: str, asset_type: str, asset: str, data: pd.DataFrame, ver_name, date=None):
         # assert data_source in self.get_data_sources()
@@ -170,44 +741,378 @@ class DatalakeClient:
         if not os.path.exists(ver_dir):
             os.mkdir(ver_dir)
         
+        self._check_data_menu(data_source, asset_type, asset)
+        
+        self._register_records(data_source, [self._write_partition(data_source, asset_type, asset, data, ver_name, date=date, how='add')])
+
+    def update_data(self, data_source: str, asset_type: str, asset: str, data: pd.DataFrame, ver_name, date: str=None, how='merge'):
+        assert data_source in self.get_data_sources()
+
+        self._check_data_menu(data_source, asset_type, asset)
+        
+        os.makedirs(os.path.join(self.datalake_dir, data_source, ver_name), exist_ok=True)
+        self._register_records(data_source, [self._write_partition(data_source, asset_type, asset, data, ver_name, date=date, how=how)])
+
+    def _write_partition(self, data_source, asset_type, asset, data: pd.DataFrame, ver_name, date=None, how='merge') -> typing.Optional[dict]:
+        """
+        Write a single partition, the data source and the data menu are assumed to be checked already.
+
+        Returns:
+            dict: the catalog record of the partition, None if the data source has no catalog.
+        """
+        # REMINDER: ticks may share timestamps, they can not be merged by ts
+        assert not (ver_name == 'tick' and how == 'merge'), 'ticks can only be added or replaced'
         ver = self._convert_ver_name_to_ver(ver_name)
         file_path = self.get_file_path(data_source, asset, ver, asset_type=asset_type, date=date)
+        profile = self.get_storage_profile(data_source, ver_name)
 
-        assert not os.path.exists(file_path)  # ensure the adding data only at initialization, use update data later on
+        # REMINDER: the check-then-write sequences of a partition are serialized across threads and processes
+        with self._partition_locks([file_path]):
+            if how == 'add':
+                assert not os.path.exists(file_path)  # ensure the adding data only at initialization, use update data later on
+                if date is not None and len(self.get_partitions(data_source, asset, ver_name, asset_type=asset_type, start_date=date, end_date=date)) > 0:
+                    # REMINDER: the day may live in a compacted file already, a daily file would silently replace it there
+                    existing = self.get_table(data_source, asset, ver_name, date=date, columns=['ts'], asset_type=asset_type)
+                    assert len(existing) == 0, f'{date} of {asset_type}/{asset} already exists in a compacted {ver_name} partition, use update_data'
+                write_parquet_table(data, file_path, profile=profile)
+            elif how == 'merge' and os.path.exists(file_path):
+                # REMINDER: append the new rows as a delta instead of rewriting the file, readers merge the deltas on the fly
+                write_parquet_table(data, get_next_delta_path(file_path), profile=profile)
+                data = None  # the catalog stats are read from the footers of the file and its deltas
+                if len(list_delta_files(file_path)) >= self.DEFAULT_MAX_DELTAS:
+                    data = self._fold_file_deltas(file_path, profile=profile)
+            elif how == 'merge':
+                try:
+                    # REMINDER: merge with the same partition, which may live in a compacted file
+                    old_data = self.get_table(data_source, asset, ver_name, date=date, asset_type=asset_type, set_index=True)
+                except FileNotFoundError:
+                    old_data = None
+                if old_data is None:
+                    write_parquet_table(data, file_path, profile=profile)
+                else:
+                    data = self._merge_and_write_data(file_path, old_data, new_data=data, profile=profile)
+            elif how == 'replace':
+                remove_deltas(file_path)
+                write_parquet_table(data, file_path, profile=profile)
+            else:
+                raise ValueError(f'{how=} is not allowed.')
+            self._invalidate_cache(file_path)
+            record = None
+            if self.get_catalog(data_source) is not None:
+                record = describe_partition(file_path, asset_type, asset, ver_name, partition=date, data=data)
+        # rollups lock their own partitions, so they are built after the lock is released
+        self._on_min_bar_written(data_source, asset_type, asset, ver_name, date)
+        return record
 
-        # load the data_menu first
-        with open(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml'), 'r') as f:
-            data_menu = yaml.safe_load(f)
+    @contextmanager
+    def _partition_locks(self, file_paths: typing.List[str]):
+        """
+        Lock the partitions (and their deltas) of `file_paths`, the partitions of a data source are hashed onto a fixed
+        set of lock files under `{data_source}/_locks`. The locks are acquired in order so that they can not deadlock.
+        """
+        lock_paths = sorted({
+            get_stripe_lock_path(os.path.join(os.path.dirname(os.path.dirname(file_path)), '_locks'), file_path)
+            for file_path in file_paths
+        })
+        with ExitStack() as stack:
+            for lock_path in lock_paths:
+                stack.enter_context(file_lock(lock_path))
+            yield
 
-        assert asset_type in data_menu
-        assert asset in data_menu[asset_type]
-        
-        data.to_parquet(file_path, index=True)
+    def _register_records(self, data_source, records: typing.List[typing.Optional[dict]]):
+        catalog = self.get_catalog(data_source)
+        records = [record for record in records if record is not None]
+        if catalog is not None and len(records) > 0:
+            catalog.upsert(records)
 
-    def update_data(self, data_source: str, asset_type: str, asset: str, data: pd.DataFrame, ver_name, date: str=None, how='merge'):
+    def write_partitioned(
+            self,
+            data_source: str,
+            asset_type: str,
+            asset: str,
+            data: pd.DataFrame,
+            ver_name: str='min_bar',
+            how: str='add',
+            max_workers: int=None,
+        ) -> typing.List[str]:
+        """
+        Write a multi-day frame (indexed by `ts`) as daily partitions.
+
+        The frame is split by day in a single pass over its sorted timestamps, the data menu is checked once
+        and the partitions are written concurrently and registered in the catalog in one transaction.
+
+        Args:
+            how (str): `add` (the partitions must not exist), `merge` or `replace`, see `add_data`/`update_data`.
+
+        Returns:
+            List[str]: the dates of the written partitions.
+        """
+        assert ver_name != 'day_bar', f'{ver_name=} is not partitioned by dates'
         assert data_source in self.get_data_sources()
+        self._check_data_menu(data_source, asset_type, asset)
+        os.makedirs(os.path.join(self.datalake_dir, data_source, ver_name), exist_ok=True)
+        if len(data) == 0:
+            return []
 
-        ver = self._convert_ver_name_to_ver(ver_name)
+        ts = pd.DatetimeIndex(data.index).to_numpy(dtype='datetime64[ns]')
+        if not data.index.is_monotonic_increasing:
+            order = np.argsort(ts, kind='stable')
+            data, ts = data.iloc[order], ts[order]
+        days = np.unique(ts.astype('datetime64[D]'))
+        # REMINDER: the day boundaries are found by binary search on the sorted timestamps, no per-day scan
+        bounds = np.searchsorted(ts, days.astype('datetime64[ns]'), side='left').tolist() + [len(ts)]
+        dates = [str(day) for day in days]
+        if how == 'add':
+            ver = self._convert_ver_name_to_ver(ver_name)
+            existing = [date for date in dates if os.path.exists(self.get_file_path(data_source, asset, ver, asset_type=asset_type, date=date))]
+            assert len(existing) == 0, f'partitions of {existing=} already exist, use how="merge" or how="replace"'
 
-        # load the data_menu first
-        with open(os.path.join(self.datalake_dir, f'{data_source}_data_menu.yaml'), 'r') as f:
-            data_menu = yaml.safe_load(f)
+        def _write(i):
+            return self._write_partition(data_source, asset_type, asset, data.iloc[bounds[i]:bounds[i + 1]], ver_name, date=dates[i], how=how)
 
-        assert asset_type in data_menu
-        assert asset in data_menu[asset_type]
-        
-        file_path = self.get_file_path(data_source, asset, ver, asset_type=asset_type, date=date)
+        max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+        # rollups of the written dates are built once at the end
+        with self.deferred_rollups():
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(dates))) as executor:
+                records = list(executor.map(_write, range(len(dates))))
+        self._register_records(data_source, records)
+        return dates
+
+    @contextmanager
+    def open_tick_writer(self, data_source: str, asset_type: str, asset: str, date: str, how: str='replace'):
+        """
+        Stream the ticks of a day into its `tick` partition chunk by chunk, see `tick_store.TickPartitionWriter`.
+        The partition is swapped in and registered when the context exits, nothing is written if it raises.
+
+        Args:
+            how (str): `add` (the partition must not exist) or `replace`.
+        """
+        assert how in ('add', 'replace'), 'ticks can only be added or replaced'
+        self._check_data_menu(data_source, asset_type, asset)
+        file_path = self.get_file_path(data_source, asset, DataVersionType.TICK, asset_type=asset_type, date=date)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if how == 'add':
+            # fail before downloading anything
+            assert not os.path.exists(file_path), f'{file_path=} already exists, use how="replace"'
+
+        @contextmanager
+        def _commit_lock():
+            # REMINDER: the ticks are written without the lock, which is only held to swap the file in
+            with self._partition_locks([file_path]):
+                if how == 'add':
+                    assert not os.path.exists(file_path), f'{file_path=} already exists, use how="replace"'
+                remove_deltas(file_path)
+                yield
+                self._invalidate_cache(file_path)
+
+        with atomic_write_path(file_path, commit_lock=_commit_lock()) as tmp_file_path:
+            writer = TickPartitionWriter(tmp_file_path, profile=self.get_storage_profile(data_source, 'tick'))
+            try:
+                yield writer
+            finally:
+                writer.close()
+        if self.get_catalog(data_source) is not None:
+            self._register_records(data_source, [describe_partition(file_path, asset_type, asset, 'tick', partition=date)])
+
+    def rebuild_bars_from_ticks(
+            self,
+            data_source: str,
+            asset_type: str=None,
+            tickers: typing.List[str]=None,
+            start_date: str=None,
+            end_date: str=None,
+            max_workers: int=None,
+        ) -> int:
+        """
+        Rebuild the min_bar partitions of a data source from its `tick` partitions, without downloading anything.
+        The ticks are streamed by row groups, the rollups of the rebuilt dates are refreshed once at the end.
+
+        Returns:
+            int: the number of rebuilt partitions.
+        """
+        df_partitions = self.list_partitions(data_source, 'tick', asset_type=asset_type, start_date=start_date, end_date=end_date)
+        if tickers is not None:
+            df_partitions = df_partitions[df_partitions['ticker'].isin(tickers)]
+        tasks = set()
+        for asset_type_, ticker, partition in df_partitions[['asset_type', 'ticker', 'partition']].itertuples(index=False):
+            # a compacted partition holds the ticks of several days
+            partition_start, partition_end = get_partition_bounds(partition)
+            first_date, last_date = partition_start, partition_end - pd.Timedelta(days=1)
+            if start_date is not None:
+                first_date = max(first_date, pd.Timestamp(start_date).normalize())
+            if end_date is not None:
+                last_date = min(last_date, pd.Timestamp(end_date).normalize())
+            if first_date <= last_date:
+                tasks.update((asset_type_, ticker, date) for date in get_dates(first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')))
+        if len(tasks) == 0:
+            return 0
+
+        def _rebuild(task):
+            asset_type_, ticker, date = task
+            builder = TickBarBuilder('1min')
+            for batch in self.iter_record_batches(data_source, ticker, 'tick', date=date, asset_type=asset_type_, batch_size=1 << 20):
+                side = arrow_io.to_numpy(batch, 'side')
+                builder.add(arrow_io.to_numpy(batch, 'ts'), arrow_io.to_numpy(batch, 'price'), arrow_io.to_numpy(batch, 'size'), is_buy=side == BUY_SIDE)
+            bars = builder.to_frame()
+            if len(bars) == 0:
+                return False, None
+            return True, self._write_partition(data_source, asset_type_, ticker, bars, 'min_bar', date=date, how='replace')
+
+        os.makedirs(os.path.join(self.datalake_dir, data_source, 'min_bar'), exist_ok=True)
+        max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+        with self.deferred_rollups():
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+                results = list(tqdm(executor.map(_rebuild, sorted(tasks)), total=len(tasks), desc=f'Rebuilding {data_source}/min_bar from ticks'))
+        self._register_records(data_source, [record for _, record in results])
+        return sum(written for written, _ in results)
+
+    def get_rollup_config(self, data_source) -> typing.Optional[dict]:
+        catalog = self.get_catalog(data_source)
+        if catalog is None:
+            return None
+        return catalog.get_setting('rollups')
+
+    def enable_rollups(
+            self,
+            data_source,
+            versions: typing.List[str]=('hour_bar', 'day_bar'),
+            tz: str=None,
+            session_offset: str=None,
+            session_hours: typing.Tuple[str, str]=None,
+        ):
+        """
+        Enable the automatic rollups of min_bar into `versions` after each min_bar write of a data source.
+        See `rollups.aggregate_ohlcv` for `tz`, `session_offset` and `session_hours`.
+        """
+        for ver_name in versions:
+            assert ver_name in ROLLUP_FREQS, f'{ver_name=} can not be rolled up from min_bar'
+        catalog = self.get_catalog(data_source) or self.build_catalog(data_source)
+        catalog.set_setting('rollups', {
+            'versions': list(versions),
+            'tz': tz,
+            'session_offset': session_offset,
+            'session_hours': list(session_hours) if session_hours is not None else None,
+        })
+
+    def disable_rollups(self, data_source):
+        catalog = self.get_catalog(data_source)
+        if catalog is not None:
+            catalog.set_setting('rollups', None)
+
+    @contextmanager
+    def deferred_rollups(self):
+        """
+        Collect the min_bar partitions written inside the context and roll them up once at exit,
+        instead of after every single write.
+        """
+        if self._deferred_rollups is not None:
+            # already deferred by an outer context
+            yield
+            return
+        self._deferred_rollups = {}
+        try:
+            yield
+        finally:
+            deferred_rollups, self._deferred_rollups = self._deferred_rollups, None
+            for data_source, dates in deferred_rollups.items():
+                self.build_rollups(data_source, dates=dates)
 
-        if how == 'merge':
-            old_data = self.get_table(data_source, asset, asset_type=asset_type, set_index=True)
-            self._merge_and_write_data(file_path, old_data, new_data=data)
-        elif how == 'replace':
-            data.to_parquet(file_path, index=True)
+    def _on_min_bar_written(self, data_source, asset_type, ticker, ver_name, date):
+        # post-ingest hook: keep the rollups of a data source in sync with its min_bar partitions
+        if ver_name != 'min_bar' or date is None or self.get_rollup_config(data_source) is None:
+            return
+        dates = {(asset_type, ticker): {date}}
+        if self._deferred_rollups is not None:
+            for key, value in dates.items():
+                self._deferred_rollups.setdefault(data_source, {}).setdefault(key, set()).update(value)
         else:
-            raise ValueError(f'{how=} is not allowed.')
-        
+            self.build_rollups(data_source, dates=dates)
+
+    def build_rollups(
+            self,
+            data_source,
+            versions: typing.List[str]=None,
+            asset_type: str=None,
+            tickers: typing.List[str]=None,
+            start_date: str=None,
+            end_date: str=None,
+            dates: typing.Dict[tuple, typing.Set[str]]=None,
+            tz: str=None,
+            session_offset: str=None,
+            session_hours: typing.Tuple[str, str]=None,
+        ):
+        """
+        Build `hour_bar`/`day_bar` from the min_bar partitions of a data source.
+
+        Only the buckets touched by the given min_bar dates are recomputed and merged into the existing rollups.
+        `dates` maps (asset_type, ticker) to the touched dates, by default all the min_bar partitions in
+        [start_date, end_date] are rolled up. The rollup config stored by `enable_rollups` is used unless
+        `versions`, `tz`, `session_offset` or `session_hours` are given.
+        """
+        config = self.get_rollup_config(data_source) or {}
+        versions = versions or config.get('versions') or list(ROLLUP_FREQS)
+        kwargs = {
+            'tz': tz or config.get('tz'),
+            'session_offset': session_offset or config.get('session_offset'),
+            'session_hours': session_hours or config.get('session_hours'),
+        }
+        if dates is None:
+            dates = {}
+            df_partitions = self.list_partitions(data_source, 'min_bar', asset_type=asset_type, start_date=start_date, end_date=end_date)
+            if tickers is not None:
+                df_partitions = df_partitions[df_partitions['ticker'].isin(tickers)]
+            for asset_type_, ticker, partition in df_partitions[['asset_type', 'ticker', 'partition']].itertuples(index=False):
+                start, end = get_partition_bounds(partition)
+                start = max(start, pd.Timestamp(start_date)) if start_date is not None else start
+                end = min(end, pd.Timestamp(end_date) + pd.Timedelta(days=1)) if end_date is not None else end
+                dates.setdefault((asset_type_, ticker), set()).update(
+                    date.strftime('%Y-%m-%d') for date in pd.date_range(start, end - pd.Timedelta(days=1), freq='D')
+                )
+        for (asset_type_, ticker), ticker_dates in tqdm(dates.items(), desc=f'Rolling up {data_source}'):
+            self._build_ticker_rollups(data_source, asset_type_, ticker, sorted(ticker_dates), versions, **kwargs)
+
+    def _build_ticker_rollups(self, data_source, asset_type, ticker, dates, versions, max_chunk_days=31, **kwargs):
+        # group the dates into chunks of nearby dates, each chunk is read once with a day of margin on both sides
+        # since a bucket of the rollups (in any timezone and session) spans at most the neighbouring days
+        chunks = []
+        for date in pd.to_datetime(dates):
+            if chunks and (date - chunks[-1][0]).days < max_chunk_days and (date - chunks[-1][-1]).days <= 2:
+                chunks[-1].append(date)
+            else:
+                chunks.append([date])
+        rollups = {ver_name: [] for ver_name in versions}
+        for chunk in chunks:
+            df = self.get_table(
+                data_source, ticker, 'min_bar',
+                start_date=chunk[0] - pd.Timedelta(days=1),
+                end_date=chunk[-1] + pd.Timedelta(days=1),
+                asset_type=asset_type,
+            )
+            if len(df) == 0:
+                continue
+            df['ts'] = pd.to_datetime(df['ts'])
+            touched = df[df['ts'].dt.normalize().isin(chunk)]
+            for ver_name in versions:
+                freq = ROLLUP_FREQS[ver_name]
+                bars = aggregate_ohlcv(df, freq, **kwargs)
+                affected = get_bucket_labels(touched['ts'], freq, tz=kwargs['tz'], session_offset=kwargs['session_offset'])
+                rollups[ver_name].append(bars[bars['ts'].isin(affected.unique())])
+
+        for ver_name, dfs in rollups.items():
+            if len(dfs) == 0:
+                continue
+            bars = pd.concat(dfs, ignore_index=True).drop_duplicates('ts', keep='last').set_index('ts').sort_index()
+            if len(bars) == 0:
+                continue
+            if ver_name == 'day_bar':
+                self.update_data(data_source, asset_type, ticker, data=bars, ver_name=ver_name, how='merge')
+            else:
+                # REMINDER: intraday rollups are partitioned by dates like min_bar
+                for date, bars_date in bars.groupby(bars.index.normalize()):
+                    self.update_data(data_source, asset_type, ticker, data=bars_date, ver_name=ver_name, date=date.strftime('%Y-%m-%d'), how='merge')
+
     @staticmethod
-    def _merge_and_write_data(file_path:str, old_data: pd.DataFrame, new_data: pd.DataFrame) -> pd.DataFrame:
+    def _merge_and_write_data(file_path:str, old_data: pd.DataFrame, new_data: pd.DataFrame, profile=None) -> pd.DataFrame:
         """
         Merges old_data and new_data DataFrames on the time dimension.
         In case of overlap, the rows from new_data are used.
@@ -215,7 +1120,7 @@ class DatalakeClient:
         Parameters:
         old_data (pd.DataFrame): The old DataFrame.
         new_data (pd.DataFrame): The new DataFrame to merge.
-        time_column (str): The name of the column representing time.
+        profile (str): The storage profile to write with.
 
         Returns:
         pd.DataFrame: The merged DataFrame.
@@ -227,7 +1132,135 @@ class DatalakeClient:
         merged_data = merged_data[~merged_data.index.duplicated(keep='last')]
 
         # merged_data = merged_data.reset_index(drop=True)
-        merged_data.to_parquet(file_path, index=True)
+        write_parquet_table(merged_data, file_path, profile=profile)
+        return merged_data
+
+    @staticmethod
+    def _read_merged_file(file_path, delta_file_paths: typing.List[str]) -> pd.DataFrame:
+        # read a file with its deltas merged in, indexed by ts
+        df = merge_tables([read_parquet_table(path) for path in [file_path] + delta_file_paths])
+        df['ts'] = pd.to_datetime(df['ts'])
+        df.set_index('ts', inplace=True)
+        return df
+
+    @staticmethod
+    def _remove_folded_deltas(file_path, delta_file_paths: typing.List[str]):
+        # only remove the merged deltas, in case new ones were appended meanwhile
+        for delta_file_path in delta_file_paths:
+            os.remove(delta_file_path)
+        try:
+            os.rmdir(get_delta_dir(file_path))
+        except OSError:
+            pass
+        remove_empty_delta_root(file_path)
+
+    def _fold_file_deltas(self, file_path, profile=None) -> pd.DataFrame:
+        # rewrite a file with its deltas merged in, the merged file is swapped in before the deltas are removed
+        delta_file_paths = list_delta_files(file_path)
+        df = self._read_merged_file(file_path, delta_file_paths)
+        write_parquet_table(df, file_path, profile=profile)
+        self._invalidate_cache(file_path)
+        self._remove_folded_deltas(file_path, delta_file_paths)
+        return df
+
+    def fold_deltas(self, data_source, ver_name: str=None, min_deltas: int=1) -> typing.List[str]:
+        """
+        Fold the delta files appended by `update_data(how='merge')` into their partition files.
+        Only the partitions with at least `min_deltas` deltas are rewritten.
+
+        Returns:
+            List[str]: the file paths of the rewritten partitions.
+        """
+        data_menu = self.get_data_menu(data_source)
+        data_source_dir = os.path.join(self.datalake_dir, data_source)
+        ver_names = [ver_name] if ver_name is not None else sorted(os.listdir(data_source_dir))
+        folded_file_paths = []
+        for ver_name_ in ver_names:
+            delta_root = os.path.join(data_source_dir, ver_name_, DELTA_DIR_NAME)
+            if not os.path.isdir(delta_root):
+                continue
+            for file_name in tqdm(sorted(os.listdir(delta_root)), desc=f'Folding deltas of {data_source}/{ver_name_}'):
+                file_path = os.path.join(data_source_dir, ver_name_, file_name)
+                n_deltas = len(list_delta_files(file_path))
+                if n_deltas == 0 or not os.path.exists(file_path):
+                    # REMINDER: deltas whose file was removed are stale
+                    remove_deltas(file_path)
+                    continue
+                if n_deltas < min_deltas:
+                    continue
+                with self._partition_locks([file_path]):
+                    df = self._fold_file_deltas(file_path, profile=self.get_storage_profile(data_source, ver_name_))
+                info = parse_partition_filename(file_name, list(data_menu.keys()))
+                if info is not None:
+                    asset_type, ticker, partition = info
+                    self._register_partition(data_source, asset_type, ticker, ver_name_, file_path, date=partition, data=df)
+                folded_file_paths.append(file_path)
+        return folded_file_paths
+
+    def compact(
+            self,
+            data_source,
+            ver_name: str='min_bar',
+            granularity: str='month',
+            asset_type: str=None,
+            tickers: typing.List[str]=None,
+            row_group_size: int=DEFAULT_ROW_GROUP_SIZE,
+        ) -> typing.List[str]:
+        """
+        Consolidate the daily partitions of a version into monthly (or yearly) partitions.
+
+        Only the periods with partitions finer than `granularity`, i.e. daily files written since the last compaction,
+        are recompacted. Each compacted file is written to a temporary file and atomically swapped in before the
+        partitions it replaces are removed, `get_table(date=...)` keeps working on the compacted files.
+
+        Returns:
+            List[str]: the file paths of the compacted partitions.
+        """
+        assert ver_name != 'day_bar', f'{ver_name=} is not partitioned by dates'
+        assert granularity in ('month', 'year'), f'{granularity=} is not supported'
+        n = GRANULARITIES[granularity]
+        ver = self._convert_ver_name_to_ver(ver_name)
+        df_partitions = self.list_partitions(data_source, ver_name, asset_type=asset_type)
+        df_partitions = df_partitions[df_partitions['partition'].str.len() >= n]
+        if tickers is not None:
+            df_partitions = df_partitions[df_partitions['ticker'].isin(tickers)]
+        df_partitions = df_partitions.assign(period=df_partitions['partition'].str[:n])
+
+        compacted_file_paths = []
+        for (asset_type_, ticker, period), df_group in tqdm(df_partitions.groupby(['asset_type', 'ticker', 'period']), desc=f'Compacting {data_source}/{ver_name}'):
+            partitions = sorted(df_group['partition'])
+            if all(len(partition) == n for partition in partitions):
+                # nothing changed since the last compaction
+                continue
+            plans = [
+                (self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type_, date=partition), get_bounds_filters(bounds), excluded_periods)
+                for partition, bounds, excluded_periods in plan_partition_reads(partitions)
+            ]
+            file_path = self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type_, date=period)
+            with self._partition_locks([plan[0] for plan in plans] + [file_path]):
+                df = self._read_partitions(plans)
+                df['ts'] = pd.to_datetime(df['ts'])
+                df.set_index('ts', inplace=True)
+
+                # swap in the compacted file first, so that readers never miss any data
+                write_parquet_table(df, file_path, row_group_size=row_group_size, profile=self.get_storage_profile(data_source, ver_name))
+                self._invalidate_cache(file_path)
+                self._register_partition(data_source, asset_type_, ticker, ver_name, file_path, date=period, data=df)
+
+                replaced_file_paths = [plan[0] for plan in plans if plan[0] != file_path]
+                # the deltas were merged into the compacted file
+                remove_deltas(file_path)
+                for replaced_file_path in replaced_file_paths:
+                    os.remove(replaced_file_path)
+                    remove_deltas(replaced_file_path)
+                    self._invalidate_cache(replaced_file_path)
+                catalog = self.get_catalog(data_source)
+                if catalog is not None:
+                    catalog.remove(ver_name, [os.path.basename(replaced_file_path) for replaced_file_path in replaced_file_paths])
+                    days = np.unique(df.index.values.astype('datetime64[D]'))
+                    self._forget_checked_dates(catalog, ver_name, asset_type_, ticker, np.datetime_as_string(days, unit='D').tolist())
+            compacted_file_paths.append(file_path)
+        return compacted_file_paths
 
     def get_file_path(self, data_source, ticker, ver, asset_type, date=None):
         if ver.value == DataVersionType.MIN_BAR.value:
@@ -236,6 +1269,8 @@ class DatalakeClient:
             partition_name = 'hour_bar'
         elif ver.value == DataVersionType.DAR_BAR.value:
             partition_name = 'day_bar'
+        elif ver.value == DataVersionType.TICK.value:
+            partition_name = 'tick'
         else:
             raise ValueError(f'{ver=} is not available now')
         
@@ -244,6 +1279,87 @@ class DatalakeClient:
         else:
             return os.path.join(self.datalake_dir, f'{data_source}/{partition_name}/{asset_type}_{ticker}_{date}_historical_data.parquet')
     
+    def get_partitions(self, data_source, ticker, ver_name, asset_type='stock', start_date=None, end_date=None) -> typing.List[str]:
+        """
+        Get the sorted partitions (`YYYY-MM-DD` daily files and `YYYY-MM`/`YYYY` compacted files) of a ticker
+        that overlap [start_date, end_date] (both inclusive).
+        """
+        if self.get_catalog(data_source) is None and start_date is not None and end_date is not None:
+            # only check the candidate partitions in range instead of listing the whole `ver_dir`
+            start_date = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+            end_date = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+            months = get_months(f'{start_date[:7]}-01', end_date)
+            years = sorted({month[:4] for month in months})
+            ver = self._convert_ver_name_to_ver(ver_name)
+            return sorted(
+                partition for partition in years + months + get_dates(start_date, end_date)
+                if os.path.exists(self.get_file_path(data_source, ticker, ver, asset_type=asset_type, date=partition))
+            )
+        df = self.list_partitions(data_source, ver_name, asset_type=asset_type, ticker=ticker, start_date=start_date, end_date=end_date)
+        return sorted(partition for partition in df['partition'] if partition != '')
+
+    def get_partition_dates(self, data_source, ticker, ver_name, asset_type='stock', start_date=None, end_date=None) -> typing.List[str]:
+        """
+        Get the sorted dates of the daily partitions of a ticker within [start_date, end_date] (both inclusive).
+        """
+        partitions = self.get_partitions(data_source, ticker, ver_name, asset_type=asset_type, start_date=start_date, end_date=end_date)
+        return [partition for partition in partitions if len(partition) == GRANULARITIES['day']]
+
+    def _plan_table_reads(self, data_source, ticker, ver_name, start_date=None, end_date=None, date=None, asset_type='stock') -> typing.List[tuple]:
+        """
+        Plan the reads of a table as a list of (file_path, filters, excluded_periods).
+        """
+        ver = self._convert_ver_name_to_ver(ver_name)
+        if ver_name == 'day_bar' and not date:
+            # REMINDER: for daily data, files are separated by assets only
+            file_path = self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type)
+            return [(file_path, get_date_range_filters(start_date, end_date), [])]
+        if date:
+            # a single day is read from its daily file, or from the compacted file that contains it
+            start_date, end_date = date, date
+        partitions = self.get_partitions(data_source, ticker, ver_name, asset_type=asset_type, start_date=start_date, end_date=end_date)
+        if date and len(partitions) == 0:
+            raise FileNotFoundError(self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type, date=date))
+        # REMINDER: the partitions are planned on whole days, a start/end with a time of day is filtered exactly as for day_bar
+        range_filters = get_range_filters(start_date, end_date)
+        return [
+            (self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type, date=partition), get_bounds_filters(bounds, range_filters), excluded_periods)
+            for partition, bounds, excluded_periods in plan_partition_reads(partitions, start_date, end_date)
+        ]
+
+    def _read_planned_table(self, file_path, filters, excluded_periods, columns=None) -> pd.DataFrame:
+        delta_file_paths = list_delta_files(file_path)
+        read_columns = columns
+        if (len(excluded_periods) > 0 or len(delta_file_paths) > 0) and columns is not None and 'ts' not in columns:
+            read_columns = ['ts'] + list(columns)
+        df = self._read_table(file_path, read_columns, filters=filters)
+        if len(delta_file_paths) > 0:
+            # merge-on-read, the last write wins
+            df = merge_tables([df] + [read_parquet_table(path, read_columns, filters) for path in delta_file_paths])
+            if columns is not None:
+                df = df[columns]
+        if len(excluded_periods) > 0:
+            # drop the periods that are replaced by finer partitions
+            df = df[~get_excluded_mask(df['ts'].values, excluded_periods)]
+            if columns is not None:
+                df = df[columns]
+        return df
+
+    def _read_partitions(self, plans: typing.List[tuple], columns: typing.List[str]=None, max_workers: int=None) -> pd.DataFrame:
+        if len(plans) == 0:
+            # REMINDER: keep `ts` so that an empty range can still be indexed by it
+            return pd.DataFrame(columns=columns if columns is not None else ['ts'])
+        if len(plans) == 1:
+            return self._read_planned_table(*plans[0], columns=columns)
+        max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+        # reading parquet files is mostly I/O and releases the GIL, a bounded thread pool is enough
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(plans))) as executor:
+            dfs = list(executor.map(lambda plan: self._read_planned_table(*plan, columns=columns), plans))
+        df = pd.concat(dfs, ignore_index=True)
+        if 'ts' in df.columns:
+            df = df.sort_values('ts', kind='stable', ignore_index=True)
+        return df
+
     def get_table(
             self, 
             data_source, 
@@ -255,32 +1371,159 @@ class DatalakeClient:
             set_index: bool=False,
             date: str=None,
             asset_type: str='stock',
+            max_workers: int=None,
         ) -> pd.DataFrame:
+        # REMINDER: for minute level data, files are separated by dates (or compacted by months/years)
+        # and the partitions in [start_date, end_date] are loaded concurrently.
+        # For daily data, the columns and the date range are pushed down to the parquet reader.
+        plans = self._plan_table_reads(data_source, ticker, ver_name, start_date, end_date, date=date, asset_type=asset_type)
+        df = self._read_partitions(plans, columns=columns, max_workers=max_workers)
+        if set_index:
+            df['ts'] = pd.to_datetime(df['ts'])
+            df.set_index('ts', inplace=True)
+        return df
+
+    @staticmethod
+    def _read_planned_arrow_table(file_path, filters, excluded_periods, columns=None) -> pa.Table:
+        delta_file_paths = list_delta_files(file_path)
+        read_columns = columns
+        if (len(excluded_periods) > 0 or len(delta_file_paths) > 0) and columns is not None and 'ts' not in columns:
+            read_columns = ['ts'] + list(columns)
+        table = arrow_io.read_arrow_table(file_path, read_columns, filters)
+        if len(delta_file_paths) > 0:
+            table = merge_arrow_tables([table] + [arrow_io.read_arrow_table(path, read_columns, filters) for path in delta_file_paths])
+            if columns is not None:
+                table = table.select(columns)
+        if len(excluded_periods) > 0:
+            mask = get_excluded_mask(arrow_io.to_numpy(table, 'ts'), excluded_periods)
+            table = table.filter(pa.array(~mask))
+            if columns is not None:
+                table = table.select(columns)
+        return table
 
+    def get_arrow_table(
+            self,
+            data_source,
+            ticker: str,
+            ver_name: str='day_bar',
+            start_date: str=None,
+            end_date: str=None,
+            columns: typing.List[str]=None,
+            date: str=None,
+            asset_type: str='stock',
+            max_workers: int=None,
+        ) -> pa.Table:
+        """
+        Arrow-native version of `get_table`. The files are memory mapped and no pandas frame is built,
+        use `arrow_io.to_pandas`/`arrow_io.to_numpy` to convert on demand.
+        """
+        plans = self._plan_table_reads(data_source, ticker, ver_name, start_date, end_date, date=date, asset_type=asset_type)
+        max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+        if len(plans) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(plans))) as executor:
+                tables = list(executor.map(lambda plan: self._read_planned_arrow_table(*plan, columns=columns), plans))
+        else:
+            tables = [self._read_planned_arrow_table(*plan, columns=columns) for plan in plans]
+        if len(tables) == 0:
+            return pa.table({column: [] for column in (columns or [])})
+        # REMINDER: concatenating tables only stitches the chunks together, no data is copied
+        return arrow_io.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+    def iter_record_batches(
+            self,
+            data_source,
+            ticker: str,
+            ver_name: str='day_bar',
+            start_date: str=None,
+            end_date: str=None,
+            columns: typing.List[str]=None,
+            date: str=None,
+            asset_type: str='stock',
+            batch_size: int=65536,
+        ) -> typing.Iterator[pa.RecordBatch]:
+        """
+        Iterate over the record batches of a table in ts order, only one batch is decoded at a time.
+        """
         ver = self._convert_ver_name_to_ver(ver_name)
-        
-        if date:
-            # REMINDER: for minute level data, files are separated by dates
-            file_path = self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type, date=date)
-            df = pd.read_parquet(file_path)
-            if columns is not None and isinstance(columns, list):
-                df = df[columns]
-            if set_index:
-                df['ts'] = pd.to_datetime(df['ts'])
-                df.set_index('ts', inplace=True)
-            return df
+        if ver_name == 'day_bar' and not date:
+            segments = [(self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type), get_date_range_filters(start_date, end_date))]
         else:
-            # REMINDER: for daily data, files are separated by assets only
-            file_path = self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type)
-            df = pd.read_parquet(file_path)
-            if start_date is not None or end_date is not None:
-                df = select_by_date_range(df, start_date, end_date)
-            if columns is not None and isinstance(columns, list):
-                df = df[columns]
-            if set_index:
-                df['ts'] = pd.to_datetime(df['ts'])
-                df.set_index('ts', inplace=True)
-            return df
+            if date:
+                start_date, end_date = date, date
+            partitions = self.get_partitions(data_source, ticker, ver_name, asset_type=asset_type, start_date=start_date, end_date=end_date)
+            # REMINDER: a compacted partition is cut around the finer partitions it contains, so that batches stay in ts order
+            range_filters = get_range_filters(start_date, end_date)
+            segments = [
+                (self.get_file_path(data_source, ticker, ver=ver, asset_type=asset_type, date=partition), get_bounds_filters(bounds, range_filters))
+                for partition, bounds in split_partition_reads(plan_partition_reads(partitions, start_date, end_date))
+            ]
+        for file_path, filters in segments:
+            filter_columns = columns
+            if columns is not None and filters is not None and 'ts' not in columns:
+                filter_columns = ['ts'] + list(columns)
+            if len(list_delta_files(file_path)) > 0:
+                # REMINDER: a file with deltas is merged as a whole before it is split into batches
+                table = self._read_planned_arrow_table(file_path, filters, [], columns=filter_columns)
+                for batch in table.to_batches(max_chunksize=batch_size):
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    if batch.num_rows > 0:
+                        yield batch
+                continue
+            bounds = {}
+            for column, op, value in (filters or []):
+                # skip the row groups out of range by their ts statistics
+                bounds['start_date' if op == '>=' else 'end_date'] = value
+            for batch in arrow_io.iter_arrow_batches(file_path, filter_columns, batch_size=batch_size, **bounds):
+                batch = arrow_io.apply_filters(batch, filters)
+                if columns is not None:
+                    batch = batch.select(columns)
+                if batch.num_rows > 0:
+                    yield batch
+
+    def iter_bars(
+            self,
+            data_source,
+            tickers: typing.List[str],
+            ver_name: str='min_bar',
+            start_date: str=None,
+            end_date: str=None,
+            batch_rows: int=100000,
+            columns: typing.List[str]=None,
+            asset_type: str='stock',
+            max_memory: int=None,
+            max_workers: int=None,
+        ) -> typing.Iterator[pd.DataFrame]:
+        """
+        Stream the bars of multiple tickers as ts-ordered batches of `batch_rows` rows with a `ticker` column.
+
+        The partitions are read lazily batch by batch and the next chunk of every ticker is prefetched in the background,
+        so long histories can be processed without loading them into memory at once.
+
+        Args:
+            max_memory (int, optional): rough ceiling in bytes of the rows held in memory, the number of rows read per
+                ticker at a time is derived from it. Defaults to reading `batch_rows` rows per ticker at a time.
+        """
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        if columns is not None and 'ts' not in columns:
+            columns = ['ts'] + list(columns)
+        chunk_rows = batch_rows
+        if max_memory is not None and len(tickers) > 0:
+            file_paths = [plan[0] for plan in self._plan_table_reads(data_source, tickers[0], ver_name, start_date, end_date, asset_type=asset_type)]
+            row_bytes = arrow_io.estimate_row_bytes(file_paths[0], columns) if len(file_paths) > 0 else 64
+            # one buffered and one prefetched chunk per ticker, plus the pending output batch
+            chunk_rows = max(1, min(batch_rows, (max_memory // row_bytes - batch_rows) // (2 * len(tickers))))
+
+        def _iter_chunks(ticker):
+            for batch in self.iter_record_batches(data_source, ticker, ver_name, start_date, end_date, columns=columns, asset_type=asset_type, batch_size=chunk_rows):
+                yield arrow_io.to_pandas(batch)
+
+        yield from iter_merged_chunks(
+            {ticker: _iter_chunks(ticker) for ticker in tickers},
+            batch_rows=batch_rows,
+            max_workers=max_workers or self.DEFAULT_MAX_WORKERS,
+        )
 
     def get_tables(
             self,
@@ -292,18 +1535,174 @@ class DatalakeClient:
             columns: typing.List[str]=None,
             set_index=False,
             dl_index=None,
-        ) -> typing.Dict[str, pd.DataFrame]:
-        assert ver_name == 'day_bar', f'You can only get multiple tables with {ver_name=}'
-        tables = {}
+            asset_type: str='stock',
+            max_workers: int=None,
+            pivot: str=None,
+        ) -> typing.Union[typing.Dict[str, pd.DataFrame], pd.DataFrame]:
+        """
+        Load the tables of multiple tickers concurrently.
+
+        If `pivot` is given (e.g. `pivot='close'`), only `ts` and that column are loaded for each ticker
+        and a single ts-aligned wide frame (ts x ticker) is returned instead of a dict of tables.
+        """
         if dl_index is not None:
             df_index = self.get_index(data_source)
             # filter tickers by index
-            tickers = [ticker for ticker in tickers if ticker in df_index[dl_index]]
-        for ticker in tickers:
-            df = self.get_table(data_source, ticker, ver_name, start_date, end_date, columns, set_index)
-            tables[ticker] = df
+            index_tickers = set(df_index.loc[df_index[dl_index].notna() & (df_index['asset_type'] == asset_type), 'ticker'])
+            tickers = [ticker for ticker in tickers if ticker in index_tickers]
+        if pivot is not None:
+            columns = ['ts', pivot]
+        max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+
+        def _get_table(ticker):
+            # REMINDER: partitions of a single ticker are loaded serially here since tickers are already loaded concurrently
+            return self.get_table(
+                data_source,
+                ticker,
+                ver_name,
+                start_date,
+                end_date,
+                columns,
+                set_index=set_index or pivot is not None,
+                asset_type=asset_type,
+                max_workers=1,
+            )
+
+        tables = {}
+        if len(tickers) > 0:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tickers))) as executor:
+                for ticker, df in zip(tickers, executor.map(_get_table, tickers)):
+                    if pivot is not None:
+                        # keep only the series so that the intermediate frames can be released early
+                        tables[ticker] = df[pivot]
+                    else:
+                        tables[ticker] = df
+        if pivot is not None:
+            if len(tables) == 0:
+                return pd.DataFrame()
+            panel = pd.concat(tables, axis=1).sort_index()
+            panel.columns.name = 'ticker'
+            return panel
         return tables
+
+    def _get_ticker_fingerprints(self, data_source, ver_name, tickers, asset_type, start_date=None, end_date=None) -> typing.Dict[str, str]:
+        # changes whenever a partition of a ticker in range is added, removed or rewritten
+        rows = {ticker: [] for ticker in tickers}
+        catalog = self.get_catalog(data_source)
+        if catalog is not None:
+            df = catalog.query(ver_name, asset_type=asset_type, start_date=start_date, end_date=end_date)
+            df = df[df['ticker'].isin(tickers)]
+            for ticker, file_name, checksum, updated_at in df[['ticker', 'file_name', 'checksum', 'updated_at']].itertuples(index=False):
+                rows[ticker].append((file_name, checksum, updated_at))
+        else:
+            df = self.list_partitions(data_source, ver_name, asset_type=asset_type, start_date=start_date, end_date=end_date)
+            df = df[df['ticker'].isin(tickers)]
+            for ticker, file_name, file_path in df[['ticker', 'file_name', 'file_path']].itertuples(index=False):
+                stat = os.stat(file_path)
+                rows[ticker].append((file_name, stat.st_mtime_ns, stat.st_size, tuple(os.path.basename(path) for path in list_delta_files(file_path))))
+        return {ticker: hashlib.sha1(repr(sorted(ticker_rows)).encode()).hexdigest() for ticker, ticker_rows in rows.items()}
+
+    def _get_partitions_fingerprint(self, data_source, ver_name, tickers, asset_type, start_date=None, end_date=None) -> str:
+        fingerprints = self._get_ticker_fingerprints(data_source, ver_name, tickers, asset_type, start_date, end_date)
+        return hashlib.sha1(repr(sorted(fingerprints.items())).encode()).hexdigest()
+
+    def get_universe_cube(
+            self,
+            data_source,
+            tickers: typing.List[str],
+            ver_name: str='day_bar',
+            start_date: str=None,
+            end_date: str=None,
+            fields: typing.List[str]=CUBE_FIELDS,
+            asset_type: str='stock',
+            dl_index=None,
+            dtype: str='float64',
+            rebuild: bool=False,
+        ) -> UniverseCube:
+        """
+        Load a universe as a dense, ts-aligned (time x ticker x field) array with a validity mask.
+
+        The cube is persisted under `{datalake_dir}/{data_source}/_cubes` and memory-mapped on later calls
+        with the same universe and range, until one of its underlying partitions changes.
+        """
+        if dl_index is not None:
+            df_index = self.get_index(data_source)
+            index_tickers = set(df_index.loc[df_index[dl_index].notna() & (df_index['asset_type'] == asset_type), 'ticker'])
+            tickers = [ticker for ticker in tickers if ticker in index_tickers]
+        tickers = sorted(set(tickers))
+        cube_dir = os.path.join(self.datalake_dir, data_source, '_cubes')
+        key = get_universe_key(ver_name, asset_type, tickers, start_date, end_date, fields=fields, dtype=dtype)
+        fingerprint = self._get_partitions_fingerprint(data_source, ver_name, tickers, asset_type, start_date, end_date)
+        if not rebuild:
+            cube = load_cube(cube_dir, key, fingerprint=fingerprint)
+            if cube is not None:
+                return cube
+
+        tables = self.get_tables(data_source, tickers, ver_name, start_date, end_date, columns=['ts'] + list(fields), asset_type=asset_type)
+        cube = build_cube(tables, fields=fields, dtype=dtype)
+        del tables
+        save_cube(cube_dir, key, cube, fingerprint)
+        # REMINDER: return the memory-mapped cube so that the built arrays can be released
+        return load_cube(cube_dir, key)
     
+    def _get_sql_files(self, data_source, ver_name, tickers=None, start_date=None, end_date=None) -> typing.List[dict]:
+        # the partition files of a version (and their deltas) for `sql_engine.build_view_sql`
+        df_partitions = self.list_partitions(data_source, ver_name, start_date=start_date, end_date=end_date)
+        if tickers is not None:
+            df_partitions = df_partitions[df_partitions['ticker'].isin(tickers)]
+        files = []
+        for (asset_type, ticker), df_ticker in df_partitions.groupby(['asset_type', 'ticker']):
+            file_paths = dict(zip(df_ticker['partition'], df_ticker['file_path']))
+            for partition, _, excluded_periods in plan_partition_reads(sorted(file_paths)):
+                file_path = file_paths[partition]
+                for seq, path in enumerate([file_path] + list_delta_files(file_path)):
+                    files.append({
+                        'file_path': path,
+                        'base_file_path': file_path,
+                        'asset_type': asset_type,
+                        'ticker': ticker,
+                        'seq': seq,
+                        'excluded_periods': excluded_periods if seq == 0 else [],
+                    })
+        return files
+
+    def sql(
+            self,
+            query: str,
+            data_sources: typing.List[str]=None,
+            tickers: typing.List[str]=None,
+            start_date: str=None,
+            end_date: str=None,
+            threads: int=None,
+        ) -> pd.DataFrame:
+        """
+        Run a SQL query over the lake with DuckDB, e.g.
+        `SELECT ticker, avg(high - low) FROM yfinance.day_bar GROUP BY ticker`.
+
+        Each (data_source, version) is registered as the view `{data_source}.{ver_name}` over its partition files,
+        with `asset_type` and `ticker` columns. The files are scanned in parallel and only the columns and row groups
+        needed by the query are read. `tickers` and `start_date`/`end_date` (both inclusive) restrict the views to the
+        matching partitions, so the other files are not even opened.
+        """
+        conn = sql_engine.connect(threads=threads)
+        try:
+            for data_source in (data_sources or self.get_data_sources()):
+                data_source_dir = os.path.join(self.datalake_dir, data_source)
+                if not os.path.isdir(data_source_dir):
+                    continue
+                conn.execute(f'CREATE SCHEMA IF NOT EXISTS {sql_engine.quote_identifier(data_source)}')
+                for ver_name in sorted(os.listdir(data_source_dir)):
+                    if ver_name not in ('min_bar', 'hour_bar', 'day_bar', 'tick'):
+                        continue
+                    files = self._get_sql_files(data_source, ver_name, tickers=tickers, start_date=start_date, end_date=end_date)
+                    if len(files) == 0:
+                        continue
+                    view_name = f'{sql_engine.quote_identifier(data_source)}.{sql_engine.quote_identifier(ver_name)}'
+                    conn.execute(f'CREATE VIEW {view_name} AS {sql_engine.build_view_sql(files, start_date, end_date)}')
+            return conn.execute(query).df()
+        finally:
+            conn.close()
+
     @staticmethod
     def _convert_ver_name_to_ver(ver_name):
         # convert the ver_name to ver first
@@ -313,6 +1712,8 @@ class DatalakeClient:
             ver = DataVersionType.HOUR_BAR
         elif ver_name == 'min_bar':
             ver = DataVersionType.MIN_BAR
+        elif ver_name == 'tick':
+            ver = DataVersionType.TICK
         else:
             raise ValueError(f'{ver_name=} is not supported')
         return ver
@@ -321,7 +1722,6 @@ class DatalakeClient:
         
         # migrating data from datalake to timescaledb by data type
         pdts = self.get_data_menu(data_source, flatten=True)
-        ver_dir = os.path.abspath(os.path.join(self.datalake_dir, data_source, ver_name))
 
         db_client = timescaledb_utils.get_db_client()
 
@@ -340,20 +1740,22 @@ class DatalakeClient:
                 db_client.add(product)
         db_client.commit()  # only commit once
         # print(f'{ver_name=}')
+        # REMINDER: partitions are listed once for all pdts instead of scanning `ver_dir` per pdt
+        df_partitions = self.list_partitions(data_source, ver_name)
+        asset_types_by_pdt = df_partitions.groupby('ticker')['asset_type'].unique().to_dict()
         for pdt in pdts:
             # if pdt not in ['ES', 'YM', 'NQ', 'MES']:
             #     continue
-            file_paths = []
-            for file_name in os.listdir(ver_dir):
-                # print(f'{file_name}')
-                info = extract_info_from_filename(file_name, ver_name)
-                if info[0] == pdt:
-                    file_paths.append(os.path.join(ver_dir, file_name))
             product = db_client.query(Product).filter_by(name=pdt).first()
-            for file_path in tqdm(file_paths, desc=f'{pdt=}'):
-                # _, date = extract_info_from_filename(file_path.split('/')[-1])
+            # REMINDER: read as `get_table` does, with the deltas merged and the days of compacted files replaced by finer partitions skipped
+            plans = [
+                plan
+                for asset_type in asset_types_by_pdt.get(pdt, [])
+                for plan in self._plan_table_reads(data_source, pdt, ver_name, asset_type=asset_type)
+            ]
+            for plan in tqdm(plans, desc=f'{pdt=}'):
                 # 1. load dataframe
-                df = pd.read_parquet(file_path)
+                df = self._read_planned_table(*plan)
                 bars = df[['ts', 'open', 'high', 'low', 'close', 'volume']].to_dict(orient='records')
                 # add product id and data source id to the bars
                 bars = [{'product_id': product.id, 'data_source_id': data_source_obj.id, 'bar_type': ver_name, **bar} for bar in bars]
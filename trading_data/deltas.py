@@ -0,0 +1,113 @@
+import os
+import time
+import shutil
+import typing
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+DELTA_DIR_NAME = '_deltas'
+
+
+def get_delta_dir(file_path: str) -> str:
+    # REMINDER: the deltas of a file live in `{ver_dir}/_deltas/{file_name}/`, so that checking for deltas
+    # is a single stat and listing a version never sees them
+    return os.path.join(os.path.dirname(file_path), DELTA_DIR_NAME, os.path.basename(file_path))
+
+
+def list_delta_files(file_path: str) -> typing.List[str]:
+    """
+    List the delta files of a file in write order.
+    """
+    delta_dir = get_delta_dir(file_path)
+    try:
+        file_names = os.listdir(delta_dir)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(delta_dir, file_name) for file_name in sorted(file_names) if file_name.endswith('.parquet')]
+
+
+def get_next_delta_path(file_path: str) -> str:
+    delta_dir = get_delta_dir(file_path)
+    for _ in range(3):
+        try:
+            os.makedirs(delta_dir, exist_ok=True)
+            break
+        except FileNotFoundError:
+            # the empty `_deltas` root was removed by `remove_deltas` of another partition meanwhile
+            continue
+    delta_file_paths = list_delta_files(file_path)
+    seq = time.time_ns()
+    if len(delta_file_paths) > 0:
+        seq = max(seq, int(os.path.basename(delta_file_paths[-1]).split('.')[0]) + 1)
+    return os.path.join(delta_dir, f'{seq:020d}.parquet')
+
+
+def remove_empty_delta_root(file_path: str):
+    # the `_deltas` root of a version is left behind once the deltas of its last file are removed
+    try:
+        os.rmdir(os.path.dirname(get_delta_dir(file_path)))
+    except OSError:
+        pass
+
+
+def remove_deltas(file_path: str):
+    shutil.rmtree(get_delta_dir(file_path), ignore_errors=True)
+    remove_empty_delta_root(file_path)
+
+
+def get_merge_indices(ts_arrays: typing.List[np.ndarray]) -> np.ndarray:
+    """
+    Get the indices (into the concatenated arrays) of the rows to keep when merging ts-sorted tables
+    in write order, the last write wins for duplicated timestamps.
+    """
+    ts = np.concatenate([np.asarray(ts, dtype='datetime64[ns]') for ts in ts_arrays])
+    # REMINDER: the stable sort (timsort) of concatenated sorted runs is a linear merge
+    order = np.argsort(ts, kind='stable')
+    ts = ts[order]
+    is_last = np.r_[ts[1:] != ts[:-1], True] if len(ts) > 0 else np.array([], dtype=bool)
+    return order[is_last]
+
+
+def merge_tables(dfs: typing.List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merge ts-sorted tables (with a `ts` column) in write order.
+    """
+    dfs = [df for df in dfs if len(df) > 0] or dfs[:1]
+    if len(dfs) == 1:
+        return dfs[0]
+    indices = get_merge_indices([pd.to_datetime(df['ts']).to_numpy(dtype='datetime64[ns]') for df in dfs])
+    return pd.concat(dfs, ignore_index=True).iloc[indices].reset_index(drop=True)
+
+
+def get_merge_schema(schemas: typing.List[pa.Schema]) -> pa.Schema:
+    """
+    Get the schema of the first (base) table with each column widened to the types of the other tables, e.g. a volume
+    downcast to integers by a storage profile in the base file and fractional in a delta.
+    """
+    fields = []
+    for field in schemas[0]:
+        types = [schema.field(field.name).type for schema in schemas if field.name in schema.names]
+        try:
+            field_type = pa.unify_schemas([pa.schema([(field.name, type_)]) for type_ in types], promote_options='permissive').field(field.name).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # REMINDER: types without a common promotion (or pyarrow < 14) keep the type of the base table
+            field_type = field.type
+        fields.append(field.with_type(field_type))
+    return pa.schema(fields, metadata=schemas[0].metadata)
+
+
+def merge_arrow_tables(tables: typing.List[pa.Table]) -> pa.Table:
+    """
+    Arrow version of `merge_tables`, the tables are cast to the schema of the first (base) table widened to the
+    types of the deltas.
+    """
+    tables = [tables[0]] + [table.select(tables[0].schema.names) for table in tables[1:] if table.num_rows > 0]
+    if len(tables) == 1:
+        return tables[0]
+    schema = get_merge_schema([table.schema for table in tables])
+    tables = [table.cast(schema) for table in tables]
+    ts_arrays = [table.column('ts').to_numpy().astype('datetime64[ns]') for table in tables]
+    return pa.concat_tables(tables).take(pa.array(get_merge_indices(ts_arrays)))
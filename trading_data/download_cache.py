@@ -0,0 +1,138 @@
+import os
+import time
+import typing
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+from trading_data.atomic import fsync_dir
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'trading-data', 'downloads')
+DEFAULT_MAX_BYTES = 20 << 30
+
+
+def get_cache_from_env() -> typing.Optional['DownloadCache']:
+    """
+    The download cache configured by `TRADING_DATA_CACHE_DIR` and `TRADING_DATA_CACHE_SIZE_GB` (0 disables it).
+    The cache is opt-in, None if neither is set.
+    """
+    if os.getenv('TRADING_DATA_CACHE_DIR') is None and os.getenv('TRADING_DATA_CACHE_SIZE_GB') is None:
+        # REMINDER: without a cache the archives are decoded while they stream, nothing is spooled to disk
+        return None
+    max_gb = float(os.getenv('TRADING_DATA_CACHE_SIZE_GB', DEFAULT_MAX_BYTES / (1 << 30)))
+    if max_gb <= 0:
+        return None
+    return DownloadCache(os.getenv('TRADING_DATA_CACHE_DIR', DEFAULT_CACHE_DIR), max_bytes=int(max_gb * (1 << 30)))
+
+
+class DownloadCache:
+    """
+    Content-addressed on-disk cache of downloaded files.
+
+    Each url maps to the version it was downloaded at (an upstream checksum, ETag or Last-Modified) and to
+    the sha256 digest of its content, stored once under `objects/`. A url is only served from the cache while
+    its upstream version is unchanged. The least recently used entries are evicted past `max_bytes`.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(cache_dir, 'cache.sqlite')
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            # REMINDER: created on first use, not when the data sources are imported
+            os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+            os.makedirs(os.path.join(self.cache_dir, 'partial'), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with conn:
+                    conn.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS entries (
+                            url TEXT PRIMARY KEY,
+                            version TEXT NOT NULL,
+                            digest TEXT NOT NULL,
+                            byte_size INTEGER NOT NULL,
+                            accessed_at REAL NOT NULL
+                        )
+                        """
+                    )
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+            self._initialized = True
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get_object_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+
+    def get_partial_path(self, url: str, version: str) -> str:
+        # a deterministic path, so that an interrupted download resumes on the next run
+        return os.path.join(self.cache_dir, 'partial', hashlib.sha1(f'{url}\n{version}'.encode()).hexdigest())
+
+    def open(self, url: str, version: str) -> typing.Optional[typing.BinaryIO]:
+        """
+        Open the cached content of `url` at `version`, None if it is not cached.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT digest FROM entries WHERE url = ? AND version = ?", (url, version)).fetchone()
+            if row is None:
+                return None
+            try:
+                # REMINDER: an open file stays readable even if it is evicted meanwhile
+                f = open(self.get_object_path(row[0]), 'rb')
+            except FileNotFoundError:
+                conn.execute("DELETE FROM entries WHERE url = ?", (url, ))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        return f
+
+    def put(self, url: str, version: str, file_path: str, digest: str):
+        """
+        Move a downloaded file of `url` at `version` with the sha256 `digest` into the cache.
+        """
+        object_path = self.get_object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        byte_size = os.path.getsize(file_path)
+        os.replace(file_path, object_path)
+        fsync_dir(os.path.dirname(object_path))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (url, version, digest, byte_size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, version, digest, byte_size, time.time()),
+            )
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `max_bytes`.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url, digest, byte_size FROM entries ORDER BY accessed_at DESC").fetchall()
+            total_bytes, evicted = 0, []
+            for url, digest, byte_size in rows:
+                total_bytes += byte_size
+                if total_bytes > self.max_bytes:
+                    evicted.append((url, digest))
+            if len(evicted) == 0:
+                return
+            conn.executemany("DELETE FROM entries WHERE url = ?", [(url, ) for url, _ in evicted])
+            # the same content may be cached for other urls
+            kept_digests = {row[0] for row in conn.execute("SELECT DISTINCT digest FROM entries")}
+        for digest in {digest for _, digest in evicted} - kept_digests:
+            try:
+                os.remove(self.get_object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def get_size(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(byte_size), 0) FROM entries").fetchone()[0]
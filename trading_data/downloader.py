@@ -0,0 +1,280 @@
+import os
+import time
+import random
+import typing
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from trading_data.catalog import compute_checksum
+from trading_data.download_cache import DownloadCache
+from trading_data.logger import get_logger
+
+
+logger = get_logger(__name__, logger_lv='info')
+
+RETRY_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket, `rate` requests per second with bursts of up to `burst` requests.
+    """
+    def __init__(self, rate: float, burst: int=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class HTTPDownloader:
+    """
+    Shared download layer: pooled keep-alive sessions, per-host concurrency and rate limits, retries of transient
+    failures with exponential backoff, resumable downloads to files and an optional on-disk cache of the streamed files.
+    """
+    def __init__(
+            self,
+            max_concurrency_per_host: int=8,
+            rate_limit: float=None,
+            max_retries: int=5,
+            backoff_factor: float=0.5,
+            timeout: float=60,
+            host_limits: typing.Dict[str, dict]=None,
+            cache: DownloadCache=None,
+            checksum_suffix: str=None,
+        ):
+        """
+        Args:
+            max_concurrency_per_host (int): maximum number of requests in flight per host.
+            rate_limit (float, optional): maximum number of requests per second per host, unlimited if None.
+            host_limits (dict, optional): host -> {'max_concurrency': ..., 'rate_limit': ...} to override the defaults.
+            cache (DownloadCache, optional): serve the streamed files from disk while their upstream version is unchanged.
+            checksum_suffix (str, optional): the upstream version of `url` is the sha256 published at `{url}{checksum_suffix}`,
+                e.g. `.CHECKSUM`. Otherwise it is the ETag (or Last-Modified) header of a HEAD request.
+        """
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.host_limits = host_limits or {}
+        self.cache = cache
+        self.checksum_suffix = checksum_suffix
+        self._local = threading.local()  # one pooled session per thread
+        self._hosts = {}  # host -> (semaphore, rate limiter)
+        self._hosts_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(16, self.max_concurrency_per_host))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _get_host_limits(self, url: str) -> tuple:
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                limits = self.host_limits.get(host, {})
+                rate_limit = limits.get('rate_limit', self.rate_limit)
+                self._hosts[host] = (
+                    threading.BoundedSemaphore(limits.get('max_concurrency', self.max_concurrency_per_host)),
+                    RateLimiter(rate_limit, burst=max(1, int(rate_limit))) if rate_limit else None,
+                )
+            return self._hosts[host]
+
+    def _get_backoff(self, attempt: int, response: requests.Response=None) -> float:
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return float(response.headers['Retry-After'])
+        return self.backoff_factor * (2 ** attempt) * (1 + random.random())
+
+    def request(self, url: str, headers: dict=None, stream: bool=False, method: str='GET') -> typing.Optional[requests.Response]:
+        """
+        GET (or `method`) a url with retries. Returns None if the resource does not exist (404), raises if it keeps failing.
+        """
+        semaphore, rate_limiter = self._get_host_limits(url)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            with semaphore:
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                try:
+                    response = self.session.request(method, url, headers=headers, timeout=self.timeout, stream=stream)
+                    if response.status_code == 404:
+                        # REMINDER: close the discarded responses, a streamed one would keep its pooled connection
+                        response.close()
+                        return None
+                    if response.status_code == 416 and headers is not None and 'Range' in headers:
+                        # the requested range is past the end, i.e. a resumed download is already complete
+                        return response
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        if not response.ok:
+                            response.close()
+                        response.raise_for_status()
+                        return response
+                    error = requests.HTTPError(f'Status code {response.status_code} {url=}', response=response)
+                    response.close()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+            if attempt == self.max_retries:
+                raise error
+            backoff = self._get_backoff(attempt, response)
+            logger.debug(f'Retrying {url=} in {backoff:.1f}s after {error}')
+            time.sleep(backoff)
+
+    def fetch(self, url: str) -> typing.Optional[bytes]:
+        response = self.request(url)
+        return response.content if response is not None else None
+
+    def get_version(self, url: str) -> typing.Optional[str]:
+        """
+        Get the upstream version of a url for the cache, None if it is unknown.
+        """
+        if self.checksum_suffix is not None:
+            content = self.fetch(f'{url}{self.checksum_suffix}')
+            # REMINDER: checksum files are `<sha256>  <file name>`
+            return f'sha256:{content.split()[0].decode().lower()}' if content else None
+        response = self.request(url, method='HEAD')
+        if response is None:
+            return None
+        response.close()
+        if response.headers.get('ETag'):
+            return f"etag:{response.headers['ETag']}"
+        if response.headers.get('Last-Modified'):
+            return f"last-modified:{response.headers['Last-Modified']}"
+        return None
+
+    def _open_cached(self, url: str, version: str) -> typing.Optional[typing.BinaryIO]:
+        f = self.cache.open(url, version)
+        if f is not None:
+            return f
+        file_path = self.download(url, self.cache.get_partial_path(url, version))
+        if file_path is None:
+            return None
+        digest = compute_checksum(file_path)
+        if version.startswith('sha256:') and version != f'sha256:{digest}':
+            os.remove(file_path)
+            raise ValueError(f'Checksum mismatch for {url=}, {version=} but got sha256:{digest}')
+        self.cache.put(url, version, file_path, digest)
+        return self.cache.open(url, version)
+
+    def stream(self, url: str, consumer: typing.Callable[[typing.BinaryIO], typing.Any]) -> typing.Any:
+        """
+        Call `consumer` with a readable binary stream of the body and return its result, None if the resource does
+        not exist. The response is closed once consumed.
+
+        With a cache, a file whose upstream version is known is downloaded to the cache first (or served from it)
+        and `consumer` gets the cached file instead.
+        """
+        version = self.get_version(url) if self.cache is not None else None
+        if version is not None:
+            f = self._open_cached(url, version)
+            if f is None:
+                return None
+            with f:
+                return consumer(f)
+
+        response = self.request(url, stream=True)
+        if response is None:
+            return None
+        try:
+            # REMINDER: undo a transfer encoding only, `.gz` files are served as they are
+            response.raw.decode_content = True
+            return consumer(response.raw)
+        finally:
+            response.close()
+
+    def download(self, url: str, file_path: str, chunk_size: int=1 << 20) -> typing.Optional[str]:
+        """
+        Download a url to a file, resuming from the partially downloaded `{file_path}.part` if any.
+        Returns None if the resource does not exist.
+        """
+        part_path = f'{file_path}.part'
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset > 0 else None
+            response = self.request(url, headers=headers, stream=True)
+            if response is None:
+                return None
+            if response.status_code == 416:
+                # the part file is already complete
+                response.close()
+                break
+            # REMINDER: servers without range support answer 200 with the whole content, start over then
+            mode = 'ab' if offset > 0 and response.status_code == 206 else 'wb'
+            try:
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.debug(f'Resuming {url=} after {e}')
+                time.sleep(self._get_backoff(attempt))
+            finally:
+                response.close()
+        os.replace(part_path, file_path)
+        return file_path
+
+    def iter_fetch(
+            self,
+            items: typing.Iterable[tuple],
+            transform: typing.Callable[[typing.Any], typing.Any]=None,
+            max_workers: int=8,
+            stream: bool=False,
+        ) -> typing.Iterator[tuple]:
+        """
+        Fetch (key, url) items concurrently and yield (key, result, error) in completion order. `result` is the content,
+        or `transform(content)` computed in the worker thread, None if the resource does not exist. At most
+        `2 * max_workers` items are in flight so that the memory stays bounded. Items can also be (key, url, transform)
+        to override `transform` per item.
+
+        With `stream=True`, `transform` is required and gets a readable binary stream of the body instead of the
+        whole content, so that large files can be decoded while they download.
+        """
+        def _fetch(url, transform):
+            if stream:
+                return self.stream(url, transform)
+            content = self.fetch(url)
+            if content is None or transform is None:
+                return content
+            return transform(content)
+
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            while True:
+                while len(futures) < 2 * max_workers:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    key, url, item_transform = item if len(item) == 3 else (*item, transform)
+                    futures[executor.submit(_fetch, url, item_transform)] = key
+                if len(futures) == 0:
+                    return
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    error = future.exception()
+                    yield key, (future.result() if error is None else None), error
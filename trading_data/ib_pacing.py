@@ -0,0 +1,164 @@
+import math
+import time
+import heapq
+import typing
+import threading
+from collections import deque
+
+import pandas as pd
+
+
+BAR_SIZE_SECONDS = {
+    '1 secs': 1, '5 secs': 5, '10 secs': 10, '15 secs': 15, '30 secs': 30,
+    '1 min': 60, '2 mins': 120, '3 mins': 180, '5 mins': 300, '10 mins': 600, '15 mins': 900, '20 mins': 1200, '30 mins': 1800,
+    '1 hour': 3600, '2 hours': 7200, '3 hours': 10800, '4 hours': 14400, '8 hours': 28800,
+    '1 day': 86400, '1 week': 604800, '1 month': 2592000,
+}
+# the longest duration of a request (in seconds) for the bar sizes from a minimum size (in seconds), from the
+# "valid duration and bar size" table of the TWS API
+MAX_DURATIONS = [
+    (86400, 365 * 86400),  # 1 Y: 1 day - 1 month
+    (1800, 30 * 86400),  # 1 M: 30 mins - 1 month
+    (180, 7 * 86400),  # 1 W: 3 mins - 1 week
+    (120, 2 * 86400),  # 2 D: 2 mins - 1 day
+    (60, 86400),  # 1 D: 1 min - 1 day
+    (30, 28800),  # 8 hours: 30 secs - 8 hrs
+    (10, 14400),  # 4 hours: 10 secs - 3 hrs
+    (5, 3600),  # 1 hour: 5 secs - 1 hr
+    (1, 1800),  # 30 mins: 1 sec - 30 mins
+]
+# IB pacing rules of the historical data, as (max requests, period in seconds):
+# no more than 60 requests in any 10 minutes for the bars of 30 secs or less
+SMALL_BAR_MAX_SECONDS = 30
+SMALL_BAR_RULES = [(60, 600)]
+# and no 6 requests or more for the same contract, exchange and tick type within 2 seconds
+CONTRACT_RULES = [(5, 2)]
+# an identical request is a pacing violation within 15 seconds, so retries never come sooner
+MIN_RETRY_BACKOFF = 15
+DEFAULT_REQUEST_LATENCY = 2.0  # seconds for IB to answer a request, for the projections
+
+
+def get_bar_seconds(bar_size: str) -> int:
+    bar_size = bar_size.strip().lower()
+    if bar_size not in BAR_SIZE_SECONDS:
+        raise ValueError(f'{bar_size=} is not a valid IB bar size, e.g. {list(BAR_SIZE_SECONDS)}')
+    return BAR_SIZE_SECONDS[bar_size]
+
+
+def get_max_duration(bar_size: str) -> int:
+    """
+    Get the longest duration (in seconds) that a single request of `bar_size` bars can cover.
+    """
+    bar_seconds = get_bar_seconds(bar_size)
+    for min_bar_seconds, max_duration in MAX_DURATIONS:
+        if bar_seconds >= min_bar_seconds:
+            return max_duration
+
+
+def format_duration(seconds: float) -> str:
+    # IB durations are whole seconds below a day, whole days above
+    if seconds < 86400:
+        return f'{max(1, math.ceil(seconds))} S'
+    return f'{math.ceil(seconds / 86400)} D'
+
+
+def plan_chunks(start_date, end_date, bar_size: str) -> typing.List[tuple]:
+    """
+    Split [start_date, end_date) into the (end_datetime, duration) requests of `bar_size` bars, each one as long as IB allows.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    step = pd.Timedelta(seconds=get_max_duration(bar_size))
+    chunks = []
+    current_end = end
+    # REMINDER: walk backwards from the end, so that only the first chunk is partial
+    while current_end > start:
+        current_start = max(current_end - step, start)
+        chunks.append((current_end.strftime("%Y%m%d-%H:%M:%S"), format_duration((current_end - current_start).total_seconds())))
+        current_end = current_start
+    return chunks[::-1]
+
+
+def get_pacing_rules(bar_size: str) -> typing.List[tuple]:
+    return SMALL_BAR_RULES if get_bar_seconds(bar_size) <= SMALL_BAR_MAX_SECONDS else []
+
+
+class PacingLimiter:
+    """
+    Thread-safe model of the IB pacing rules: at most `max_requests` per `period` seconds over all the requests (`rules`)
+    and per contract (`contract_rules`).
+
+    Each rule is a token bucket whose tokens come back `period` seconds after they are taken, so that no sliding window
+    ever holds more requests than IB allows. Requests are scheduled first come first served.
+    `clock`/`sleep` default to `time.monotonic`/`time.sleep`.
+    """
+    def __init__(
+            self,
+            rules: typing.List[tuple]=(),
+            contract_rules: typing.List[tuple]=CONTRACT_RULES,
+            clock: typing.Callable[[], float]=time.monotonic,
+            sleep: typing.Callable[[float], None]=time.sleep,
+        ):
+        self.rules = list(rules)
+        self.contract_rules = list(contract_rules)
+        self.clock = clock
+        self.sleep = sleep
+        self._windows = [deque() for _ in self.rules]
+        self._contract_windows = {}  # key -> deques of `contract_rules`
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_bar_size(cls, bar_size: str) -> 'PacingLimiter':
+        return cls(rules=get_pacing_rules(bar_size))
+
+    def reserve(self, key, now: float) -> float:
+        """
+        Reserve the earliest time at or after `now` at which a request for the contract `key` may be sent.
+        """
+        with self._lock:
+            if key not in self._contract_windows:
+                self._contract_windows[key] = [deque() for _ in self.contract_rules]
+            windows = list(zip(self.rules + self.contract_rules, self._windows + self._contract_windows[key]))
+            start = max(now, self._last)
+            while True:
+                wait_s = 0.0
+                for (max_requests, period), window in windows:
+                    while len(window) > 0 and window[0] <= start - period:
+                        window.popleft()
+                    if len(window) >= max_requests:
+                        wait_s = max(wait_s, window[-max_requests] + period - start)
+                if wait_s <= 0:
+                    break
+                start += wait_s
+            for _, window in windows:
+                window.append(start)
+            self._last = start
+            return start
+
+    def acquire(self, key):
+        # block until a request for the contract `key` may be sent
+        start = self.reserve(key, self.clock())
+        wait_s = start - self.clock()
+        if wait_s > 0:
+            self.sleep(wait_s)
+
+
+def project_wall_time(
+        keys: typing.List[typing.Hashable],
+        bar_size: str,
+        max_in_flight: int,
+        latency: float=DEFAULT_REQUEST_LATENCY,
+    ) -> float:
+    """
+    Project the seconds needed to send the requests of the contracts `keys` (in order) under the pacing rules of
+    `bar_size`, with up to `max_in_flight` requests answered in `latency` seconds each.
+    """
+    limiter = PacingLimiter.for_bar_size(bar_size)
+    ends = []  # heap of the answer times of the requests in flight
+    now = 0.0
+    for key in keys:
+        if len(ends) >= max_in_flight:
+            now = max(now, heapq.heappop(ends))
+        now = limiter.reserve(key, now)
+        heapq.heappush(ends, now + latency)
+    return max(ends) if len(ends) > 0 else 0.0
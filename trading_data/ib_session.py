@@ -0,0 +1,335 @@
+import time
+import array
+import typing
+import itertools
+import threading
+
+import pandas as pd
+from ibapi.client import EClient
+from ibapi.wrapper import EWrapper
+from ibapi.contract import Contract
+from ibapi.common import BarData
+
+from trading_data.ib_pacing import MIN_RETRY_BACKOFF, PacingLimiter, get_pacing_rules
+from trading_data.logger import get_logger
+
+
+logger = get_logger(__name__, logger_lv='info')
+
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+DEFAULT_MAX_IN_FLIGHT = 8
+# notifications reported through `error`, e.g. `2104 Market data farm connection is OK`
+INFO_ERROR_CODES = (2104, 2106, 2107, 2108, 2158)
+# the connection to TWS (or from TWS to IB) is lost, the requests in flight will not complete
+CONNECTION_ERROR_CODES = (502, 504, 1100, 1300)
+# REMINDER: not an IB code, reported for the requests that are canceled after `request_timeout`
+TIMEOUT_ERROR_CODE = -1
+# the requests over the maximum number of simultaneous requests are rejected
+MAX_REQUESTS_ERROR_CODE = 322
+# REMINDER: 162 is the code of every historical data error, pacing violations as well as the periods without data
+HISTORICAL_DATA_ERROR_CODE = 162
+
+
+def is_no_data_error(error: tuple) -> bool:
+    # e.g. `HMDS query returned no data` for a holiday, the period is empty rather than failed
+    return error[0] == HISTORICAL_DATA_ERROR_CODE and 'no data' in error[1].lower()
+
+
+def is_retriable_error(error: tuple) -> bool:
+    if error[0] in (TIMEOUT_ERROR_CODE, MAX_REQUESTS_ERROR_CODE):
+        return True
+    return error[0] == HISTORICAL_DATA_ERROR_CODE and ('pacing' in error[1].lower() or 'cancelled' in error[1].lower())
+
+
+class HistoricalDataRequest:
+    """
+    A `reqHistoricalData` request of an `IBSession`. Its bars are buffered column by column as they arrive, and `done`
+    is set once it completes or fails (`error` is then the (error_code, error_string) from IB).
+    """
+    def __init__(self, req_id: int, contract: Contract, end_datetime: str, duration: str, bar_size: str):
+        self.req_id = req_id
+        self.contract = contract
+        self.end_datetime = end_datetime
+        self.duration = duration
+        self.bar_size = bar_size
+        self.dates = []
+        self.columns = {field: array.array('d') for field in BAR_FIELDS}
+        self.error = None
+        self.sent_at = None
+        self.done = threading.Event()
+
+    def add_bar(self, bar: BarData):
+        self.dates.append(bar.date)
+        self.columns['open'].append(bar.open)
+        self.columns['high'].append(bar.high)
+        self.columns['low'].append(bar.low)
+        self.columns['close'].append(bar.close)
+        # REMINDER: the volume is a Decimal in the recent API versions
+        self.columns['volume'].append(float(bar.volume))
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame({field: self.columns[field] for field in BAR_FIELDS})
+        # Strip timezone suffix from IB timestamp strings and parse only date & time
+        ts_clean = pd.Series(self.dates, dtype=str).str.extract(r'^(\d{8} \d{2}:\d{2}:\d{2})')[0]
+        df.index = pd.DatetimeIndex(pd.to_datetime(ts_clean, format="%Y%m%d %H:%M:%S"), name='ts')
+        return df
+
+
+class IBApp(EClient, EWrapper):
+    """
+    EClient/EWrapper of an `IBSession`. The callbacks run in the message loop thread and are routed by reqId.
+    """
+    def __init__(self):
+        EClient.__init__(self, self)
+        self.requests = {}  # reqId -> HistoricalDataRequest in flight
+        self.requests_lock = threading.Lock()
+        self.ready = threading.Event()  # set once the API is started, i.e. on the first `nextValidId`
+        self.on_finish = None
+
+    def nextValidId(self, orderId: int):
+        self.ready.set()
+
+    def historicalData(self, reqId, bar: BarData):
+        request = self.requests.get(reqId)
+        if request is not None:
+            request.add_bar(bar)
+
+    def historicalDataEnd(self, reqId, start, end):
+        self.finish(reqId)
+
+    def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=''):
+        if errorCode in INFO_ERROR_CODES:
+            logger.info(f"Info {errorCode}: {errorString}")
+        elif reqId in self.requests:
+            self.finish(reqId, error=(errorCode, errorString))
+        elif errorCode in CONNECTION_ERROR_CODES:
+            logger.error(f"Error {errorCode}: {errorString}")
+            self.finish_all(error=(errorCode, errorString))
+        else:
+            logger.error(f"Error {errorCode}: {errorString}")
+
+    def connectionClosed(self):
+        self.finish_all(error=(504, 'Not connected'))
+
+    def finish(self, req_id: int, error: tuple=None):
+        # REMINDER: a request finishes once, whichever of its end, an error or a timeout comes first
+        with self.requests_lock:
+            request = self.requests.pop(req_id, None)
+        if request is None:
+            return
+        request.error = error
+        request.done.set()
+        if self.on_finish is not None:
+            self.on_finish(request)
+
+    def finish_all(self, error: tuple):
+        for req_id in list(self.requests):
+            self.finish(req_id, error=error)
+
+
+class IBSession:
+    """
+    Long-lived connection to TWS / IB Gateway, shared by the requests of all the symbols.
+
+    Up to `max_in_flight` historical data requests are kept in flight on the connection. The bars are routed by reqId
+    into per-request columnar buffers, and the completion of each request is signaled with an event.
+    """
+    def __init__(
+            self,
+            host: str='127.0.0.1',
+            port: int=4003,
+            client_id: int=1,
+            max_in_flight: int=DEFAULT_MAX_IN_FLIGHT,
+            connect_timeout: float=10,
+            request_timeout: float=60,
+            pacing: bool=True,
+            max_retries: int=5,
+            retry_backoff: float=MIN_RETRY_BACKOFF,
+        ):
+        """
+        Args:
+            max_in_flight (int): maximum number of requests in flight, IB accepts 50 at most.
+            pacing (bool): delay the requests so that they never break the IB pacing rules, see `ib_pacing.PacingLimiter`.
+            max_retries (int): number of times a chunk is sent again after a pacing violation or a timeout.
+            retry_backoff (float): seconds before the first retry, doubled for each retry.
+        """
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.max_in_flight = max_in_flight
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.pacing = pacing
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.app = None
+        self._limiters = {}  # pacing rules -> PacingLimiter
+        self._thread = None
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._req_ids = itertools.count(1000)
+
+    def _create_app(self) -> IBApp:
+        app = IBApp()
+        # REMINDER: a request gives its slot back once, whichever of its end, an error or a timeout comes first
+        app.on_finish = lambda request: self._slots.release()
+        return app
+
+    def connect(self):
+        self.app = self._create_app()
+        self.app.connect(self.host, self.port, clientId=self.client_id)
+        if not self.app.isConnected():
+            raise ConnectionError(f'Failed to connect to TWS at {self.host}:{self.port}')
+        self._thread = threading.Thread(target=self.app.run, daemon=True)
+        self._thread.start()
+        if not self.app.ready.wait(self.connect_timeout):
+            self.disconnect()
+            raise TimeoutError(f'TWS at {self.host}:{self.port} did not start the API within {self.connect_timeout}s')
+
+    def disconnect(self):
+        if self.app is None:
+            return
+        self.app.disconnect()
+        self._thread.join(timeout=self.connect_timeout)
+        # the requests still in flight will never complete
+        self.app.finish_all(error=(504, 'Not connected'))
+        self.app = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    def get_limiter(self, bar_size: str) -> PacingLimiter:
+        # REMINDER: the bar sizes under the same pacing rules share their limiter
+        rules = tuple(get_pacing_rules(bar_size))
+        if rules not in self._limiters:
+            self._limiters[rules] = PacingLimiter(rules=rules)
+        return self._limiters[rules]
+
+    def request_historical_data(
+            self,
+            contract: Contract,
+            end_datetime: str,
+            duration: str,
+            bar_size: str,
+            what_to_show: str='TRADES',
+            use_rth: int=0,
+        ) -> HistoricalDataRequest:
+        """
+        Send a historical data request without waiting for its bars. Blocks while `max_in_flight` requests are in flight,
+        and until the pacing rules allow the request.
+        """
+        # REMINDER: the requests that never answer are expired while waiting, otherwise they would hold their slots forever
+        while not self._slots.acquire(timeout=1):
+            self._expire_requests()
+        if self.pacing:
+            self.get_limiter(bar_size).acquire((contract.symbol, contract.secType, contract.exchange, what_to_show))
+        request = HistoricalDataRequest(next(self._req_ids), contract, end_datetime, duration, bar_size)
+        with self.app.requests_lock:
+            self.app.requests[request.req_id] = request
+        request.sent_at = time.monotonic()
+        try:
+            self.app.reqHistoricalData(
+                reqId=request.req_id,
+                contract=contract,
+                endDateTime=end_datetime,
+                durationStr=duration,
+                barSizeSetting=bar_size,
+                whatToShow=what_to_show,
+                useRTH=use_rth,
+                formatDate=1,
+                keepUpToDate=False,
+                chartOptions=[]
+            )
+        except Exception as e:
+            self.app.finish(request.req_id, error=(504, str(e)))
+        return request
+
+    def wait(self, request: HistoricalDataRequest) -> HistoricalDataRequest:
+        """
+        Wait for a request to finish. A request still running `request_timeout` seconds after it was sent is canceled
+        and fails with `TIMEOUT_ERROR_CODE`.
+        """
+        timeout = max(0, request.sent_at + self.request_timeout - time.monotonic())
+        if not request.done.wait(timeout):
+            self._cancel(request)
+        return request
+
+    def _cancel(self, request: HistoricalDataRequest):
+        if self.app is None:
+            return
+        if self.app.isConnected():
+            self.app.cancelHistoricalData(request.req_id)
+        self.app.finish(request.req_id, error=(TIMEOUT_ERROR_CODE, f'No answer within {self.request_timeout}s'))
+
+    def _expire_requests(self):
+        now = time.monotonic()
+        with self.app.requests_lock:
+            requests = list(self.app.requests.values())
+        for request in requests:
+            if request.sent_at is not None and now - request.sent_at > self.request_timeout:
+                self._cancel(request)
+
+    def fetch_chunks(
+            self,
+            items: typing.List[tuple],
+            bar_size: str,
+            what_to_show: str='TRADES',
+            use_rth: int=0,
+        ) -> typing.Dict[typing.Hashable, typing.List[pd.DataFrame]]:
+        """
+        Fetch (key, contract, end_datetime, duration) chunks with the requests in flight concurrently, sent in order
+        under the pacing rules. Returns key -> frames of the chunks with bars.
+
+        The chunks that fail with a pacing violation or a timeout are sent again after an exponential backoff, up to
+        `max_retries` times. The other failures are logged and left out.
+        """
+        frames = {key: [] for key, *_ in items}
+        pending = list(items)
+        for attempt in range(self.max_retries + 1):
+            sent = [
+                (item, self.request_historical_data(item[1], item[2], item[3], bar_size, what_to_show=what_to_show, use_rth=use_rth))
+                for item in pending
+            ]
+            pending = []
+            for item, request in sent:
+                self.wait(request)
+                if request.error is None:
+                    if len(request.dates) > 0:
+                        frames[item[0]].append(request.to_frame())
+                elif is_no_data_error(request.error):
+                    continue
+                elif is_retriable_error(request.error) and attempt < self.max_retries:
+                    pending.append(item)
+                else:
+                    logger.error(f'Failed to fetch {request.contract.symbol} bars of {request.duration} until {request.end_datetime}: {request.error}')
+            if len(pending) == 0:
+                break
+            backoff = self.retry_backoff * (2 ** attempt)
+            logger.warning(f'Retrying {len(pending)} requests in {backoff:.1f}s after pacing violations or timeouts')
+            time.sleep(backoff)
+        return frames
+
+    def fetch_bars(
+            self,
+            contract: Contract,
+            chunks: typing.List[tuple],
+            bar_size: str,
+            what_to_show: str='TRADES',
+            use_rth: int=0,
+        ) -> pd.DataFrame:
+        """
+        Fetch the bars of the (end_datetime, duration) chunks of a contract, see `fetch_chunks`.
+        """
+        items = [(0, contract, end_datetime, duration) for end_datetime, duration in chunks]
+        return concat_bars(self.fetch_chunks(items, bar_size, what_to_show=what_to_show, use_rth=use_rth)[0])
+
+
+def concat_bars(dfs: typing.List[pd.DataFrame]) -> pd.DataFrame:
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=BAR_FIELDS, index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='ts'))
+    df = pd.concat(dfs)
+    # the chunks may overlap at their edges
+    return df[~df.index.duplicated(keep='last')].sort_index()
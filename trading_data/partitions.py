@@ -0,0 +1,136 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+GRANULARITIES = {
+    # granularity -> length of the partition name, e.g. `2024`, `2024-01`, `2024-01-31`
+    'year': 4,
+    'month': 7,
+    'day': 10,
+}
+
+
+def get_partition_bounds(partition: str) -> typing.Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Get the [start, end) time bounds of a partition named `YYYY`, `YYYY-MM` or `YYYY-MM-DD`.
+    """
+    if len(partition) == GRANULARITIES['year']:
+        start = pd.Timestamp(f'{partition}-01-01')
+        return start, start + pd.DateOffset(years=1)
+    elif len(partition) == GRANULARITIES['month']:
+        start = pd.Timestamp(f'{partition}-01')
+        return start, start + pd.DateOffset(months=1)
+    elif len(partition) == GRANULARITIES['day']:
+        start = pd.Timestamp(partition)
+        return start, start + pd.Timedelta(days=1)
+    raise ValueError(f'{partition=} is not a valid partition')
+
+
+def get_partition_name(date, granularity: str) -> str:
+    return pd.Timestamp(date).strftime('%Y-%m-%d')[:GRANULARITIES[granularity]]
+
+
+def overlaps_date_range(partition: str, start_date=None, end_date=None) -> bool:
+    # compare on the prefixes, e.g. `2024-01` overlaps [2024-01-15, 2024-03-01]
+    n = len(partition)
+    if start_date is not None and partition < pd.Timestamp(start_date).strftime('%Y-%m-%d')[:n]:
+        return False
+    if end_date is not None and partition > pd.Timestamp(end_date).strftime('%Y-%m-%d')[:n]:
+        return False
+    return True
+
+
+def merge_periods(periods: typing.List[typing.Tuple[pd.Timestamp, pd.Timestamp]]) -> typing.List[typing.Tuple[pd.Timestamp, pd.Timestamp]]:
+    merged = []
+    for start, end in sorted(periods):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def plan_partition_reads(partitions: typing.List[str], start_date=None, end_date=None) -> typing.List[tuple]:
+    """
+    Plan how to read the partitions of a ticker. A finer partition takes precedence over the coarser
+    partitions that contain it (day > month > year), e.g. a daily file written after a monthly compaction
+    replaces that day in the monthly file.
+
+    Returns:
+        list of (partition, bounds, excluded_periods) in partition order. `bounds` is the [start, end) time
+        range to read from the partition (None if the whole partition is needed) and `excluded_periods` are
+        the [start, end) periods covered by finer partitions.
+    """
+    range_start = pd.Timestamp(pd.Timestamp(start_date).date()) if start_date is not None else None
+    range_end = pd.Timestamp(pd.Timestamp(end_date).date()) + pd.Timedelta(days=1) if end_date is not None else None
+    plans = []
+    for partition in partitions:
+        if partition == '':
+            plans.append((partition, None, []))
+            continue
+        start, end = get_partition_bounds(partition)
+        excluded = [
+            get_partition_bounds(other)
+            for other in partitions
+            if len(other) > len(partition) and other.startswith(partition)
+        ]
+        bounds = None
+        if (range_start is not None and range_start > start) or (range_end is not None and range_end < end):
+            bounds = (max(start, range_start) if range_start is not None else start, min(end, range_end) if range_end is not None else end)
+        plans.append((partition, bounds, merge_periods(excluded)))
+    return plans
+
+
+def split_partition_reads(plans: typing.List[tuple]) -> typing.List[tuple]:
+    """
+    Split the planned reads into ts-ordered, non-overlapping segments of (partition, bounds), cutting the
+    excluded periods out of the coarser partitions. Used when the partitions have to be streamed in ts order.
+    """
+    segments = []
+    for partition, bounds, excluded_periods in plans:
+        if partition == '':
+            segments.append((partition, bounds))
+            continue
+        start, end = bounds if bounds is not None else get_partition_bounds(partition)
+        for excluded_start, excluded_end in excluded_periods:
+            if excluded_end <= start or excluded_start >= end:
+                continue
+            if excluded_start > start:
+                segments.append((partition, (start, excluded_start)))
+            start = max(start, excluded_end)
+        if start < end:
+            segments.append((partition, (start, end)))
+    return sorted(segments, key=lambda segment: segment[1][0] if segment[1] is not None else pd.Timestamp.min)
+
+
+def get_range_filters(start_date=None, end_date=None) -> typing.List[tuple]:
+    """
+    Get the exact ts filters of a [start_date, end_date] read. The partition reads are planned on whole days, so only
+    a start or an end with a time of day needs them, a date alone keeps its whole day.
+    """
+    filters = []
+    if start_date is not None and pd.Timestamp(start_date) != pd.Timestamp(start_date).normalize():
+        filters.append(('ts', '>=', pd.Timestamp(start_date)))
+    if end_date is not None and pd.Timestamp(end_date) != pd.Timestamp(end_date).normalize():
+        filters.append(('ts', '<=', pd.Timestamp(end_date)))
+    return filters
+
+
+def get_bounds_filters(bounds, range_filters: typing.List[tuple]=()) -> typing.Optional[typing.List[tuple]]:
+    filters = [('ts', '>=', bounds[0]), ('ts', '<', bounds[1])] if bounds is not None else []
+    return filters + list(range_filters) or None
+
+
+def get_excluded_mask(ts: np.ndarray, excluded_periods: typing.List[tuple]) -> np.ndarray:
+    """
+    Vectorized mask of the timestamps that fall into any of the (sorted, non-overlapping) excluded periods.
+    """
+    ts = np.asarray(ts, dtype='datetime64[ns]')
+    if len(excluded_periods) == 0:
+        return np.zeros(len(ts), dtype=bool)
+    starts = np.array([start.to_datetime64() for start, _ in excluded_periods], dtype='datetime64[ns]')
+    ends = np.array([end.to_datetime64() for _, end in excluded_periods], dtype='datetime64[ns]')
+    idx = np.searchsorted(starts, ts, side='right') - 1
+    return (idx >= 0) & (ts < ends[np.maximum(idx, 0)])
@@ -0,0 +1,83 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+ROLLUP_FREQS = {
+    'hour_bar': '1h',
+    'day_bar': '1D',
+}
+
+
+def get_bucket_labels(ts: pd.Series, freq: str, tz: str=None, session_offset: str=None) -> pd.Series:
+    """
+    Get the bucket label of each timestamp.
+
+    Args:
+        ts (pd.Series): naive timestamps, in UTC if `tz` is given.
+        freq (str): `1h` or `1D`.
+        tz (str, optional): the timezone of the sessions, e.g. `America/New_York`. The labels are naive local times.
+        session_offset (str, optional): the start of a session relative to midnight, e.g. `-6h` for sessions starting
+            at 18:00 of the previous day or `9h30min`. Daily buckets are labelled by their trading date.
+    """
+    ts = pd.to_datetime(ts)
+    if tz is not None:
+        ts = ts.dt.tz_localize('UTC').dt.tz_convert(tz).dt.tz_localize(None)
+    offset = pd.Timedelta(session_offset) if session_offset is not None else pd.Timedelta(0)
+    if pd.Timedelta(freq) >= pd.Timedelta(days=1):
+        # label the daily buckets by their trading date
+        return (ts - offset).dt.floor(freq)
+    return (ts - offset).dt.floor(freq) + offset
+
+
+def aggregate_ohlcv(
+        df: pd.DataFrame,
+        freq: str,
+        tz: str=None,
+        session_offset: str=None,
+        session_hours: typing.Tuple[str, str]=None,
+    ) -> pd.DataFrame:
+    """
+    Aggregate ts-sorted OHLCV bars (with a `ts` column) into coarser bars in a single vectorized pass.
+    `trade_count`, `buy_volume`, `sell_volume` and `vwap` are aggregated too when present.
+
+    Args:
+        session_hours (tuple, optional): (start, end) local times, e.g. ('09:30', '16:00'). Bars outside are ignored.
+    """
+    df = df[df['close'].notna()]  # empty bars (no trades) do not contribute
+    if session_hours is not None:
+        local_ts = pd.to_datetime(df['ts'])
+        if tz is not None:
+            local_ts = local_ts.dt.tz_localize('UTC').dt.tz_convert(tz).dt.tz_localize(None)
+        time_of_day = local_ts - local_ts.dt.normalize()
+        df = df[(time_of_day >= pd.Timedelta(f'{session_hours[0]}:00')) & (time_of_day < pd.Timedelta(f'{session_hours[1]}:00'))]
+    columns = ['ts', 'open', 'high', 'low', 'close', 'volume']
+    if len(df) == 0:
+        return pd.DataFrame(columns=columns)
+    labels = get_bucket_labels(df['ts'], freq, tz=tz, session_offset=session_offset).to_numpy()
+    order = np.argsort(labels, kind='stable')  # already sorted unless the labels wrap around a DST change
+    labels = labels[order]
+    # REMINDER: the labels are sorted, the buckets are the runs of equal labels
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)] - 1
+    high = df['high'].to_numpy()[order]
+    low = df['low'].to_numpy()[order]
+    volume = df['volume'].to_numpy()[order]
+    bars = pd.DataFrame({
+        'ts': labels[starts],
+        'open': df['open'].to_numpy()[order][starts],
+        'high': np.fmax.reduceat(high, starts),
+        'low': np.fmin.reduceat(low, starts),
+        'close': df['close'].to_numpy()[order][ends],
+        'volume': np.add.reduceat(np.nan_to_num(volume), starts),
+    })
+    # the trade statistics of the tick sources, if any
+    for column in ['trade_count', 'buy_volume', 'sell_volume']:
+        if column in df.columns:
+            bars[column] = np.add.reduceat(np.nan_to_num(df[column].to_numpy(dtype=np.float64)[order]), starts)
+    if 'vwap' in df.columns:
+        notional = np.nan_to_num(df['vwap'].to_numpy(dtype=np.float64)[order] * volume)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bars['vwap'] = np.add.reduceat(notional, starts) / bars['volume'].to_numpy()
+    return bars
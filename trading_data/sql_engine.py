@@ -0,0 +1,79 @@
+import typing
+
+import pandas as pd
+
+
+def connect(threads: int=None):
+    """
+    Open an in-memory DuckDB connection. DuckDB scans the parquet files in parallel, with projection pushdown and
+    row-group pruning by the column statistics.
+    """
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError('`duckdb` is required for SQL queries, install it with `pip install duckdb`') from e
+    conn = duckdb.connect(':memory:')
+    if threads is not None:
+        conn.execute(f'SET threads = {int(threads)}')
+    return conn
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def quote_literal(value) -> str:
+    if isinstance(value, pd.Timestamp):
+        value = value.isoformat(sep=' ')
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _values_sql(rows: typing.List[tuple]) -> str:
+    return ', '.join('(' + ', '.join(quote_literal(value) if not isinstance(value, int) else str(value) for value in row) + ')' for row in rows)
+
+
+def build_view_sql(files: typing.List[dict], start_date=None, end_date=None) -> str:
+    """
+    Build the SELECT of a view over the partition files of a version, with `asset_type` and `ticker` columns.
+
+    Args:
+        files (list): dicts of `file_path`, `asset_type`, `ticker`, `base_file_path` (the partition a delta belongs to,
+            the file itself otherwise), `seq` (0 for a partition, the write order for its deltas) and `excluded_periods`
+            ([start, end) periods of the partition replaced by finer partitions).
+        start_date, end_date (optional): both inclusive, pushed down to the row groups by their ts statistics.
+    """
+    has_deltas = {file['base_file_path'] for file in files if file['seq'] > 0}
+    files_sql = _values_sql([(file['file_path'], file['base_file_path'], file['asset_type'], file['ticker'], file['seq']) for file in files])
+    excluded = [(file['file_path'], start, end) for file in files for start, end in file['excluded_periods']]
+
+    conditions = []
+    if start_date is not None:
+        conditions.append(f"s.ts >= TIMESTAMP {quote_literal(pd.Timestamp(pd.Timestamp(start_date).date()))}")
+    if end_date is not None:
+        conditions.append(f"s.ts < TIMESTAMP {quote_literal(pd.Timestamp(pd.Timestamp(end_date).date()) + pd.Timedelta(days=1))}")
+    if len(excluded) > 0:
+        # drop the periods of the compacted partitions that are replaced by finer partitions
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM (VALUES " + _values_sql(excluded) + ") AS e(file_path, start_ts, end_ts) "
+            "WHERE e.file_path = s.filename AND s.ts >= CAST(e.start_ts AS TIMESTAMP) AND s.ts < CAST(e.end_ts AS TIMESTAMP))"
+        )
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    def _scan(file_paths, qualify=''):
+        paths_sql = ', '.join(quote_literal(file_path) for file_path in file_paths)
+        return (
+            f"SELECT f.asset_type, f.ticker, s.* EXCLUDE (filename) "
+            f"FROM read_parquet([{paths_sql}], union_by_name = true, filename = true) AS s "
+            f"JOIN (VALUES {files_sql}) AS f(file_path, base_file_path, asset_type, ticker, seq) ON s.filename = f.file_path "
+            f"{where} {qualify}"
+        )
+
+    selects = []
+    plain_files = [file['file_path'] for file in files if file['base_file_path'] not in has_deltas]
+    if len(plain_files) > 0:
+        selects.append(_scan(plain_files))
+    delta_files = [file['file_path'] for file in files if file['base_file_path'] in has_deltas]
+    if len(delta_files) > 0:
+        # REMINDER: merge-on-read of the partitions with deltas only, the last write wins
+        selects.append(_scan(delta_files, qualify='QUALIFY row_number() OVER (PARTITION BY f.base_file_path, s.ts ORDER BY f.seq DESC) = 1'))
+    return ' UNION ALL BY NAME '.join(f'({select})' for select in selects)
@@ -0,0 +1,95 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+VOLUME_COLUMNS = ['volume']
+
+STORAGE_PROFILES = {
+    # pandas/pyarrow defaults: float64 everywhere and snappy
+    'default': {},
+    # lossless: integer volume where exact, zstd and byte-stream-split encoding for floats
+    'lossless': {
+        'integer_volume': True,
+        'compression': 'zstd',
+        'compression_level': 9,
+        'byte_stream_split': True,
+    },
+    # float32 prices (~7 significant digits), e.g. for crypto min bars
+    'compact': {
+        'price_dtype': 'float32',
+        'integer_volume': True,
+        'compression': 'zstd',
+        'compression_level': 9,
+        'byte_stream_split': True,
+    },
+}
+
+
+# the profiles of the versions without a profile set in the catalog
+DEFAULT_VERSION_PROFILES = {
+    'tick': 'lossless',
+}
+
+
+def get_storage_profile(profile: typing.Union[str, dict, None]) -> dict:
+    if profile is None:
+        return STORAGE_PROFILES['default']
+    if isinstance(profile, dict):
+        return profile
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f'{profile=} is not supported, available profiles: {list(STORAGE_PROFILES)}')
+    return STORAGE_PROFILES[profile]
+
+
+def downcast_volume(volume: pd.Series) -> pd.Series:
+    # only cast to integers if it is lossless
+    values = volume.to_numpy()
+    if not np.issubdtype(values.dtype, np.floating) or len(values) == 0:
+        return volume
+    if not np.isfinite(values).all() or not (values == np.round(values)).all():
+        return volume
+    if values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+        return volume.astype('int32')
+    if values.min() >= np.iinfo(np.int64).min and values.max() <= np.iinfo(np.int64).max:
+        return volume.astype('int64')
+    return volume
+
+
+def prepare_for_write(df: pd.DataFrame, profile: typing.Union[str, dict, None]=None) -> typing.Tuple[pd.DataFrame, dict]:
+    """
+    Apply a storage profile to a table before writing it.
+
+    Returns:
+        (df, write_kwargs): the downcasted table and the keyword arguments for `to_parquet`.
+    """
+    profile = get_storage_profile(profile)
+    if len(profile) == 0:
+        return df, {}
+    df = df.copy(deep=False)
+    if profile.get('price_dtype') is not None:
+        for column in PRICE_COLUMNS:
+            if column in df.columns and np.issubdtype(df[column].dtype, np.floating):
+                df[column] = df[column].astype(profile['price_dtype'])
+    if profile.get('integer_volume'):
+        for column in VOLUME_COLUMNS:
+            if column in df.columns:
+                df[column] = downcast_volume(df[column])
+
+    write_kwargs = {}
+    if profile.get('compression') is not None:
+        write_kwargs['compression'] = profile['compression']
+    if profile.get('compression_level') is not None:
+        write_kwargs['compression_level'] = profile['compression_level']
+    if profile.get('byte_stream_split'):
+        float_columns = [column for column in df.columns if np.issubdtype(df[column].dtype, np.floating)]
+        if len(float_columns) > 0:
+            write_kwargs['use_byte_stream_split'] = float_columns
+            # REMINDER: byte-stream-split replaces dictionary encoding, keep dictionaries for the other columns only
+            write_kwargs['use_dictionary'] = [
+                column for column in df.columns
+                if column not in float_columns and (pd.api.types.is_string_dtype(df[column]) or isinstance(df[column].dtype, pd.CategoricalDtype))
+            ]
+    return df, write_kwargs
@@ -0,0 +1,69 @@
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def iter_merged_chunks(
+        chunk_iterators: typing.Dict[str, typing.Iterator[pd.DataFrame]],
+        batch_rows: int,
+        max_workers: int=8,
+    ) -> typing.Iterator[pd.DataFrame]:
+    """
+    Merge per-ticker iterators of ts-sorted chunks into ts-ordered batches of `batch_rows` rows with a `ticker` column.
+
+    The next chunk of every ticker is prefetched in the background while the current chunks are merged. Only the rows
+    up to the smallest last ts of the buffered chunks are emitted at each step, so at most one buffered and one
+    prefetched chunk per ticker are held in memory.
+    """
+    def _next_chunk(iterator):
+        return next(iterator, None)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunk_iterators)))) as executor:
+        futures = {ticker: executor.submit(_next_chunk, iterator) for ticker, iterator in chunk_iterators.items()}
+        buffers = {}
+        pending = []
+        n_pending = 0
+        while len(futures) > 0 or len(buffers) > 0:
+            # refill the empty buffers from the prefetched chunks and prefetch the next ones
+            for ticker in list(futures):
+                while ticker in futures and ticker not in buffers:
+                    chunk = futures.pop(ticker).result()
+                    if chunk is None:
+                        break
+                    futures[ticker] = executor.submit(_next_chunk, chunk_iterators[ticker])
+                    if len(chunk) > 0:
+                        buffers[ticker] = chunk
+            if len(buffers) == 0:
+                continue
+
+            # every ticker that may have more chunks has a buffer now, tickers without more chunks do not bound the cutoff
+            cutoff = None
+            if len(futures) > 0:
+                cutoff = min(buffers[ticker]['ts'].iat[-1] for ticker in futures)
+            taken = []
+            for ticker in list(buffers):
+                buffer = buffers[ticker]
+                n = len(buffer) if cutoff is None else int(np.searchsorted(buffer['ts'].values, np.datetime64(cutoff), side='right'))
+                if n == 0:
+                    continue
+                taken.append(buffer.iloc[:n].assign(ticker=ticker))
+                if n == len(buffer):
+                    del buffers[ticker]
+                else:
+                    buffers[ticker] = buffer.iloc[n:]
+            if len(taken) == 0:
+                continue
+            merged = pd.concat(taken, ignore_index=True).sort_values('ts', kind='stable', ignore_index=True)
+            pending.append(merged)
+            n_pending += len(merged)
+            if n_pending >= batch_rows:
+                df = pd.concat(pending, ignore_index=True)
+                n_full = len(df) - len(df) % batch_rows
+                for start in range(0, n_full, batch_rows):
+                    yield df.iloc[start:start + batch_rows].reset_index(drop=True)
+                pending = [df.iloc[n_full:]] if n_full < len(df) else []
+                n_pending = len(df) - n_full
+        if n_pending > 0:
+            yield pd.concat(pending, ignore_index=True)
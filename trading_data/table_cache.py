@@ -0,0 +1,77 @@
+import os
+import threading
+import typing
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class TableCache:
+    """
+    In-process LRU cache of decoded tables, bounded by a byte budget.
+
+    Entries are keyed by (resolved file path, mtime, size, columns), so a table that is rewritten
+    on disk is never served from a stale entry.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (df, n_bytes), ordered from least to most recently used
+        self._lock = threading.Lock()  # tables can be loaded from multiple threads
+
+    @staticmethod
+    def make_key(file_path: str, columns: typing.List[str]=None) -> tuple:
+        file_path = os.path.realpath(file_path)
+        stat = os.stat(file_path)
+        return (file_path, stat.st_mtime_ns, stat.st_size, tuple(columns) if columns is not None else None)
+
+    def get(self, key: tuple) -> typing.Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # REMINDER: return a copy so that callers can mutate the table without corrupting the cache
+        return entry[0].copy()
+
+    def put(self, key: tuple, df: pd.DataFrame):
+        n_bytes = int(df.memory_usage(index=True, deep=True).sum())
+        if n_bytes > self.max_bytes:
+            # never cache a table that can not fit into the budget on its own
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, n_bytes)
+            self.current_bytes += n_bytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate(self, file_path: str):
+        file_path = os.path.realpath(file_path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == file_path]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'n_entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,247 @@
+import typing
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+
+
+DEFAULT_BLOCK_SIZE = 64 << 20  # bytes of decompressed csv parsed at a time
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap']
+SIDE_COLUMNS = ['buy_volume', 'sell_volume']  # volumes of the buyer/seller initiated trades
+SUM_FIELDS = ['volume', 'notional', 'trade_count', 'buy_volume', 'sell_volume']
+
+
+def _is_header(line: bytes) -> bool:
+    first_field = line.split(b',', 1)[0].strip()
+    try:
+        float(first_field)
+    except ValueError:
+        return True
+    return False
+
+
+def iter_csv_tables(
+        fileobj: typing.BinaryIO,
+        column_names: typing.List[str]=None,
+        include_columns: typing.List[str]=None,
+        block_size: int=DEFAULT_BLOCK_SIZE,
+    ) -> typing.Iterator[pa.Table]:
+    """
+    Parse a csv stream block by block with the multithreaded arrow csv reader, so that only one block of the
+    decompressed file is in memory at a time. Blocks are cut at line boundaries.
+
+    Args:
+        fileobj: readable binary stream of the (decompressed) csv.
+        column_names (list, optional): column names of files without a header line. The first line is used as
+            the header when it is not numeric.
+        include_columns (list, optional): columns to keep.
+    """
+    first_line = fileobj.readline()
+    if len(first_line) == 0:
+        return
+    remainder = b''
+    if column_names is None or _is_header(first_line):
+        column_names = first_line.decode().strip().split(',')
+    else:
+        remainder = first_line
+    read_options = pa_csv.ReadOptions(column_names=column_names, use_threads=True)
+    convert_options = pa_csv.ConvertOptions(include_columns=include_columns)
+
+    def _parse(data: bytes) -> pa.Table:
+        return pa_csv.read_csv(pa.BufferReader(data), read_options=read_options, convert_options=convert_options)
+
+    while True:
+        block = fileobj.read(block_size)
+        if len(block) == 0:
+            break
+        block = remainder + block
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            # a single line longer than the block
+            remainder = block
+            continue
+        remainder = block[cut:]
+        yield _parse(block[:cut])
+    if len(remainder.strip()) > 0:
+        yield _parse(remainder)
+
+
+def _is_sorted(values: np.ndarray) -> bool:
+    return len(values) < 2 or bool(np.all(values[1:] >= values[:-1]))
+
+
+def _stable_order(bucket: np.ndarray, ts: np.ndarray) -> typing.Optional[np.ndarray]:
+    # order by (bucket, ts), rows that tie keep their arrival order. None if the rows are already in order
+    if _is_sorted(ts):
+        return None
+    order = np.argsort(ts, kind='stable')
+    return order[np.argsort(bucket[order], kind='stable')]
+
+
+def _take(values: np.ndarray, order: typing.Optional[np.ndarray]) -> np.ndarray:
+    return values if order is None else values[order]
+
+
+def _reduce(rows: dict, step: int) -> dict:
+    """
+    Reduce rows (ticks or finer bars) into one row per `step` bucket with vectorized kernels.
+    """
+    bucket = rows['first_ts'] - np.mod(rows['first_ts'], step)
+    open_order = _stable_order(bucket, rows['first_ts'])
+    sorted_bucket = _take(bucket, open_order)
+    starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)] - 1
+    close_order = _stable_order(bucket, rows['last_ts'])
+    reduced = {
+        'bucket': sorted_bucket[starts],
+        'first_ts': _take(rows['first_ts'], open_order)[starts],
+        'last_ts': _take(rows['last_ts'], close_order)[ends],
+        'open': _take(rows['open'], open_order)[starts],
+        'high': np.maximum.reduceat(_take(rows['high'], open_order), starts),
+        'low': np.minimum.reduceat(_take(rows['low'], open_order), starts),
+        'close': _take(rows['close'], close_order)[ends],
+    }
+    for field in SUM_FIELDS:
+        if field in rows:
+            reduced[field] = np.add.reduceat(_take(rows[field], open_order), starts)
+    return reduced
+
+
+class TickBarBuilder:
+    """
+    Aggregate ticks into time bars of one or more frequencies, chunk by chunk.
+
+    Ticks are reduced once into bars of the finest frequency, coarser frequencies are reduced from these bars,
+    so that extra frequencies cost almost nothing. Only one row per finest bar is kept between chunks, memory
+    is bounded by the number of bars whatever the number of ticks, and a bar spanning a chunk boundary is
+    combined as if all its ticks had been seen at once.
+
+    The bars have `BAR_COLUMNS` (and `SIDE_COLUMNS` if the sides of the trades are given). open/high/low/close/volume
+    match `df.resample(freq)` of the ticks: open/close are the prices of the first/last tick by ts (by arrival for
+    ties), empty bars in between have NaN prices and a 0 volume.
+    """
+    def __init__(self, freqs: typing.Union[str, typing.List[str]]='1min'):
+        self.freqs = [freqs] if isinstance(freqs, str) else list(freqs)
+        self.steps = {freq: pd.Timedelta(freq).value for freq in self.freqs}
+        self.base_step = min(self.steps.values())
+        for freq, step in self.steps.items():
+            assert step % self.base_step == 0, f'{freq=} is not a multiple of the finest frequency'
+        self._state = None  # dict of arrays, one row per finest bar sorted by bucket
+        self._has_side = None
+
+    def add(self, ts: np.ndarray, price: np.ndarray, size: np.ndarray, is_buy: np.ndarray=None):
+        """
+        Args:
+            ts (np.ndarray): tick timestamps as int64 nanoseconds (or datetime64), in any order.
+            is_buy (np.ndarray, optional): whether each trade was initiated by the buyer.
+        """
+        ts = np.asarray(ts).astype('datetime64[ns]').view(np.int64)
+        if len(ts) == 0:
+            return
+        if self._has_side is None:
+            self._has_side = is_buy is not None
+        assert self._has_side == (is_buy is not None), 'the sides must be given for all the chunks or none'
+        price = np.asarray(price, dtype=np.float64)
+        size = np.asarray(size)
+        # REMINDER: ticks are bars of a single trade, so that they are reduced with the kept bars in one pass
+        rows = {
+            'first_ts': ts,
+            'last_ts': ts,
+            'open': price,
+            'high': price,
+            'low': price,
+            'close': price,
+            'volume': size,
+            'notional': price * size,
+            'trade_count': np.ones(len(ts), dtype=np.int64),
+        }
+        if is_buy is not None:
+            is_buy = np.asarray(is_buy, dtype=bool)
+            rows['buy_volume'] = np.where(is_buy, size, 0)
+            rows['sell_volume'] = np.where(is_buy, 0, size)
+        bars = _reduce(rows, self.base_step)
+        if self._state is not None:
+            # the kept bars come first, so that they win the ties of the open and lose those of the close
+            bars = _reduce({name: np.concatenate([self._state[name], bars[name]]) for name in bars}, self.base_step)
+        self._state = bars
+
+    def to_frame(self, freq: str=None) -> pd.DataFrame:
+        """
+        The bars of `freq` (the first frequency by default) so far, indexed by `ts`, with every bar between the first
+        and the last one.
+        """
+        freq = freq or self.freqs[0]
+        columns = BAR_COLUMNS + (SIDE_COLUMNS if self._has_side else [])
+        if self._state is None:
+            return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='ts'), dtype=np.float64)
+        bars = self._state
+        if self.steps[freq] != self.base_step:
+            bars = _reduce(bars, self.steps[freq])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = bars['notional'] / bars['volume']
+        df = pd.DataFrame(
+            {**{column: bars[column] for column in columns if column != 'vwap'}, 'vwap': vwap},
+            index=pd.DatetimeIndex(bars['bucket'].view('datetime64[ns]'), name='ts'),
+        )[columns]
+        full_index = pd.date_range(df.index[0], df.index[-1], freq=freq, name='ts')
+        if len(full_index) == len(df):
+            return df
+        df = df.reindex(full_index)
+        for column in ['volume', 'trade_count'] + (SIDE_COLUMNS if self._has_side else []):
+            df[column] = df[column].fillna(0).astype(bars[column].dtype)
+        return df
+
+    def to_frames(self) -> typing.Dict[str, pd.DataFrame]:
+        return {freq: self.to_frame(freq) for freq in self.freqs}
+
+
+def create_time_bars_from_tick_data(df: pd.DataFrame, freq: typing.Union[str, typing.List[str]]='1min', side_column: str=None, buy_value=None):
+    """
+    Aggregate ticks indexed by ts, with `price` and `size` columns, into time bars.
+
+    Args:
+        freq (str or list): a frequency, or a list of frequencies to get a dict of frequency -> bars.
+        side_column (str, optional): the column of the trade sides, a trade is buyer initiated if its side is `buy_value`.
+    """
+    builder = TickBarBuilder(freqs=freq)
+    is_buy = (df[side_column] == buy_value).to_numpy() if side_column is not None else None
+    builder.add(df.index.to_numpy(dtype='datetime64[ns]'), df['price'].to_numpy(), df['size'].to_numpy(), is_buy=is_buy)
+    return builder.to_frame() if isinstance(freq, str) else builder.to_frames()
+
+
+def create_time_bars_from_stream(
+        fileobj: typing.BinaryIO,
+        ts_column: str,
+        ts_unit: str,
+        price_column: str='price',
+        size_column: str='size',
+        side_column: str=None,
+        buy_value=None,
+        freq: typing.Union[str, typing.List[str]]='1min',
+        column_names: typing.List[str]=None,
+        block_size: int=DEFAULT_BLOCK_SIZE,
+        tick_writer=None,
+    ):
+    """
+    Stream a csv of trades into time bars with bounded memory, see `iter_csv_tables` and `TickBarBuilder`.
+    The ticks are also written chunk by chunk to `tick_writer` (a `tick_store.TickPartitionWriter`) if given.
+
+    Args:
+        ts_unit (str): unit of the numeric `ts_column`, e.g. `s` or `ms`.
+        side_column (str, optional): the column of the trade sides, a trade is buyer initiated if its side is `buy_value`.
+        freq (str or list): a frequency, or a list of frequencies to get a dict of frequency -> bars.
+    """
+    builder = TickBarBuilder(freqs=freq)
+    include_columns = [ts_column, price_column, size_column] + ([side_column] if side_column is not None else [])
+    for table in iter_csv_tables(fileobj, column_names=column_names, include_columns=include_columns, block_size=block_size):
+        ts = pd.to_datetime(table.column(ts_column).to_numpy(), unit=ts_unit).to_numpy(dtype='datetime64[ns]')
+        is_buy = None
+        if side_column is not None:
+            is_buy = pc.equal(table.column(side_column), pa.scalar(buy_value)).to_numpy(zero_copy_only=False)
+        price, size = table.column(price_column).to_numpy(), table.column(size_column).to_numpy()
+        builder.add(ts, price, size, is_buy=is_buy)
+        if tick_writer is not None:
+            tick_writer.write(ts, price, size, is_buy=is_buy)
+    return builder.to_frame() if isinstance(freq, str) else builder.to_frames()
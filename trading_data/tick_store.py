@@ -0,0 +1,96 @@
+import typing
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from trading_data.storage_profiles import prepare_for_write
+
+
+TICK_COLUMNS = ['price', 'size', 'side']  # next to the `ts` index
+# REMINDER: `side` is 1 for the trades initiated by the buyer, -1 for those initiated by the seller
+BUY_SIDE = 1
+SELL_SIDE = -1
+DEFAULT_TICK_ROW_GROUP_SIZE = 1_000_000
+
+
+def _get_template(profile=None) -> typing.Tuple[pd.DataFrame, dict]:
+    template = pd.DataFrame(
+        {
+            'price': np.array([], dtype=np.float64),
+            'size': np.array([], dtype=np.float64),
+            'side': np.array([], dtype=np.int8),
+        },
+        index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='ts'),
+    )
+    return prepare_for_write(template, profile)
+
+
+class TickPartitionWriter:
+    """
+    Stream the ticks of a partition into a parquet file chunk by chunk, so that a day of ticks never has to be
+    held in memory. The file has the layout of `write_parquet_table`, with a `ts` index.
+    """
+    def __init__(self, file_path: str, profile=None, row_group_size: int=DEFAULT_TICK_ROW_GROUP_SIZE):
+        template, write_kwargs = _get_template(profile)
+        self.dtypes = template.dtypes.to_dict()
+        self.schema = pa.Schema.from_pandas(template, preserve_index=True)
+        self.row_group_size = row_group_size
+        self.n_rows = 0
+        self._writer = pq.ParquetWriter(file_path, self.schema, **write_kwargs)
+
+    def write(self, ts: np.ndarray, price: np.ndarray, size: np.ndarray, is_buy: np.ndarray):
+        """
+        Args:
+            ts (np.ndarray): tick timestamps as datetime64 (or int64 nanoseconds).
+            is_buy (np.ndarray): whether each trade was initiated by the buyer.
+        """
+        if len(ts) == 0:
+            return
+        df = pd.DataFrame(
+            {
+                'price': price,
+                'size': size,
+                'side': np.where(np.asarray(is_buy, dtype=bool), BUY_SIDE, SELL_SIDE),
+            },
+            index=pd.DatetimeIndex(np.asarray(ts).astype('datetime64[ns]'), name='ts'),
+        ).astype(self.dtypes)
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind='stable')
+        self._writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=True), row_group_size=self.row_group_size)
+        self.n_rows += len(df)
+
+    def close(self):
+        self._writer.close()
+
+
+class DailyTickWriter:
+    """
+    Route the ticks of a multi-day stream (e.g. a monthly archive) to one partition writer per day.
+
+    `open_writer(date)` is a context manager yielding the `TickPartitionWriter` of a `YYYY-MM-DD` date. The writers
+    are opened as their days show up and all closed (and swapped in) when the `DailyTickWriter` context exits.
+    """
+    def __init__(self, open_writer: typing.Callable[[str], typing.ContextManager[TickPartitionWriter]]):
+        self.open_writer = open_writer
+        self._writers = {}
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        self._stack.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stack.__exit__(*exc_info)
+
+    def write(self, ts: np.ndarray, price: np.ndarray, size: np.ndarray, is_buy: np.ndarray):
+        ts = np.asarray(ts).astype('datetime64[ns]')
+        days = ts.astype('datetime64[D]')
+        for day in np.unique(days):
+            mask = days == day
+            date = str(day)
+            if date not in self._writers:
+                self._writers[date] = self._stack.enter_context(self.open_writer(date))
+            self._writers[date].write(ts[mask], np.asarray(price)[mask], np.asarray(size)[mask], np.asarray(is_buy)[mask])
@@ -6,4 +6,6 @@ class DataVersionType(Enum):
     MIN_BAR=0
     HOUR_BAR=1
     DAR_BAR=2
+    # raw trades
+    TICK=3
     
@@ -0,0 +1,106 @@
+import os
+import json
+import typing
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from trading_data.atomic import atomic_write_path
+
+
+CUBE_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def get_universe_key(ver_name, asset_type, tickers, start_date=None, end_date=None, fields=CUBE_FIELDS, dtype='float64') -> str:
+    """
+    Key of a universe cube, the tickers are hashed so that any change of the universe builds a new cube.
+    """
+    start_date = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else ''
+    end_date = pd.Timestamp(end_date).strftime('%Y-%m-%d') if end_date is not None else ''
+    universe_hash = hashlib.sha1('\n'.join(tickers).encode()).hexdigest()[:16]
+    return f"{ver_name}_{asset_type}_{universe_hash}_{start_date}_{end_date}_{hashlib.sha1(f'{fields}{dtype}'.encode()).hexdigest()[:8]}"
+
+
+class UniverseCube:
+    """
+    Dense, ts-aligned (time x ticker x field) array of a universe.
+
+    `values[i, j, k]` is `fields[k]` of `tickers[j]` at `ts[i]`, NaN where the ticker has no bar.
+    `valid[i, j]` tells whether the ticker has a bar at `ts[i]`.
+    """
+    def __init__(self, ts: pd.DatetimeIndex, tickers: typing.List[str], fields: typing.List[str], values: np.ndarray, valid: np.ndarray):
+        self.ts = ts
+        self.tickers = tickers
+        self.fields = fields
+        self.values = values
+        self.valid = valid
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def get_field(self, field: str) -> pd.DataFrame:
+        # a (ts x ticker) frame of a single field
+        return pd.DataFrame(self.values[:, :, self.fields.index(field)], index=self.ts, columns=pd.Index(self.tickers, name='ticker'))
+
+    def get_valid(self) -> pd.DataFrame:
+        return pd.DataFrame(self.valid, index=self.ts, columns=pd.Index(self.tickers, name='ticker'))
+
+
+def build_cube(tables: typing.Dict[str, pd.DataFrame], fields: typing.List[str]=CUBE_FIELDS, dtype='float64') -> UniverseCube:
+    """
+    Align the tables of the tickers (with a `ts` column) on the union of their timestamps.
+    """
+    tickers = list(tables)
+    ts_values = [pd.to_datetime(df['ts']).to_numpy(dtype='datetime64[ns]') for df in tables.values()]
+    ts = np.unique(np.concatenate(ts_values)) if len(ts_values) > 0 else np.array([], dtype='datetime64[ns]')
+    values = np.full((len(ts), len(tickers), len(fields)), np.nan, dtype=dtype)
+    valid = np.zeros((len(ts), len(tickers)), dtype=bool)
+    for j, (df, ticker_ts) in enumerate(zip(tables.values(), ts_values)):
+        if len(df) == 0:
+            continue
+        rows = np.searchsorted(ts, ticker_ts)
+        valid[rows, j] = True
+        for k, field in enumerate(fields):
+            if field in df.columns:
+                values[rows, j, k] = df[field].to_numpy(dtype=dtype, na_value=np.nan)
+    return UniverseCube(pd.DatetimeIndex(ts, name='ts'), tickers, list(fields), values, valid)
+
+
+def save_cube(cube_dir: str, key: str, cube: UniverseCube, fingerprint: str):
+    """
+    Persist a cube as `.npy` files next to a json header. The header is written last so that a cube
+    is only visible once all its arrays are complete.
+    """
+    os.makedirs(cube_dir, exist_ok=True)
+    arrays = {
+        'ts': cube.ts.to_numpy(dtype='datetime64[ns]'),
+        'values': cube.values,
+        'valid': cube.valid,
+    }
+    for name, array in arrays.items():
+        with atomic_write_path(os.path.join(cube_dir, f'{key}.{name}.npy')) as tmp_file_path:
+            with open(tmp_file_path, 'wb') as f:
+                np.save(f, array)
+    with atomic_write_path(os.path.join(cube_dir, f'{key}.json')) as tmp_file_path:
+        with open(tmp_file_path, 'w') as f:
+            json.dump({'tickers': cube.tickers, 'fields': cube.fields, 'fingerprint': fingerprint}, f)
+
+
+def load_cube(cube_dir: str, key: str, fingerprint: str=None) -> typing.Optional[UniverseCube]:
+    """
+    Load a persisted cube with memory-mapped arrays, None if it does not exist or its fingerprint is stale.
+    """
+    header_path = os.path.join(cube_dir, f'{key}.json')
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, 'r') as f:
+        header = json.load(f)
+    if fingerprint is not None and header['fingerprint'] != fingerprint:
+        return None
+    try:
+        ts, values, valid = (np.load(os.path.join(cube_dir, f'{key}.{name}.npy'), mmap_mode='r') for name in ['ts', 'values', 'valid'])
+    except FileNotFoundError:
+        return None
+    return UniverseCube(pd.DatetimeIndex(ts, name='ts'), header['tickers'], header['fields'], values, valid)
@@ -0,0 +1,97 @@
+import typing
+
+import pandas as pd
+
+from trading_data.common.date_ranges import get_dates
+
+
+# asset types traded every day, the others are expected on business days only
+CALENDAR_DAY_ASSET_TYPES = ['perp', 'spot', 'crypto']
+PLAN_COLUMNS = ['asset_type', 'ticker', 'start_date', 'end_date', 'n_days', 'reason']
+# days that are still missing this long after an update are recorded as empty upstream (e.g. holidays)
+DEFAULT_SETTLE_DAYS = 3
+
+
+def get_expected_dates(asset_type: str, start_date: str, end_date: str) -> typing.List[str]:
+    if asset_type in CALENDAR_DAY_ASSET_TYPES:
+        return get_dates(start_date, end_date)
+    return [date.strftime('%Y-%m-%d') for date in pd.bdate_range(start_date, end_date)]
+
+
+def get_checked_key(ver_name: str) -> str:
+    # catalog setting of the days known to have no data upstream, {'<asset_type>/<ticker>': [dates]}
+    return f'checked_empty.{ver_name}'
+
+
+def plan_dates(
+        expected_dates: typing.List[str],
+        covered_dates: typing.Set[str],
+        first_date: str=None,
+        last_date: str=None,
+        stale_dates: typing.Set[str]=frozenset(),
+        skipped_dates: typing.Set[str]=frozenset(),
+        fill_head: bool=False,
+    ) -> typing.List[tuple]:
+    """
+    Plan the fetches of a ticker as (start_date, end_date, n_days, reason) ranges of the `expected_dates` that are not
+    covered yet. Consecutive expected dates are fetched as one range.
+
+    Args:
+        first_date/last_date (str, optional): first and last dates of the existing data, which may lie outside
+            of the expected dates. The ticker is new if None.
+        stale_dates (set): covered dates to fetch again, e.g. a day written before it ended.
+        skipped_dates (set): dates known to have no data upstream.
+        fill_head (bool): also fetch the dates before the existing data, otherwise the history is assumed to start there.
+    """
+    reasons = []
+    for date in expected_dates:
+        if date in stale_dates:
+            reason = 'stale'
+        elif date in covered_dates or date in skipped_dates:
+            reason = None
+        elif first_date is None:
+            reason = 'new'
+        elif date < first_date:
+            reason = 'head' if fill_head else None
+        elif date > last_date:
+            reason = 'tail'
+        else:
+            reason = 'gap'
+        reasons.append(reason)
+
+    ranges = []
+    start = None
+    for i, reason in enumerate(reasons + [None]):
+        if reason is not None and start is None:
+            start = i
+        elif reason is None and start is not None:
+            range_reasons = list(dict.fromkeys(reasons[start:i]))
+            ranges.append((expected_dates[start], expected_dates[i - 1], i - start, '+'.join(range_reasons)))
+            start = None
+    return ranges
+
+
+def to_fetch_plan(plan: pd.DataFrame) -> typing.Dict[tuple, typing.List[tuple]]:
+    """
+    Convert a plan frame into the fetch list handed to the data sources, (asset_type, ticker) -> [(start_date, end_date)]
+    with both dates inclusive. Tickers without anything to fetch are left out.
+    """
+    fetch_plan = {}
+    for row in plan.itertuples(index=False):
+        fetch_plan.setdefault((row.asset_type, row.ticker), []).append((row.start_date, row.end_date))
+    return fetch_plan
+
+
+def get_plan_ranges(plan: typing.Optional[dict], asset_type: str, asset: str, start_date: str, end_date: str) -> typing.List[tuple]:
+    # the ranges of an asset to fetch, the whole [start_date, end_date] without a plan
+    if plan is None:
+        return [(start_date, end_date)]
+    return plan.get((asset_type, asset), [])
+
+
+def get_ranges_mask(ts: pd.Series, ranges: typing.List[tuple]) -> pd.Series:
+    # the rows of the days within the (start_date, end_date) ranges, both dates inclusive
+    mask = pd.Series(False, index=ts.index)
+    for start_date, end_date in ranges:
+        mask |= (ts >= pd.Timestamp(start_date)) & (ts < pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    return mask